@@ -0,0 +1,41 @@
+# Lanes per second of the NumPy interpreter against the same shader compiled to Python, by batch size
+# Usage: python benchmarks/bench_compile.py [blocks per shader] [runs]
+
+import sys
+import time
+
+import shadergen
+import dxshd
+from bench_interpreter import shader_inputs
+
+BATCH_SIZES = (16, 256, 4096, 65536)
+
+def lanes_per_second(machine, inputs, count, runs):
+	machine.run(inputs)
+	start = time.time()
+	for i in xrange(runs):
+		machine.run(inputs)
+	elapsed = max(time.time() - start, 1e-6)
+	return elapsed / runs, count * runs / elapsed
+
+def main(argv):
+	blocks = int(argv[1]) if len(argv) > 1 else 16
+	runs = int(argv[2]) if len(argv) > 2 else 5
+	bytecode = shadergen.vertex_shader(blocks)
+	program = dxshd.decode(bytecode)
+	start = time.time()
+	compiled = dxshd.compile_shader(bytecode)
+	print("%d instructions, compiled in %.2f ms" % (len(program.instructions), 1000.0 * (time.time() - start)))
+	start = time.time()
+	dxshd.compile_shader(bytecode)
+	print("cached compile in %.2f ms" % (1000.0 * (time.time() - start)))
+	interpreter = dxshd.Interpreter(program)
+	for count in BATCH_SIZES:
+		inputs = shader_inputs(count)
+		interpreted = lanes_per_second(interpreter, inputs, count, runs)
+		generated = lanes_per_second(compiled, inputs, count, runs)
+		print("batch %6d: interpreter %8.2f ms/run %12.1f lanes/s, compiled %8.2f ms/run %12.1f lanes/s, %.2fx" % (
+			count, 1000.0 * interpreted[0], interpreted[1], 1000.0 * generated[0], generated[1], interpreted[0] / generated[0]))
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,32 @@
+# Control flow, liveness and def-use throughput over a synthetic corpus
+# Usage: python benchmarks/bench_dataflow.py [shader count] [blocks per shader]
+
+import sys
+import time
+
+import shadergen
+import dxshd
+
+def timed(label, count, instructions, work):
+	start = time.time()
+	result = work()
+	elapsed = max(time.time() - start, 1e-6)
+	print("%-10s %8.3fs %10.1f shaders/s %12.1f instructions/s" % (label, elapsed, count / elapsed, instructions / elapsed))
+	return result
+
+def main(argv):
+	count = int(argv[1]) if len(argv) > 1 else 2000
+	blocks = int(argv[2]) if len(argv) > 2 else 16
+	bytecodes = shadergen.corpus(count, blocks)
+	programs = [dxshd.decode(bytecode) for bytecode in bytecodes]
+	instructions = sum([len(program.instructions) for program in programs])
+	print("%d shaders, %d instructions" % (count, instructions))
+	timed("cfg", count, instructions, lambda: [program.control_flow() for program in programs])
+	liveness = timed("liveness", count, instructions, lambda: [dxshd.Liveness(program) for program in programs])
+	timed("def-use", count, instructions, lambda: [dxshd.DefUseChains(program) for program in programs])
+	peak = max([result.peak_pressure()[0] for result in liveness])
+	dead = sum([len(result.dead_writes()) for result in liveness])
+	print("peak temp pressure %d, %d dead writes" % (peak, dead))
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,37 @@
+# Lanes per second of the NumPy interpreter on the synthetic vertex shader, by batch size
+# Usage: python benchmarks/bench_interpreter.py [blocks per shader] [runs]
+
+import sys
+import time
+
+import numpy
+
+import shadergen
+import dxshd
+
+BATCH_SIZES = (64, 1024, 16384, 65536)
+
+def shader_inputs(count):
+	rng = numpy.random.RandomState(1)
+	inputs = {'v0': rng.randn(count, 4), 'v1': rng.randn(count, 4), 'b0': True}
+	for register in xrange(64):
+		inputs['c%d' % register] = rng.randn(4)
+	return inputs
+
+def main(argv):
+	blocks = int(argv[1]) if len(argv) > 1 else 16
+	runs = int(argv[2]) if len(argv) > 2 else 5
+	program = dxshd.decode(shadergen.vertex_shader(blocks))
+	interpreter = dxshd.Interpreter(program)
+	print("%d instructions" % len(program.instructions))
+	for count in BATCH_SIZES:
+		inputs = shader_inputs(count)
+		interpreter.run(inputs)
+		start = time.time()
+		for i in xrange(runs):
+			interpreter.run(inputs)
+		elapsed = max(time.time() - start, 1e-6)
+		print("batch %6d: %8.2f ms/run %12.1f lanes/s" % (count, 1000.0 * elapsed / runs, count * runs / elapsed))
+
+if __name__ == "__main__":
+	main(sys.argv)
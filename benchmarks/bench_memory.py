@@ -0,0 +1,54 @@
+# Memory held by decoded instructions, __slots__ records vs the same data in per-instance dicts
+# Usage: python benchmarks/bench_memory.py [shader count]
+
+import sys
+
+import shadergen
+import dxshd
+
+class DictRecord(object):
+	"""Stand-in with the same attributes kept in a __dict__"""
+	pass
+
+def slot_names(obj):
+	names = []
+	for cls in type(obj).__mro__:
+		names.extend(getattr(cls, '__slots__', ()))
+	return [name for name in names if hasattr(obj, name)]
+
+def record_size(obj, asDict, seen):
+	"""Size of obj and the decoder records it references"""
+	if obj is None or id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	if isinstance(obj, tuple):
+		return sys.getsizeof(obj) + sum([record_size(item, asDict, seen) for item in obj])
+	if not isinstance(obj, (dxshd.Instruction, dxshd.InstructionToken, dxshd.ParameterToken)):
+		return 0
+	names = slot_names(obj)
+	if asDict:
+		record = DictRecord()
+		for name in names:
+			setattr(record, name, getattr(obj, name))
+		size = sys.getsizeof(record) + sys.getsizeof(record.__dict__)
+	else:
+		size = sys.getsizeof(obj)
+	for name in names:
+		size += record_size(getattr(obj, name), asDict, seen)
+	return size
+
+def main(argv):
+	count = int(argv[1]) if len(argv) > 1 else 200
+	instructions = []
+	for bytecode in shadergen.corpus(count):
+		instructions.extend(dxshd.decode(bytecode).instructions)
+	slotted = sum([record_size(inst, False, set()) for inst in instructions])
+	dicts = sum([record_size(inst, True, set()) for inst in instructions])
+	n = float(len(instructions))
+	print("%d instructions from %d shaders" % (len(instructions), count))
+	print("__dict__ records: %8.1f bytes/instruction" % (dicts / n))
+	print("__slots__ records: %7.1f bytes/instruction" % (slotted / n))
+	print("saved: %.1f%%" % (100.0 * (dicts - slotted) / dicts))
+
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,126 @@
+# Listing throughput: one write per line, as disassemble_stream used to do, against ListingWriter chunks
+# and a single write of the whole listing, into a buffered file, a pipe and a socket.
+# Pipe and socket writes go straight to the descriptor, the way a raw stdout or a network client does,
+# so there every line written is a system call. The best of several runs is reported
+# Usage: python benchmarks/bench_output.py [shader count] [blocks per shader] [runs]
+
+import io
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+import shadergen
+import dxshd
+
+def per_line(source, out):
+	"""The old disassemble_stream loop, a print statement is a write for the text and one for the newline"""
+	ctx = dxshd.DisassemblyContext()
+	for inst in dxshd.iter_instructions(source, ctx):
+		if inst.offset == 4:
+			out.write(ctx.version_string())
+			out.write("\n")
+		out.write(dxshd.instruction_text(inst, ctx))
+		out.write("\n")
+
+def chunked(source, out):
+	dxshd.disassemble_stream(source, False, out)
+
+def whole(source, out):
+	dxshd.disassemble_stream(source, False, out, None)
+
+RENDERERS = (("per line", per_line), ("chunked", chunked), ("whole", whole))
+
+def as_bytes(text):
+	if isinstance(text, bytes):
+		return text
+	return text.encode('ascii')
+
+class FileTarget(object):
+	"""Buffered text file, the writes are gathered by the file object before they reach the disk"""
+	def __init__(self):
+		handle, self.path = tempfile.mkstemp()
+		os.close(handle)
+		self.out = open(self.path, 'w')
+	def close(self):
+		self.out.close()
+		size = os.path.getsize(self.path)
+		os.remove(self.path)
+		return size
+
+class Drain(threading.Thread):
+	"""Reads and counts everything sent to the other end of a pipe or socket"""
+	def __init__(self, receive):
+		threading.Thread.__init__(self)
+		self.receive = receive
+		self.size = 0
+	def run(self):
+		while True:
+			data = self.receive(1 << 16)
+			if not data:
+				return
+			self.size += len(data)
+
+class PipeTarget(object):
+	"""Unbuffered pipe, every write is an os.write"""
+	def __init__(self):
+		self.read_fd, self.write_fd = os.pipe()
+		self.drain = Drain(lambda size: os.read(self.read_fd, size))
+		self.drain.start()
+		self.out = self
+	def write(self, text):
+		data = as_bytes(text)
+		while data:
+			data = data[os.write(self.write_fd, data):]
+	def close(self):
+		os.close(self.write_fd)
+		self.drain.join()
+		os.close(self.read_fd)
+		return self.drain.size
+
+class SocketTarget(object):
+	"""Connected socket, every write is a sendall"""
+	def __init__(self):
+		self.sender, self.receiver = socket.socketpair()
+		self.drain = Drain(self.receiver.recv)
+		self.drain.start()
+		self.out = self
+	def write(self, text):
+		self.sender.sendall(as_bytes(text))
+	def close(self):
+		self.sender.shutdown(socket.SHUT_WR)
+		self.drain.join()
+		self.sender.close()
+		self.receiver.close()
+		return self.drain.size
+
+TARGETS = [("file", FileTarget), ("pipe", PipeTarget)]
+if hasattr(socket, 'socketpair'):
+	TARGETS.append(("socket", SocketTarget))
+
+def timed(bytecodes, render, makeTarget):
+	"""(seconds, bytes written) of rendering every shader into a new target"""
+	target = makeTarget()
+	start = time.time()
+	try:
+		for bytecode in bytecodes:
+			render(io.BytesIO(bytecode), target.out)
+	finally:
+		elapsed = max(time.time() - start, 1e-6)
+		size = target.close()
+	return elapsed, size
+
+def main(argv):
+	count = int(argv[1]) if len(argv) > 1 else 1000
+	blocks = int(argv[2]) if len(argv) > 2 else 16
+	runs = int(argv[3]) if len(argv) > 3 else 3
+	bytecodes = shadergen.corpus(count, blocks)
+	for targetName, makeTarget in TARGETS:
+		for label, render in RENDERERS:
+			elapsed, size = min([timed(bytecodes, render, makeTarget) for run in range(runs)])
+			print("%-6s %-9s %8.3fs %8.1f shaders/s %8.2f MB/s" % (targetName, label, elapsed, len(bytecodes) / elapsed, size / elapsed / 1e6))
+
+if __name__ == "__main__":
+	main(sys.argv)
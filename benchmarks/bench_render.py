@@ -0,0 +1,119 @@
+# Listing lines per second with the operand text tables, against the per-operand string building they replaced
+# Usage: python benchmarks/bench_render.py [shader count] [blocks per shader]
+
+import sys
+import time
+
+import shadergen
+import dxshd
+
+def legacy_register_text(param, ctx):
+	reg_str = ctx.register_mnemonics[param.register_type]
+	if param.is_relative:
+		if param.relative_param is None:
+			return "!ERR!"
+		out = reg_str
+		if param.register > 0:
+			out += "%d" % param.register
+		out += "["
+		if param.relative_param.register_type == dxshd.D3DSPR_LOOP:
+			out += "aL%s" % (param.relative_param.swizzle_text())
+		else:
+			out += "a%d%s" % (param.relative_param.register, param.relative_param.swizzle_text())
+		return out + "]"
+	if param.register_type == dxshd.D3DSPR_LOOP:
+		return "aL%s" % param.swizzle_text()
+	elif param.register_type == dxshd.D3DSPR_DEPTHOUT:
+		return "oDepth%s" % param.swizzle_text()
+	return "%s%d%s" % (reg_str, param.register, param.swizzle_text())
+
+def legacy_mod_str(dst):
+	text = ''
+	if (dst.result_modifier & 0x1) == 0x1:
+		text += '_sat'
+	if (dst.result_modifier & 0x2) == 0x2:
+		text += '_pp'
+	if (dst.result_modifier & 0x4) == 0x4:
+		text += '_centroid'
+	return text
+
+def legacy_write_mask_text(dst):
+	if (dst.write_mask == 15) and not dst.force_swizzle:
+		return ''
+	mask = '.'
+	for bit, component in ((0x1, 'x'), (0x2, 'y'), (0x4, 'z'), (0x8, 'w')):
+		if dst.write_mask & bit == bit:
+			mask += component
+	return mask
+
+def legacy_component_text(val):
+	if val == 0:
+		return 'x'
+	if val == 1:
+		return 'y'
+	if val == 2:
+		return 'z'
+	if val == 3:
+		return 'w'
+
+def legacy_swizzle_text(src):
+	if (src.read_mask == 0xE4) and not src.force_swizzle:
+		return ''
+	last_val = (src.read_mask >> 6) & 0x3
+	mask = legacy_component_text(last_val)
+	ch = 0
+	for i in xrange(3):
+		val = (src.read_mask >> (4 - 2*i)) & 0x3
+		if (val != last_val) or ch:
+			mask = legacy_component_text(val) + mask
+			ch = 1
+	return '.' + mask
+
+def legacy_source_text(src, ctx):
+	return dxshd.SOURCE_MOD_FORMAT[src.source_modifier] % legacy_register_text(src, ctx)
+
+# (class, method name, stand-in) for the string building the tables replaced
+LEGACY_METHODS = [
+	(dxshd.ParameterToken, 'to_string', legacy_register_text),
+	(dxshd.DestinationParameterToken, 'mod_str', legacy_mod_str),
+	(dxshd.DestinationParameterToken, 'swizzle_text', legacy_write_mask_text),
+	(dxshd.SourceParameterToken, 'swizzle_text', legacy_swizzle_text),
+	(dxshd.SourceParameterToken, 'to_string', legacy_source_text)
+]
+
+def render(programs):
+	lines = 0
+	for program in programs:
+		lines += program.to_text().count('\n')
+	return lines
+
+def timed(label, programs, runs):
+	render(programs)
+	start = time.time()
+	for i in xrange(runs):
+		lines = render(programs)
+	elapsed = max(time.time() - start, 1e-6)
+	print("%-8s %8.3fs %12.1f lines/s" % (label, elapsed, lines * runs / elapsed))
+	return lines * runs / elapsed
+
+def main(argv):
+	count = int(argv[1]) if len(argv) > 1 else 500
+	blocks = int(argv[2]) if len(argv) > 2 else 16
+	runs = 3
+	programs = [dxshd.decode(bytecode) for bytecode in shadergen.corpus(count, blocks)]
+	saved = [(cls, name, cls.__dict__[name]) for cls, name, method in LEGACY_METHODS]
+	for cls, name, method in LEGACY_METHODS:
+		setattr(cls, name, method)
+	try:
+		legacy = [program.to_text() for program in programs]
+		before = timed("before", programs, runs)
+	finally:
+		for cls, name, method in saved:
+			setattr(cls, name, method)
+	if legacy != [program.to_text() for program in programs]:
+		print("listings differ")
+	after = timed("after", programs, runs)
+	print("%.2fx" % (after / before))
+
+if __name__ == "__main__":
+	main(sys.argv)
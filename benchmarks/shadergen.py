@@ -0,0 +1,113 @@
+# Synthetic shader bytecode for the benchmarks
+# There is no shader compiler here, so the tokens are put together by hand
+
+import os
+import sys
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dxshd
+
+def dst(register, registerType, writeMask=0xf, modifier=0, relative=0):
+	return (0x80000000 | register | ((registerType & 0x7) << 28) | ((registerType >> 3) << 11) |
+		(relative << 13) | (writeMask << 16) | (modifier << 20))
+
+def src(register, registerType, swizzle=0xE4, modifier=0, relative=0):
+	return (0x80000000 | register | ((registerType & 0x7) << 28) | ((registerType >> 3) << 11) |
+		(relative << 13) | (swizzle << 16) | (modifier << 24))
+
+def inst(op, *params, **kw):
+	token = op | (len(params) << 24) | (kw.get('flags', 0) << 16) | (kw.get('predicated', 0) << 28)
+	return [token] + list(params)
+
+def float_token(value):
+	return struct.unpack('<I', struct.pack('<f', value))[0]
+
+def pack(tokens):
+	return struct.pack('<%dI' % len(tokens), *tokens)
+
+def constant_table(constants, target, creator='shadergen'):
+	"""CTAB comment block for [(name, register set, register index, register count, (class, type, rows, columns, elements))]"""
+	header = 28
+	infoOffset = header
+	typeOffset = infoOffset + 20 * len(constants)
+	stringOffset = typeOffset + 16 * len(constants)
+	strings = b''
+	def add_string(text):
+		offset = stringOffset + len(strings)
+		return offset, strings + text.encode('ascii') + b'\0'
+	creatorOffset, strings = add_string(creator)
+	targetOffset, strings = add_string(target)
+	infos = b''
+	types = b''
+	for i, (name, registerSet, registerIndex, registerCount, typeInfo) in enumerate(constants):
+		nameOffset, strings = add_string(name)
+		infos += struct.pack('<IHHHHII', nameOffset, registerSet, registerIndex, registerCount, 0, typeOffset + 16 * i, 0)
+		types += struct.pack('<HHHHHHI', typeInfo[0], typeInfo[1], typeInfo[2], typeInfo[3], typeInfo[4], 0, 0)
+	data = struct.pack('<7I', header, creatorOffset, 0xFFFE0300, len(constants), infoOffset, 0, targetOffset) + infos + types + strings
+	data += b'\0' * (-len(data) % 4)
+	words = [dxshd.FOURCC_CTAB] + list(struct.unpack('<%dI' % (len(data) // 4), data))
+	return [dxshd.D3DSIO_COMMENT | (len(words) << 16)] + words
+
+def vertex_shader(blocks=16):
+	"""vs_3_0 program with dcl/def headers, relative addressing, flow control and a subroutine"""
+	t = [0xFFFE0300]
+	t += constant_table([
+		('WorldViewProj', dxshd.D3DXRS_FLOAT4, 0, 4, (3, 3, 4, 4, 1)),
+		('Bones', dxshd.D3DXRS_FLOAT4, 4, 60, (2, 3, 3, 4, 20)),
+		('LightCount', dxshd.D3DXRS_INT4, 0, 1, (0, 2, 1, 1, 1)),
+		('Skinned', dxshd.D3DXRS_BOOL, 0, 1, (0, 1, 1, 1, 1))
+	], 'vs_3_0')
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_NORMAL, dst(1, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_OUTPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_TEXCOORD, dst(1, dxshd.D3DSPR_OUTPUT, 0x3))
+	t += inst(dxshd.D3DSIO_DEF, dst(90, dxshd.D3DSPR_CONST), float_token(1.0), float_token(0.5), float_token(-2.0), float_token(0.0))
+	t += inst(dxshd.D3DSIO_DEFI, dst(0, dxshd.D3DSPR_CONSTINT), 4, 0, 1, 0)
+	for i in range(blocks):
+		t += inst(dxshd.D3DSIO_DP4, dst(0, dxshd.D3DSPR_TEMP, 0x1), src(0, dxshd.D3DSPR_INPUT), src(0, dxshd.D3DSPR_CONST))
+		t += inst(dxshd.D3DSIO_DP4, dst(0, dxshd.D3DSPR_TEMP, 0x2), src(0, dxshd.D3DSPR_INPUT), src(1, dxshd.D3DSPR_CONST))
+		t += inst(dxshd.D3DSIO_MOVA, dst(0, dxshd.D3DSPR_ADDR, 0x1), src(0, dxshd.D3DSPR_TEMP, 0x00))
+		t += inst(dxshd.D3DSIO_MAD, dst(1, dxshd.D3DSPR_TEMP, 0xf, 1), src(0, dxshd.D3DSPR_TEMP, 0x00), src(90, dxshd.D3DSPR_CONST, 0x55), src(1, dxshd.D3DSPR_INPUT, 0xE4, 1))
+		t += inst(dxshd.D3DSIO_MOV, dst(2, dxshd.D3DSPR_TEMP), src(4, dxshd.D3DSPR_CONST, 0xE4, 0, 1), src(0, dxshd.D3DSPR_ADDR, 0x00))
+		t += inst(dxshd.D3DSIO_DP3, dst(1, dxshd.D3DSPR_OUTPUT, 0x3), src(1, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_TEMP, 0x1B))
+	t += inst(dxshd.D3DSIO_MOV, dst(3, dxshd.D3DSPR_TEMP), src(90, dxshd.D3DSPR_CONST, 0xFF))
+	t += inst(dxshd.D3DSIO_LOOP, src(0, dxshd.D3DSPR_LOOP), src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_ADD, dst(3, dxshd.D3DSPR_TEMP), src(3, dxshd.D3DSPR_TEMP), src(10, dxshd.D3DSPR_CONST, 0xE4, 0, 1), src(0, dxshd.D3DSPR_LOOP, 0x00))
+	t += inst(dxshd.D3DSIO_ENDLOOP)
+	t += inst(dxshd.D3DSIO_IF, src(0, dxshd.D3DSPR_CONSTBOOL))
+	t += inst(dxshd.D3DSIO_MUL, dst(3, dxshd.D3DSPR_TEMP), src(3, dxshd.D3DSPR_TEMP), src(90, dxshd.D3DSPR_CONST, 0x55))
+	t += inst(dxshd.D3DSIO_ELSE)
+	t += inst(dxshd.D3DSIO_ABS, dst(3, dxshd.D3DSPR_TEMP), src(3, dxshd.D3DSPR_TEMP))
+	t += inst(dxshd.D3DSIO_ENDIF)
+	t += inst(dxshd.D3DSIO_CALL, src(0, dxshd.D3DSPR_LABEL))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_OUTPUT), src(3, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_RET)
+	t += inst(dxshd.D3DSIO_LABEL, src(0, dxshd.D3DSPR_LABEL))
+	t += inst(dxshd.D3DSIO_MAX, dst(3, dxshd.D3DSPR_TEMP, 0x7), src(3, dxshd.D3DSPR_TEMP), src(90, dxshd.D3DSPR_CONST, 0xFF))
+	t += inst(dxshd.D3DSIO_RET)
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def pixel_shader(blocks=16):
+	"""ps_3_0 program with texture sampling, cmp and predication"""
+	t = [0xFFFF0300]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_TEXCOORD, dst(0, dxshd.D3DSPR_INPUT, 0x3))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DSTT_2D << 27), dst(0, dxshd.D3DSPR_SAMPLER))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DSTT_CUBE << 27), dst(1, dxshd.D3DSPR_SAMPLER))
+	t += inst(dxshd.D3DSIO_DEF, dst(0, dxshd.D3DSPR_CONST), float_token(0.25), float_token(0.5), float_token(0.75), float_token(1.0))
+	t += inst(dxshd.D3DSIO_MOV, dst(2, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST))
+	for i in range(blocks):
+		t += inst(dxshd.D3DSIO_TEX, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(0, dxshd.D3DSPR_SAMPLER))
+		t += inst(dxshd.D3DSIO_TEXLDL, dst(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_SAMPLER))
+		t += inst(dxshd.D3DSIO_CMP, dst(2, dxshd.D3DSPR_TEMP, 0x7), src(0, dxshd.D3DSPR_TEMP, 0xE4, 1), src(1, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_TEMP))
+		t += inst(dxshd.D3DSIO_SETP, dst(0, dxshd.D3DSPR_PREDICATE, 0x1), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP), flags=1)
+		t += inst(dxshd.D3DSIO_ADD, dst(2, dxshd.D3DSPR_TEMP, 0x8), src(0, dxshd.D3DSPR_PREDICATE, 0x00), src(2, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0xFF), predicated=1)
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_COLOROUT, 0xf, 1), src(2, dxshd.D3DSPR_TEMP))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def corpus(count, blocks=16):
+	"""Alternating vertex and pixel shaders"""
+	return [(vertex_shader if (i % 2) == 0 else pixel_shader)(blocks + (i % 7)) for i in range(count)]
@@ -7,8 +7,30 @@
 # The main goal is to turn compiled bytecode into something more understandable
 # The output isn't necessarily meant to be able to be recompiled as-is
 
+import os
+import re
 import sys
+import copy
+import mmap
+import time
 import struct
+import hashlib
+import json
+import argparse
+import multiprocessing
+import cPickle as pickle
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
 
 # opcodes for pixel and vertex shaders
 D3DSIO_NOP          =  0
@@ -98,91 +120,95 @@ D3DSIO_PHASE        = 0xFFFD
 D3DSIO_COMMENT      = 0xFFFE
 D3DSIO_END          = 0XFFFF
 
+# Opcode table
+# 'op' is the mnemonic, 'dst' marks a destination operand and 'src' is the usual source count.
+# The generic Instruction reads its sources up to the length field, so 'src' only documents the signature
+# Opcodes carrying extra literal DWORDs (dcl, def*) have a 'gen' handler instead
 D3DSIO = {
 	D3DSIO_NOP: {'op':'nop'},
-	D3DSIO_MOV: {'op':'mov', 'gen':lambda tok: MovInstruction(tok)},
-	D3DSIO_ADD: {'op':'add', 'gen':lambda tok: AddInstruction(tok)},
-	D3DSIO_SUB: {'op':'sub', 'gen':lambda tok: SubInstruction(tok)},
-	D3DSIO_MAD: {'op':'mad', 'gen':lambda tok: MadInstruction(tok)},
-	D3DSIO_MUL: {'op':'mul', 'gen':lambda tok: MulInstruction(tok)},
-	D3DSIO_RCP: {'op':'rcp', 'gen':lambda tok: RcpInstruction(tok)},
-	D3DSIO_RSQ: {'op':'rsq', 'gen':lambda tok: RsqInstruction(tok)},
-	D3DSIO_DP3: {'op':'dp3', 'gen':lambda tok: Dp3Instruction(tok)},
-	D3DSIO_DP4: {'op':'dp4', 'gen':lambda tok: Dp4Instruction(tok)},
-	D3DSIO_MIN: {'op':'min', 'gen':lambda tok: MinInstruction(tok)},
-	D3DSIO_MAX: {'op':'max', 'gen':lambda tok: MaxInstruction(tok)},
-	D3DSIO_SLT: {'op':'slt', 'gen':lambda tok: SltInstruction(tok)},
-	D3DSIO_SGE: {'op':'sge', 'gen':lambda tok: SgeInstruction(tok)},
-	D3DSIO_EXP: {'op':'exp', 'gen':lambda tok: ExpInstruction(tok)},
-	D3DSIO_LOG: {'op':'log', 'gen':lambda tok: LogInstruction(tok)},
-	D3DSIO_LIT: {'op':'lit', 'gen':lambda tok: LitInstruction(tok)},
-	D3DSIO_DST: {'op':'dst', 'gen':lambda tok: DstInstruction(tok)},
-	D3DSIO_LRP: {'op':'lrp', 'gen':lambda tok: LrpInstruction(tok)},
-	D3DSIO_FRC: {'op':'frc', 'gen':lambda tok: FrcInstruction(tok)},
-	D3DSIO_M4x4: {'op':'m4x4', 'gen':lambda tok: M4x4Instruction(tok)},
-	D3DSIO_M4x3: {'op':'m4x3', 'gen':lambda tok: M4x3Instruction(tok)},
-	D3DSIO_M3x4: {'op':'m3x4', 'gen':lambda tok: M3x4Instruction(tok)},
-	D3DSIO_M3x3: {'op':'m3x3', 'gen':lambda tok: M3x3Instruction(tok)},
-	D3DSIO_M3x2: {'op':'m3x2', 'gen':lambda tok: M3x2Instruction(tok)},
-	D3DSIO_CALL: {'op':'call', 'gen':lambda tok: CallInstruction(tok)},
-	D3DSIO_CALLNZ: {'op':'callnz', 'gen':lambda tok: CallNzInstruction(tok)},
-	D3DSIO_LOOP: {'op':'loop', 'gen':lambda tok: LoopInstruction(tok)},
+	D3DSIO_MOV: {'op':'mov', 'dst':True, 'src':1},
+	D3DSIO_ADD: {'op':'add', 'dst':True, 'src':2},
+	D3DSIO_SUB: {'op':'sub', 'dst':True, 'src':2},
+	D3DSIO_MAD: {'op':'mad', 'dst':True, 'src':3},
+	D3DSIO_MUL: {'op':'mul', 'dst':True, 'src':2},
+	D3DSIO_RCP: {'op':'rcp', 'dst':True, 'src':1},
+	D3DSIO_RSQ: {'op':'rsq', 'dst':True, 'src':1},
+	D3DSIO_DP3: {'op':'dp3', 'dst':True, 'src':2},
+	D3DSIO_DP4: {'op':'dp4', 'dst':True, 'src':2},
+	D3DSIO_MIN: {'op':'min', 'dst':True, 'src':2},
+	D3DSIO_MAX: {'op':'max', 'dst':True, 'src':2},
+	D3DSIO_SLT: {'op':'slt', 'dst':True, 'src':2},
+	D3DSIO_SGE: {'op':'sge', 'dst':True, 'src':2},
+	D3DSIO_EXP: {'op':'exp', 'dst':True, 'src':1},
+	D3DSIO_LOG: {'op':'log', 'dst':True, 'src':1},
+	D3DSIO_LIT: {'op':'lit', 'dst':True, 'src':1},
+	D3DSIO_DST: {'op':'dst', 'dst':True, 'src':2},
+	D3DSIO_LRP: {'op':'lrp', 'dst':True, 'src':3},
+	D3DSIO_FRC: {'op':'frc', 'dst':True, 'src':1},
+	D3DSIO_M4x4: {'op':'m4x4', 'dst':True, 'src':2},
+	D3DSIO_M4x3: {'op':'m4x3', 'dst':True, 'src':2},
+	D3DSIO_M3x4: {'op':'m3x4', 'dst':True, 'src':2},
+	D3DSIO_M3x3: {'op':'m3x3', 'dst':True, 'src':2},
+	D3DSIO_M3x2: {'op':'m3x2', 'dst':True, 'src':2},
+	D3DSIO_CALL: {'op':'call', 'src':1},
+	D3DSIO_CALLNZ: {'op':'callnz', 'src':2},
+	D3DSIO_LOOP: {'op':'loop', 'src':2},
 	D3DSIO_RET: {'op':'ret'},
 	D3DSIO_ENDLOOP: {'op':'endloop'},
-	D3DSIO_LABEL: {'op':'label', 'gen':lambda tok: LabelInstruction(tok)},
+	D3DSIO_LABEL: {'op':'label', 'src':1},
 	D3DSIO_DCL: {'op':'dcl', 'gen':lambda tok: DclInstruction(tok)},
-	D3DSIO_POW: {'op':'pow', 'gen':lambda tok: PowInstruction(tok)},
-	D3DSIO_CRS: {'op':'crs', 'gen':lambda tok: CrsInstruction(tok)},
-	D3DSIO_SGN: {'op':'sgn', 'gen':lambda tok: SgnInstruction(tok)},
-	D3DSIO_ABS: {'op':'abs', 'gen':lambda tok: AbsInstruction(tok)},
-	D3DSIO_NRM: {'op':'nrm', 'gen':lambda tok: NrmInstruction(tok)},
-	D3DSIO_SINCOS: {'op':'sincos', 'gen':lambda tok: SinCosInstruction(tok)},
-	D3DSIO_REP: {'op':'rep', 'gen':lambda tok: RepInstruction(tok)},
+	D3DSIO_POW: {'op':'pow', 'dst':True, 'src':2},
+	D3DSIO_CRS: {'op':'crs', 'dst':True, 'src':2},
+	D3DSIO_SGN: {'op':'sgn', 'dst':True, 'src':3},
+	D3DSIO_ABS: {'op':'abs', 'dst':True, 'src':1},
+	D3DSIO_NRM: {'op':'nrm', 'dst':True, 'src':1},
+	D3DSIO_SINCOS: {'op':'sincos', 'dst':True, 'src':1},
+	D3DSIO_REP: {'op':'rep', 'src':1},
 	D3DSIO_ENDREP: {'op':'endrep'},
-	D3DSIO_IF: {'op':'if', 'gen':lambda tok: IfInstruction(tok)},
-	D3DSIO_IFC: {'op':'ifc', 'gen':lambda tok: IfCompInstruction(tok)},
+	D3DSIO_IF: {'op':'if', 'src':1},
+	D3DSIO_IFC: {'op':'ifc', 'src':2},
 	D3DSIO_ELSE: {'op':'else'},
 	D3DSIO_ENDIF: {'op':'endif'},
 	D3DSIO_BREAK: {'op':'break'},
-	D3DSIO_BREAKC: {'op':'breakc', 'gen':lambda tok: BreakCInstruction(tok)},
-	D3DSIO_MOVA: {'op':'mova', 'gen':lambda tok: MovaInstruction(tok)},
+	D3DSIO_BREAKC: {'op':'breakc', 'src':2},
+	D3DSIO_MOVA: {'op':'mova', 'dst':True, 'src':1},
 	D3DSIO_DEFB: {'op':'defb', 'gen':lambda tok: DefBInstruction(tok)},
 	D3DSIO_DEFI: {'op':'defi', 'gen':lambda tok: DefIInstruction(tok)},
-	D3DSIO_TEXCOORD: {'op':'texcoord', 'gen':lambda tok: TexCoordInstruction(tok)},
-	D3DSIO_TEXKILL: {'op':'texkill', 'gen':lambda tok: TexKillInstruction(tok)},
-	D3DSIO_TEX: {'op':'tex', 'gen':lambda tok: TexInstruction(tok)},
-	D3DSIO_TEXBEM: {'op':'texbem', 'gen':lambda tok: TexBemInstruction(tok)},
-	D3DSIO_TEXBEML: {'op':'texbeml', 'gen':lambda tok: TexBemlInstruction(tok)},
-	D3DSIO_TEXREG2AR: {'op':'texreg2ar', 'gen':lambda tok: TexReg2ARInstruction(tok)},
-	D3DSIO_TEXREG2GB: {'op':'texreg2gb', 'gen':lambda tok: TexReg2GBInstruction(tok)},
-	D3DSIO_TEXM3x2PAD: {'op':'texm3x2pad', 'gen':lambda tok: TexM3x2PadInstruction(tok)},
-	D3DSIO_TEXM3x2TEX: {'op':'texm3x2tex', 'gen':lambda tok: TexM3x2TexInstruction(tok)},
-	D3DSIO_TEXM3x3PAD: {'op':'texm3x3pad', 'gen':lambda tok: TexM3x3PadInstruction(tok)},
-	D3DSIO_TEXM3x3TEX: {'op':'texm3x3tex', 'gen':lambda tok: TexM3x3TexInstruction(tok)},
+	D3DSIO_TEXCOORD: {'op':'texcoord', 'dst':True},
+	D3DSIO_TEXKILL: {'op':'texkill', 'dst':True},
+	D3DSIO_TEX: {'op':'tex', 'dst':True, 'src':2},
+	D3DSIO_TEXBEM: {'op':'texbem', 'dst':True, 'src':1},
+	D3DSIO_TEXBEML: {'op':'texbeml', 'dst':True, 'src':1},
+	D3DSIO_TEXREG2AR: {'op':'texreg2ar', 'dst':True, 'src':1},
+	D3DSIO_TEXREG2GB: {'op':'texreg2gb', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x2PAD: {'op':'texm3x2pad', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x2TEX: {'op':'texm3x2tex', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x3PAD: {'op':'texm3x3pad', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x3TEX: {'op':'texm3x3tex', 'dst':True, 'src':1},
 	D3DSIO_TEXM3x3DIFF: {'op':'texm3x3diff'},
-	D3DSIO_TEXM3x3SPEC: {'op':'texm3x3spec', 'gen':lambda tok: TexM3x3SpecInstruction(tok)},
-	D3DSIO_TEXM3x3VSPEC: {'op':'texm3x3vspec', 'gen':lambda tok: TexM3x3VSpecInstruction(tok)},
-	D3DSIO_EXPP: {'op':'expp', 'gen':lambda tok: ExppInstruction(tok)},
-	D3DSIO_LOGP: {'op':'logp', 'gen':lambda tok: LogpInstruction(tok)},
-	D3DSIO_CND: {'op':'cnd', 'gen':lambda tok: CndInstruction(tok)},
+	D3DSIO_TEXM3x3SPEC: {'op':'texm3x3spec', 'dst':True, 'src':2},
+	D3DSIO_TEXM3x3VSPEC: {'op':'texm3x3vspec', 'dst':True, 'src':1},
+	D3DSIO_EXPP: {'op':'expp', 'dst':True, 'src':1},
+	D3DSIO_LOGP: {'op':'logp', 'dst':True, 'src':1},
+	D3DSIO_CND: {'op':'cnd', 'dst':True, 'src':3},
 	D3DSIO_DEF: {'op':'def', 'gen':lambda tok: DefInstruction(tok)},
-	D3DSIO_TEXREG2RGB: {'op':'texreg2rgb', 'gen':lambda tok: TexReg2RGBInstruction(tok)},
-	D3DSIO_TEXDP3TEX: {'op':'texdp3tex', 'gen':lambda tok: TexDp3TexInstruction(tok)},
-	D3DSIO_TEXM3x2DEPTH: {'op':'texm3x2depth', 'gen':lambda tok: TexM3x2DepthInstruction(tok)},
-	D3DSIO_TEXDP3: {'op':'texdp3', 'gen':lambda tok: TexDp3Instruction(tok)},
-	D3DSIO_TEXM3x3: {'op':'texm3x3', 'gen':lambda tok: TexM3x3Instruction(tok)},
-	D3DSIO_TEXDEPTH: {'op':'texdepth', 'gen':lambda tok: TexDepthInstruction(tok)},
-	D3DSIO_CMP: {'op':'cmp', 'gen':lambda tok: CmpInstruction(tok)},
-	D3DSIO_BEM: {'op':'bem', 'gen':lambda tok: BemInstruction(tok)},
-	D3DSIO_DP2ADD: {'op':'dp2add', 'gen':lambda tok: Dp2AddInstruction(tok)},
-	D3DSIO_DSX: {'op':'dsx', 'gen':lambda tok: DsxInstruction(tok)},
-	D3DSIO_DSY: {'op':'dsy', 'gen':lambda tok: DsyInstruction(tok)},
-	D3DSIO_TEXLDD: {'op':'texldd', 'gen':lambda tok: TexLddInstruction(tok)},
-	D3DSIO_SETP: {'op':'setp', 'gen':lambda tok: SetpInstruction(tok)},
-	D3DSIO_TEXLDL: {'op':'texldl', 'gen':lambda tok: TexLdlInstruction(tok)},
-	D3DSIO_BREAKP: {'op':'breakp', 'gen':lambda tok: BreakPInstruction(tok)},
+	D3DSIO_TEXREG2RGB: {'op':'texreg2rgb', 'dst':True, 'src':1},
+	D3DSIO_TEXDP3TEX: {'op':'texdp3tex', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x2DEPTH: {'op':'texm3x2depth', 'dst':True, 'src':1},
+	D3DSIO_TEXDP3: {'op':'texdp3', 'dst':True, 'src':1},
+	D3DSIO_TEXM3x3: {'op':'texm3x3', 'dst':True, 'src':1},
+	D3DSIO_TEXDEPTH: {'op':'texdepth', 'dst':True},
+	D3DSIO_CMP: {'op':'cmp', 'dst':True, 'src':3},
+	D3DSIO_BEM: {'op':'bem', 'dst':True, 'src':2},
+	D3DSIO_DP2ADD: {'op':'dp2add', 'dst':True, 'src':3},
+	D3DSIO_DSX: {'op':'dsx', 'dst':True, 'src':1},
+	D3DSIO_DSY: {'op':'dsy', 'dst':True, 'src':1},
+	D3DSIO_TEXLDD: {'op':'texldd', 'dst':True, 'src':4},
+	D3DSIO_SETP: {'op':'setp', 'dst':True, 'src':2},
+	D3DSIO_TEXLDL: {'op':'texldl', 'dst':True, 'src':2},
+	D3DSIO_BREAKP: {'op':'breakp', 'src':1},
 	D3DSIO_PHASE: {'op':'phase'},
-	D3DSIO_COMMENT: {'op':'comment'},
+	D3DSIO_COMMENT: {'op':'comment', 'gen':lambda tok: CommentInstruction(tok)},
 	D3DSIO_END: {'op':'end'}
 }
 
@@ -274,18 +300,76 @@ SOURCE_MOD_FORMAT = {
 	12: '-abs(%s)',
 	13: 'NOT %s'
 }
+# D3DXREGISTER_SET
+D3DXRS_BOOL = 0
+D3DXRS_INT4 = 1
+D3DXRS_FLOAT4 = 2
+D3DXRS_SAMPLER = 3
+
+D3DXRS = {
+	D3DXRS_BOOL: {'text':'b'},
+	D3DXRS_INT4: {'text':'i'},
+	D3DXRS_FLOAT4: {'text':'c'},
+	D3DXRS_SAMPLER: {'text':'s'}
+}
+
+# Register set used by the constant table for each register type
+REGISTER_SET_LOOKUP = {
+	D3DSPR_CONST: D3DXRS_FLOAT4,
+	D3DSPR_CONST2: D3DXRS_FLOAT4,
+	D3DSPR_CONST3: D3DXRS_FLOAT4,
+	D3DSPR_CONST4: D3DXRS_FLOAT4,
+	D3DSPR_CONSTINT: D3DXRS_INT4,
+	D3DSPR_CONSTBOOL: D3DXRS_BOOL,
+	D3DSPR_SAMPLER: D3DXRS_SAMPLER
+}
+
+# D3DXPARAMETER_TYPE names, the ones HLSL puts in constant tables
+D3DXPT = {
+	0: 'void',
+	1: 'bool',
+	2: 'int',
+	3: 'float',
+	4: 'string',
+	5: 'texture',
+	6: 'texture1D',
+	7: 'texture2D',
+	8: 'texture3D',
+	9: 'textureCUBE',
+	10: 'sampler',
+	11: 'sampler1D',
+	12: 'sampler2D',
+	13: 'sampler3D',
+	14: 'samplerCUBE'
+}
+
+FOURCC_CTAB = 0x42415443
+
 SHADERTYPE_VERTEX = 0xFFFE
 SHADERTYPE_PIXEL = 0xFFFF
 
-gCurrentShaderType = SHADERTYPE_VERTEX
-
 class TokenStreamError(Exception):
 	"""Exception raised when an unexpected value was found in the bytecode stream"""
 	pass
 
-class InstructionToken:
+class UnsupportedInstructionError(ValueError):
+	"""Exception raised when valid bytecode uses an instruction or addressing mode that the Interpreter,
+	its texture sampler or the ShaderCompiler cannot run, naming the instruction and its byte offset"""
+	def __init__(self, inst, reason):
+		ValueError.__init__(self, "%s at offset 0x%X: %s" % (inst.token.mnemonic(), inst.offset, reason))
+		self.instruction = inst
+
+class InstructionToken(object):
+	__slots__ = ('op', 'flags', 'length', 'predicated', 'coissue')
 	def __init__(self, instructionToken):
 		self.op = instructionToken & 0xffff
+		if self.op == D3DSIO_COMMENT:
+			# Comments carry their DWORD count in bits 16-30
+			self.flags = 0
+			self.length = (instructionToken >> 16) & 0x7fff
+			self.predicated = 0
+			self.coissue = 0
+			return
 		self.flags = (instructionToken >> 16) & 0xff
 		self.length = (instructionToken >> 24) & 0xf
 		self.predicated = (instructionToken >> 28) & 0x1
@@ -294,15 +378,26 @@ class InstructionToken:
 	def size(self):
 		"""Size in bytes of the instruction in the byte stream"""
 		return (self.length + 1) * 4
-	def create_instruction(self, stream, offset):
-		if 'gen' in D3DSIO[self.op]:
-			inst = D3DSIO[self.op]['gen'](self)
-		else:
+	def token_count(self):
+		"""Number of DWORD tokens the instruction occupies in the token stream"""
+		return self.length + 1
+	def create_instruction(self, tokens, index):
+		if index + self.length >= len(tokens):
+			raise TokenStreamError("Truncated %s instruction" % self.mnemonic())
+		gen = D3DSIO[self.op].get('gen')
+		if gen is None:
 			inst = Instruction(self)
-		inst.load(stream, offset)
+		else:
+			inst = gen(self)
+		inst.load(tokens, index)
 		return inst
 	def is_exit(self):
 		return (self.op == D3DSIO_END)
+	def encode(self, length):
+		"""Instruction DWORD with length operand DWORDs following it"""
+		if self.op == D3DSIO_COMMENT:
+			return self.op | (length << 16)
+		return self.op | (self.flags << 16) | (length << 24) | (self.predicated << 28) | (self.coissue << 30)
 	def mnemonic(self):
 		return D3DSIO[self.op]['op']
 
@@ -323,6 +418,7 @@ RegisterMnemonicLookupVS = {
 	D3DSPR_CONST4 : 'c',
 	D3DSPR_CONSTBOOL : 'b',
 	D3DSPR_LOOP : 'aL',
+	D3DSPR_LABEL : 'l',
 	D3DSPR_PREDICATE : 'p'
 }
 RegisterMnemonicLookupPS = {
@@ -342,47 +438,98 @@ RegisterMnemonicLookupPS = {
 	D3DSPR_CONST4 : 'c',
 	D3DSPR_CONSTBOOL : 'b',
 	D3DSPR_LOOP : 'aL',
+	D3DSPR_LABEL : 'l',
 	D3DSPR_PREDICATE : 'p',
 	D3DSPR_MISCTYPE : 'm'
 }
-class ParameterToken:
+class DisassemblyContext(object):
+	"""Per-call disassembly state: shader type and version of the program being decoded and formatter options
+
+	Decoding and formatting only read shader state from here, so separate contexts can be used from separate threads"""
+	def __init__(self, shaderType=SHADERTYPE_VERTEX, majorVersion=0, minorVersion=0, isDebug=False):
+		self.debug = isDebug
+		self.constant_table = None
+		self.set_version((shaderType, majorVersion, minorVersion))
+	def set_version(self, version):
+		self.shader_type, self.major_version, self.minor_version = version
+		if self.shader_type == SHADERTYPE_VERTEX:
+			self.register_mnemonics = RegisterMnemonicLookupVS
+		else:
+			self.register_mnemonics = RegisterMnemonicLookupPS
+	def version(self):
+		return (self.shader_type, self.major_version, self.minor_version)
+	def register_text(self, registerType, register):
+		"""Name of a register without swizzle, like 'r0', 'aL' or 'oDepth'"""
+		texts = REGISTER_TEXT_VS if self.shader_type == SHADERTYPE_VERTEX else REGISTER_TEXT_PS
+		key = (registerType << 11) | register
+		text = texts.get(key)
+		if text is None:
+			text = self.register_mnemonics[registerType]
+			if registerType != D3DSPR_LOOP and registerType != D3DSPR_DEPTHOUT:
+				text += "%d" % register
+			texts[key] = text
+		return text
+	def version_string(self):
+		return "%s_%d_%d" % (('vs' if (self.shader_type == SHADERTYPE_VERTEX) else 'ps'), self.major_version, self.minor_version)
+
+# Operand text tables, formatting an operand is a few lookups into these
+COMPONENT_TEXT = 'xyzw'
+
+def build_swizzle_text():
+	"""SWIZZLE_TEXT[swizzle]: '.xyzw' style text with the trailing repeats of the last component left out"""
+	table = []
+	for swizzle in xrange(256):
+		components = [COMPONENT_TEXT[(swizzle >> (2 * i)) & 0x3] for i in xrange(4)]
+		while len(components) > 1 and components[-1] == components[-2]:
+			components.pop()
+		table.append('.' + ''.join(components))
+	return table
+
+SWIZZLE_TEXT = build_swizzle_text()
+WRITE_MASK_TEXT = ['.' + ''.join([COMPONENT_TEXT[i] for i in xrange(4) if mask & (1 << i)]) for mask in xrange(16)]
+RESULT_MODIFIER_TEXT = [('_sat' if mods & 0x1 else '') + ('_pp' if mods & 0x2 else '') + ('_centroid' if mods & 0x4 else '') for mods in xrange(16)]
+
+# Register names by (register type << 11) | register, filled in as registers are first printed
+REGISTER_TEXT_VS = {}
+REGISTER_TEXT_PS = {}
+
+class ParameterToken(object):
+	__slots__ = ('force_swizzle', 'register', 'register_type', 'is_relative', 'relative_param')
 	def swizzle_text():
 		return ''
 	def debug_print():
 		print 'You should override debug_print for anything that inherits from ParameterToken'
-	def to_string(self):
-		reg_str = 'unk'
-		if gCurrentShaderType == SHADERTYPE_VERTEX:
-			reg_str = RegisterMnemonicLookupVS[self.register_type]
-		else:
-			reg_str = RegisterMnemonicLookupPS[self.register_type]
-
-		if self.is_relative:
-			if self.relative_param is None:
-				return "!ERR!"
-			out = reg_str
-			if self.register > 0:
-				out += "%d" % self.register
-			out += "["
-			if self.relative_param.register_type == D3DSPR_LOOP:
-				out += "aL%s" % (self.relative_param.swizzle_text())
-			elif self.relative_param.register_type == D3DSPR_ADDR:
-				out += "a%d%s" % (self.relative_param.register, self.relative_param.swizzle_text())
-			else:
-				raise TokenStreamError("Invalid relative addressing parameter found")
-			out += "]"
-			return out
-		else:
-			if self.register_type == D3DSPR_LOOP:
-				return "aL%s" % (self.register, self.swizzle_text())
-			elif self.register_type == D3DSPR_DEPTHOUT:
-				return "oDepth%s" % (self.register, self.swizzle_text())
-			else:
-				return "%s%d%s" % (reg_str, self.register, self.swizzle_text())
-		self.debug_print()
-		return "unk_reg"
+	def to_string(self, ctx):
+		if not self.is_relative:
+			return ctx.register_text(self.register_type, self.register) + self.swizzle_text()
+		if self.relative_param is None:
+			return "!ERR!"
+		out = ctx.register_mnemonics[self.register_type]
+		if self.register > 0:
+			out += "%d" % self.register
+		if self.relative_param.register_type == D3DSPR_LOOP:
+			return "%s[aL%s]" % (out, self.relative_param.swizzle_text())
+		if self.relative_param.register_type == D3DSPR_ADDR:
+			return "%s[a%d%s]" % (out, self.relative_param.register, self.relative_param.swizzle_text())
+		raise TokenStreamError("Invalid relative addressing parameter found")
+	def encode(self, fields):
+		"""DWORDs of the parameter with fields holding the bits of its own kind, then the relative address token"""
+		token = (0x80000000 | (self.register & 0x7ff) | ((self.register_type & 0x7) << 28) | ((self.register_type >> 3) << 11) |
+			(int(self.is_relative) << 13) | fields)
+		if self.is_relative and self.relative_param is not None:
+			return [token] + self.relative_param.encode()
+		return [token]
+	def relative_record(self, ctx):
+		if not self.is_relative or self.relative_param is None:
+			return None
+		return self.relative_param.to_record(ctx)
+	def relative_signature(self, ignoreRegisters):
+		if not self.is_relative or self.relative_param is None:
+			return None
+		return self.relative_param.signature(ignoreRegisters)
 
 class DestinationParameterToken(ParameterToken):
+	__slots__ = ('write_mask', 'result_modifier', 'shift_scale')
 	def __init__(self, val):
 		self.force_swizzle = False
 		self.register = (val & 0x7ff)
@@ -394,32 +541,27 @@ class DestinationParameterToken(ParameterToken):
 		register_type_012 = (val >> 28) & 0x7
 		self.register_type = (register_type_34 << 3) + register_type_012
 		self.relative_param = None
+	def signature(self, ignoreRegisters=False):
+		"""Hashable description of the operand, with the register index masked out when ignoreRegisters is set"""
+		return (self.register_type, -1 if ignoreRegisters else self.register, self.write_mask,
+			self.result_modifier, self.shift_scale, self.relative_signature(ignoreRegisters))
+	def encode(self):
+		return ParameterToken.encode(self, (self.write_mask << 16) | (self.result_modifier << 20) | (self.shift_scale << 24))
+	def to_record(self, ctx):
+		"""Operand fields as a dict of plain values, for structured output"""
+		return {'type': self.register_type, 'register': self.register, 'name': ctx.register_text(self.register_type, self.register),
+			'write_mask': self.write_mask, 'modifiers': self.result_modifier, 'shift': self.shift_scale, 'relative': self.relative_record(ctx)}
 	def debug_print(self):
 		print "Dst: %d, %d, %d, %d, %d, %d" % (self.register, self.register_type, self.write_mask, self.is_relative, self.result_modifier, self.shift_scale)
 	def mod_str(self):
-		str = ''
-		if (self.result_modifier & 0x1) == 0x1:
-			str += '_sat'
-		if (self.result_modifier & 0x2) == 0x2:
-			str += '_pp'
-		if (self.result_modifier & 0x4) == 0x4:
-			str += '_centroid'
-		return str
+		return RESULT_MODIFIER_TEXT[self.result_modifier]
 	def swizzle_text(self):
 		if (self.write_mask == 15) and not self.force_swizzle:
 			return ''
-		mask = '.'
-		if self.write_mask & 0x1 == 0x1:
-			mask += 'x'
-		if self.write_mask & 0x2 == 0x2:
-			mask += 'y'
-		if self.write_mask & 0x4 == 0x4:
-			mask += 'z'
-		if self.write_mask & 0x8 == 0x8:
-			mask += 'w'
-		return mask
+		return WRITE_MASK_TEXT[self.write_mask]
 
 class SourceParameterToken(ParameterToken):
+	__slots__ = ('read_mask', 'source_modifier')
 	def __init__(self, val):
 		self.force_swizzle = False
 		self.register = (val & 0x7ff)
@@ -430,164 +572,136 @@ class SourceParameterToken(ParameterToken):
 		register_type_012 = (val >> 28) & 0x7
 		self.register_type = (register_type_34 << 3) + register_type_012
 		self.relative_param = None
+	def signature(self, ignoreRegisters=False):
+		"""Hashable description of the operand, with the register index masked out when ignoreRegisters is set"""
+		return (self.register_type, -1 if ignoreRegisters else self.register, self.read_mask,
+			self.source_modifier, self.relative_signature(ignoreRegisters))
+	def encode(self):
+		return ParameterToken.encode(self, (self.read_mask << 16) | (self.source_modifier << 24))
+	def to_record(self, ctx):
+		"""Operand fields as a dict of plain values, for structured output"""
+		return {'type': self.register_type, 'register': self.register, 'name': ctx.register_text(self.register_type, self.register),
+			'swizzle': self.read_mask, 'modifier': self.source_modifier, 'relative': self.relative_record(ctx)}
 	def debug_print(self):
 		print "Src: %d, %d, %d, %d, %d" % (self.register, self.register_type, self.read_mask, self.is_relative, self.source_modifier)
 	def mod_str(self, str):
 		return SOURCE_MOD_FORMAT[self.source_modifier] % str
 	def swizzle_component_str(self, val):
-		if val == 0:
-			return 'x'
-		if val == 1:
-			return 'y'
-		if val == 2:
-			return 'z'
-		if val == 3:
-			return 'w'
+		return COMPONENT_TEXT[val]
 	def swizzle_text(self):
+		# r0.x is equivalent to r0.xxxx, r0.xy is equivalent to r0.xyyy
 		if (self.read_mask == 0xE4) and not self.force_swizzle:
 			return ''
-		last_val = (self.read_mask >> 6) & 0x3
-		mask = self.swizzle_component_str(last_val)
-		ch = 0
-		# Do this in reverse order
-		# We don't need to specify the last swizzle values if they're duplicated
-		# e.g. r0.x is equivalent to r0.xxxx, r0.xy is equivalent to r0.xyyy
-		for i in xrange(3):
-			val = (self.read_mask >> (4 - 2*i)) & 0x3
-			if (val != last_val) or ch:
-				mask = self.swizzle_component_str(val) + mask
-				ch = 1
-		return '.' + mask
-	def to_string(self):
-		return self.mod_str(ParameterToken.to_string(self))
+		return SWIZZLE_TEXT[self.read_mask]
+	def to_string(self, ctx):
+		if self.source_modifier:
+			return SOURCE_MOD_FORMAT[self.source_modifier] % ParameterToken.to_string(self, ctx)
+		return ParameterToken.to_string(self, ctx)
 
-class Instruction:
+class Instruction(object):
+	"""Instruction decoded from the operand signature of its opcode in the D3DSIO table"""
+	__slots__ = ('token', 'offset', 'dst', 'predicate', 'srcs')
 	def __init__(self, token):
 		self.token = token
+		self.offset = 0
+		self.dst = None
+		self.predicate = None
+		self.srcs = ()
 	def size(self):
 		return self.token.size()
-	def load(self, stream, offset):
-		return
+	def token_count(self):
+		return self.token.token_count()
+	def load(self, tokens, index):
+		"""Operands up to the length field: the destination when the opcode has one, the predicate, then sources
+
+		The table's source count is not used, it varies with the shader version: ps_1_x tex has no sources,
+		ps_1_4 texld and texcrd have one and 2_x sincos two past the usual one"""
+		end = index + 1 + self.token.length
+		index += 1
+		srcs = []
+		try:
+			if 'dst' in D3DSIO[self.token.op] and index < end:
+				self.dst, index = get_destination_param(tokens, index)
+			# The predicate register sits between the destination and the sources
+			if self.token.predicated and index < end:
+				self.predicate, index = get_source_param(tokens, index)
+			while index < end:
+				src, index = get_source_param(tokens, index)
+				srcs.append(src)
+		except IndexError:
+			# A relative addressing token past the last token, which is never inside the length
+			index = end + 1
+		if index > end:
+			raise TokenStreamError("Operands of %s run past its length" % self.token.mnemonic())
+		self.srcs = tuple(srcs)
 	def mnemonic(self, dst=None):
 		mn = self.token.mnemonic()
 		if dst is not None:
 			mn += dst.mod_str()
 		return mn
-	def to_string(self):
-		return self.mnemonic()
-
-class AbsInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
-
-class AddInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
-
-class BemInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
-
-class BreakCInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(), self.src0.to_string(), self.src1.to_string())
-
-class BreakPInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.src.to_string())
-
-class CallInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.src.to_string())
-
-class CallNzInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(), self.src0.to_string(), self.src1.to_string())
+	def operands(self):
+		"""List of the operand parameter tokens, destination first"""
+		if self.dst is None:
+			return self.srcs
+		return (self.dst,) + self.srcs
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		"""Hashable description of the opcode and operands
 
-class CmpInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
-
-class CndInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
-
-class CrsInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+		ignoreRegisters masks out register indices, ignoreConstants masks out literal values"""
+		predicate = None
+		if self.predicate is not None:
+			predicate = self.predicate.signature(ignoreRegisters)
+		return (self.token.op, self.token.flags, predicate, tuple([param.signature(ignoreRegisters) for param in self.operands()]))
+	def to_string(self, ctx):
+		operands = self.operands()
+		if operands:
+			text = "%s %s" % (self.mnemonic(self.dst), ", ".join([param.to_string(ctx) for param in operands]))
+		else:
+			text = self.mnemonic()
+		if self.predicate is not None:
+			text = "(%s) %s" % (self.predicate.to_string(ctx), text)
+		return text
+	def to_record(self, ctx):
+		"""Instruction fields as a dict of plain values, for structured output without the listing text"""
+		return {
+			'offset': self.offset,
+			'op': self.token.op,
+			'mnemonic': self.token.mnemonic(),
+			'flags': self.token.flags,
+			'predicated': bool(self.token.predicated),
+			'coissue': bool(self.token.coissue),
+			'dst': None if self.dst is None else self.dst.to_record(ctx),
+			'predicate': None if self.predicate is None else self.predicate.to_record(ctx),
+			'srcs': [src.to_record(ctx) for src in self.srcs]
+		}
+	def encode(self):
+		"""DWORD tokens of the instruction, the length field counts the operand tokens"""
+		tokens = []
+		if self.dst is not None:
+			tokens += self.dst.encode()
+		if self.predicate is not None:
+			tokens += self.predicate.encode()
+		for src in self.srcs:
+			tokens += src.encode()
+		return [self.token.encode(len(tokens))] + tokens
+	def to_python(self, gen):
+		"""Emit the Python statements running this instruction through gen, a ShaderCompiler"""
+		op = self.token.op
+		if op in FLOW_OPS or op == D3DSIO_END or op == D3DSIO_TEXKILL:
+			gen.flow(self)
+		elif op in TEXTURE_OPS:
+			gen.store(self, "machine.texture_lookup(INST[%d], [%s])" % (gen.index, ", ".join([gen.operand(src) for src in self.srcs])))
+		elif op not in (D3DSIO_NOP, D3DSIO_PHASE):
+			gen.store(self, gen.expression(self))
 
 class DclInstruction(Instruction):
+	__slots__ = ('usage', 'usage_index', 'texture_type')
 	def __init__(self, token):
 		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		params = struct.unpack('<I', stream[offset+4:offset+8])[0]
-		offset += 8
-		self.dst, offset = get_destination_param(stream, offset)
+	def load(self, tokens, index):
+		params = tokens[index+1]
+		index += 2
+		self.dst, index = get_destination_param(tokens, index)
 		if self.dst.register_type == D3DSPR_INPUT or self.dst.register_type == D3DSPR_OUTPUT or self.dst.register_type == D3DSPR_TEXTURE:
 			self.usage = params & 0x1f
 			self.usage_index = (params >> 16) & 0xf
@@ -600,731 +714,3508 @@ class DclInstruction(Instruction):
 		elif self.dst.register_type == D3DSPR_SAMPLER:
 			mn = "dcl_%s" % D3DSTT[self.texture_type]['text']
 		return mn + self.dst.mod_str()
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.dst.to_string())
+	def to_string(self, ctx):
+		return "%s %s" % (self.mnemonic(), self.dst.to_string(ctx))
+	def to_record(self, ctx):
+		record = Instruction.to_record(self, ctx)
+		record['usage'] = getattr(self, 'usage', None)
+		record['usage_index'] = getattr(self, 'usage_index', None)
+		record['texture_type'] = getattr(self, 'texture_type', None)
+		return record
+	def encode(self):
+		params = 0x80000000 | (getattr(self, 'usage', 0) & 0x1f) | ((getattr(self, 'usage_index', 0) & 0xf) << 16) | ((getattr(self, 'texture_type', 0) & 0xf) << 27)
+		tokens = [params] + self.dst.encode()
+		return [self.token.encode(len(tokens))] + tokens
+	def to_python(self, gen):
+		pass
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		return Instruction.signature(self, ignoreRegisters) + (getattr(self, 'usage', None), getattr(self, 'usage_index', None), getattr(self, 'texture_type', None))
 
 class DefInstruction(Instruction):
+	__slots__ = ('values',)
 	def __init__(self, token):
 		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.values = struct.unpack('<ffff', stream[offset:offset+16])
-	def to_string(self):
-		return "%s %s, %f, %f, %f, %f" % (self.mnemonic(self.dst), self.dst.to_string(), self.values[0], self.values[1], self.values[2], self.values[3])
+	def load(self, tokens, index):
+		index += 1
+		self.dst, index = get_destination_param(tokens, index)
+		self.values = struct.unpack('<ffff', struct.pack('<IIII', *tokens[index:index+4]))
+	def to_string(self, ctx):
+		return "%s %s, %f, %f, %f, %f" % (self.mnemonic(self.dst), self.dst.to_string(ctx), self.values[0], self.values[1], self.values[2], self.values[3])
+	def to_record(self, ctx):
+		record = Instruction.to_record(self, ctx)
+		record['values'] = list(self.values)
+		return record
+	def encode(self):
+		tokens = self.dst.encode() + list(struct.unpack('<IIII', struct.pack('<ffff', *self.values)))
+		return [self.token.encode(len(tokens))] + tokens
+	def to_python(self, gen):
+		gen.emit("C[%d] = %r" % (self.dst.register + CONST_BANK_BASE.get(self.dst.register_type, 0), tuple(self.values)))
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		return Instruction.signature(self, ignoreRegisters) + (None if ignoreConstants else self.values,)
 
 class DefBInstruction(Instruction):
+	__slots__ = ('value',)
 	def __init__(self, token):
 		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.value = struct.unpack('<I', stream[offset:offset+4])[0]
-	def to_string(self):
-		return "%s %s %s" % (self.mnemonic(self.dst), self.dst.to_string(), "FALSE" if self.value == 0 else "TRUE")
+	def load(self, tokens, index):
+		index += 1
+		self.dst, index = get_destination_param(tokens, index)
+		self.value = tokens[index]
+	def to_string(self, ctx):
+		return "%s %s %s" % (self.mnemonic(self.dst), self.dst.to_string(ctx), "FALSE" if self.value == 0 else "TRUE")
+	def to_record(self, ctx):
+		record = Instruction.to_record(self, ctx)
+		record['values'] = [self.value != 0]
+		return record
+	def encode(self):
+		tokens = self.dst.encode() + [self.value]
+		return [self.token.encode(len(tokens))] + tokens
+	def to_python(self, gen):
+		gen.emit("B[%d] = %r" % (self.dst.register, self.value != 0))
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		return Instruction.signature(self, ignoreRegisters) + (None if ignoreConstants else self.value,)
 
 class DefIInstruction(Instruction):
+	__slots__ = ('values',)
 	def __init__(self, token):
 		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.values = struct.unpack('<iiii', stream[offset:offset+16])
-	def to_string(self):
-		return "%s %s %d, %d, %d, %d" % (self.mnemonic(self.dst), self.dst.to_string(), self.values[0], self.values[1], self.values[2], self.values[3])
+	def load(self, tokens, index):
+		index += 1
+		self.dst, index = get_destination_param(tokens, index)
+		self.values = struct.unpack('<iiii', struct.pack('<IIII', *tokens[index:index+4]))
+	def to_string(self, ctx):
+		return "%s %s %d, %d, %d, %d" % (self.mnemonic(self.dst), self.dst.to_string(ctx), self.values[0], self.values[1], self.values[2], self.values[3])
+	def to_record(self, ctx):
+		record = Instruction.to_record(self, ctx)
+		record['values'] = list(self.values)
+		return record
+	def encode(self):
+		tokens = self.dst.encode() + list(struct.unpack('<IIII', struct.pack('<iiii', *self.values)))
+		return [self.token.encode(len(tokens))] + tokens
+	def to_python(self, gen):
+		gen.emit("I[%d] = %r" % (self.dst.register, list(self.values)))
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		return Instruction.signature(self, ignoreRegisters) + (None if ignoreConstants else self.values,)
 
-class Dp2AddInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
+class ShaderConstant(object):
+	"""One entry of a constant table"""
+	__slots__ = ('name', 'register_set', 'register_index', 'register_count', 'parameter_class', 'parameter_type', 'rows', 'columns', 'elements')
+	def __init__(self, name, registerSet, registerIndex, registerCount, typeInfo):
+		self.name = name
+		self.register_set = registerSet
+		self.register_index = registerIndex
+		self.register_count = registerCount
+		self.parameter_class, self.parameter_type, self.rows, self.columns, self.elements = typeInfo
+	def type_name(self):
+		name = D3DXPT.get(self.parameter_type, 'unknown')
+		if self.rows > 1:
+			name += "%dx%d" % (self.rows, self.columns)
+		elif self.columns > 1:
+			name += "%d" % self.columns
+		return name
+	def register_name(self):
+		return "%s%d" % (D3DXRS[self.register_set]['text'], self.register_index)
 
-class Dp3Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
+class ConstantTable(object):
+	"""Constant table stored by the HLSL compiler in a CTAB comment block"""
+	def __init__(self, data):
+		"""Parse the table from data, the bytes following the CTAB fourcc"""
+		size, creator, version, count, info, flags, target = struct.unpack_from('<7I', data, 0)
+		self.creator = self.read_string(data, creator)
+		self.target = self.read_string(data, target)
+		self.version = version
+		self.flags = flags
+		self.constants = []
+		self.registers = {}
+		for i in xrange(count):
+			name, registerSet, registerIndex, registerCount, reserved, typeInfo, defaultValue = struct.unpack_from('<IHHHHII', data, info + i * 20)
+			constant = ShaderConstant(self.read_string(data, name), registerSet, registerIndex, registerCount,
+				struct.unpack_from('<HHHHH', data, typeInfo))
+			self.constants.append(constant)
+			for register in xrange(registerIndex, registerIndex + registerCount):
+				self.registers[(registerSet, register)] = constant
+	def read_string(self, data, offset):
+		end = data.find(b'\0', offset)
+		if end < 0:
+			end = len(data)
+		return str(data[offset:end].decode('ascii', 'replace').replace(u'\ufffd', u'?'))
+	def lookup(self, registerType, register):
+		"""Constant mapped to a c#, i#, b# or s# register, or None"""
+		registerSet = REGISTER_SET_LOOKUP.get(registerType)
+		if registerSet is None:
+			return None
+		return self.registers.get((registerSet, register))
+	def annotate(self, inst):
+		"""Names of the constants read or written by inst, as a comma separated string"""
+		names = []
+		for param in inst.operands():
+			constant = self.lookup(param.register_type, param.register)
+			if constant is None:
+				continue
+			name = constant.name
+			if constant.register_count > 1:
+				name += "[%d]" % (param.register - constant.register_index)
+			if name not in names:
+				names.append(name)
+		return ", ".join(names)
 	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+		lines = ["// Constant table, %s" % self.creator]
+		for constant in self.constants:
+			lines.append("//   %-24s %-16s %-6s %d" % (constant.name, constant.type_name(), constant.register_name(), constant.register_count))
+		return "\n".join(lines)
 
-class Dp4Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+class CommentInstruction(Instruction):
+	"""Comment block, skipped as a whole using the length from its instruction token
 
-class DstInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	CTAB blocks are parsed into a ConstantTable, other comments are only kept as raw DWORDs"""
+	__slots__ = ('fourcc', 'data', 'constant_table')
+	def load(self, tokens, index):
+		self.data = tokens[index+1:index+1+self.token.length]
+		self.fourcc = self.data[0] if self.data else 0
+		self.constant_table = None
+		if self.fourcc == FOURCC_CTAB:
+			try:
+				self.constant_table = ConstantTable(struct.pack('<%dI' % (len(self.data) - 1), *self.data[1:]))
+			except (struct.error, IndexError):
+				self.constant_table = None
+	def operands(self):
+		return ()
+	def signature(self, ignoreRegisters=False, ignoreConstants=False):
+		return (self.token.op, self.fourcc, None if ignoreConstants else self.data)
+	def to_string(self, ctx):
+		if self.constant_table is not None:
+			return self.constant_table.to_string()
+		return "// comment, %d dwords" % len(self.data)
+	def to_record(self, ctx):
+		return {'offset': self.offset, 'op': self.token.op, 'mnemonic': self.token.mnemonic(), 'fourcc': self.fourcc, 'dwords': len(self.data)}
+	def encode(self):
+		return [self.token.encode(len(self.data))] + list(self.data)
+	def to_python(self, gen):
+		pass
 
-class DsxInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def instruction_text(inst, ctx):
+	"""Text of inst, with the names of the constants it uses when the shader has a constant table"""
+	text = inst.to_string(ctx)
+	if ctx.constant_table is not None:
+		names = ctx.constant_table.annotate(inst)
+		if names:
+			text += "  // " + names
+	return text
 
-class DsyInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Unpack the whole bytecode buffer into DWORD tokens in one call
+# Everything past this point works on token indices, byte offsets are only index * 4
+def unpack_tokens(bytecode):
+	return struct.unpack_from('<%dI' % (len(bytecode) // 4), bytecode)
 
-class ExpInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def pack_tokens(tokens):
+	return struct.pack('<%dI' % len(tokens), *tokens)
 
-class ExppInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Get the next instruction from the token stream
+def get_instruction(tokens, index):
+	instToken = InstructionToken(tokens[index])
+	inst = instToken.create_instruction(tokens, index)
+	return inst
 
-class FrcInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def get_source_param(tokens, index):
+	param = SourceParameterToken(tokens[index])
+	index += 1
+	if param.is_relative:
+		param.relative_param, index = get_source_param(tokens, index)
+	return param, index
 
-class IfInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.src.to_string())
+def get_destination_param(tokens, index):
+	param = DestinationParameterToken(tokens[index])
+	index += 1
+	if param.is_relative:
+		param.relative_param, index = get_destination_param(tokens, index)
+	return param, index
 
-class IfCompInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(), self.src0.to_string(), self.src1.to_string())
+def get_version(tokens):
+	if len(tokens) < 1:
+		raise TokenStreamError("Missing version token")
+	val = tokens[0]
+	if ((val >> 16) & 0xfffe) != 0xfffe:
+		raise TokenStreamError("Version error, unknown shader type")
+	minorVersion = val & 0xff
+	majorVersion = (val >> 8) & 0xff
+	shaderType = (val >> 16) & 0xffff
+	return (shaderType, majorVersion, minorVersion)
 
-class LabelInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.src.to_string())
+# Columnar decoding
+# Decodes a whole shader into NumPy structured arrays, one row per instruction and one per operand
 
-class LitInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+OPERAND_DST = 0
+OPERAND_SRC = 1
+OPERAND_PREDICATE = 2
 
-class LogInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+INSTRUCTION_DTYPE = [
+	('offset', '<u4'),			# token index of the instruction token, byte offset is offset * 4
+	('opcode', '<u2'),
+	('length', '<u2'),
+	('flags', 'u1'),
+	('predicated', '?'),
+	('coissue', '?'),
+	('operand_start', '<u4'),	# first row of this instruction in the operand array
+	('operand_count', 'u1')
+]
 
-class LogPInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+OPERAND_DTYPE = [
+	('instruction', '<u4'),		# row in the instruction array
+	('kind', 'u1'),				# OPERAND_DST, OPERAND_SRC or OPERAND_PREDICATE
+	('register', '<u2'),
+	('register_type', 'u1'),
+	('mask', 'u1'),				# write mask for destinations, swizzle for sources
+	('modifier', 'u1'),			# result modifier for destinations, source modifier for sources
+	('shift_scale', 'u1'),
+	('relative', '?'),
+	('relative_register', '<u2'),
+	('relative_register_type', 'u1'),
+	('relative_swizzle', 'u1')
+]
 
-class LoopInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(), self.src0.to_string(), self.src1.to_string())
+# Per-opcode lookup arrays built from the D3DSIO table on first use
+gOpcodeColumns = None
 
-class LrpInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
+def get_opcode_columns():
+	global gOpcodeColumns
+	if gOpcodeColumns is None:
+		hasDst = numpy.zeros(0x10000, dtype=bool)
+		literalFrom = numpy.zeros(0x10000, dtype=numpy.uint8)
+		for op, info in D3DSIO.items():
+			hasDst[op] = ('dst' in info) or ('gen' in info)
+		# Position (relative to the instruction token) of the first literal DWORD, 0 for none
+		literalFrom[D3DSIO_DEF] = 2
+		literalFrom[D3DSIO_DEFI] = 2
+		literalFrom[D3DSIO_DEFB] = 2
+		literalFrom[D3DSIO_COMMENT] = 1
+		gOpcodeColumns = (hasDst, literalFrom)
+	return gOpcodeColumns
 
-class M3x2Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+def decode_columns(bytecode):
+	"""Decode a shader into (instructions, operands) NumPy structured arrays
 
-class M3x3Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	The version token is not part of the result, use get_version for it.
+	Relative addressing tokens are folded into the relative_* fields of the operand that uses them."""
+	if numpy is None:
+		raise ImportError("decode_columns requires numpy")
+	tokens = numpy.frombuffer(bytecode, dtype='<u4', count=len(bytecode) // 4).astype(numpy.uint32)
+	get_version(tokens)
+	isComment = (tokens & 0xffff) == D3DSIO_COMMENT
+	lengthColumn = numpy.where(isComment, (tokens >> 16) & 0x7fff, (tokens >> 24) & 0xf)
+	lengths = lengthColumn.tolist()
+	opcodes = (tokens & 0xffff).tolist()
+	# Walking the length chain is inherently sequential, everything after it is vectorized
+	starts = []
+	index = 1
+	count = len(opcodes)
+	while index < count:
+		starts.append(index)
+		if opcodes[index] == D3DSIO_END:
+			break
+		index += lengths[index] + 1
+	starts = numpy.array(starts, dtype=numpy.uint32)
+	instTokens = numpy.where(isComment[starts], 0, tokens[starts])
+	instructions = numpy.zeros(len(starts), dtype=INSTRUCTION_DTYPE)
+	instructions['offset'] = starts
+	instructions['opcode'] = tokens[starts] & 0xffff
+	instructions['length'] = lengthColumn[starts]
+	instructions['flags'] = (instTokens >> 16) & 0xff
+	instructions['predicated'] = (instTokens >> 28) & 0x1
+	instructions['coissue'] = (instTokens >> 30) & 0x1
 
-class M3x4Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	# Map every token covered by the instructions back to the instruction that owns it
+	spans = instructions['length'].astype(numpy.intp) + 1
+	end = min(int(starts[-1]) + int(spans[-1]), count) if len(starts) else 1
+	owner = numpy.repeat(numpy.arange(len(starts)), spans)[:end - 1]
+	position = numpy.arange(1, end, dtype=numpy.intp)
+	within = position - starts[owner].astype(numpy.intp)
+	hasDst, literalFrom = get_opcode_columns()
+	ownerOps = instructions['opcode'][owner]
+	literal = literalFrom[ownerOps].astype(numpy.intp)
+	isParam = (within > 0) & ((literal == 0) | (within < literal))
+	# The dcl usage token sits between the instruction token and the destination
+	isParam &= ~((ownerOps == D3DSIO_DCL) & (within == 1))
+	paramTokens = tokens[position]
+	relativeBit = ((paramTokens >> 13) & 0x1).astype(bool)
+	isRelToken = numpy.zeros(len(position), dtype=bool)
+	isRelToken[1:] = isParam[1:] & isParam[:-1] & relativeBit[:-1] & (owner[1:] == owner[:-1])
+	isOperand = isParam & ~isRelToken
 
-class M4x3Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	rows = numpy.nonzero(isOperand)[0]
+	operands = numpy.zeros(len(rows), dtype=OPERAND_DTYPE)
+	rowOwner = owner[rows]
+	operands['instruction'] = rowOwner
+	perInstruction = numpy.bincount(rowOwner, minlength=len(starts))
+	operandStart = numpy.zeros(len(starts), dtype=numpy.intp)
+	operandStart[1:] = numpy.cumsum(perInstruction)[:-1]
+	instructions['operand_start'] = operandStart
+	instructions['operand_count'] = perInstruction
+	ordinal = numpy.arange(len(rows)) - operandStart[rowOwner]
+	rowOps = instructions['opcode'][rowOwner]
+	rowDst = hasDst[rowOps]
+	predicated = instructions['predicated'][rowOwner]
+	isDst = rowDst & (ordinal == 0)
+	isPredicate = predicated & (ordinal == rowDst.astype(numpy.intp))
+	kind = numpy.full(len(rows), OPERAND_SRC, dtype=numpy.uint8)
+	kind[isDst] = OPERAND_DST
+	kind[isPredicate] = OPERAND_PREDICATE
+	operands['kind'] = kind
 
-class M4x4Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	val = paramTokens[rows]
+	operands['register'] = val & 0x7ff
+	operands['register_type'] = ((val >> 28) & 0x7) | (((val >> 11) & 0x3) << 3)
+	operands['mask'] = numpy.where(isDst, (val >> 16) & 0xf, (val >> 16) & 0xff)
+	operands['modifier'] = numpy.where(isDst, (val >> 20) & 0xf, (val >> 24) & 0xf)
+	operands['shift_scale'] = numpy.where(isDst, (val >> 24) & 0xf, 0)
+	relative = relativeBit[rows] & (rows + 1 < len(position))
+	operands['relative'] = relative
+	relRows = rows[relative] + 1
+	relVal = paramTokens[relRows]
+	operands['relative_register'][relative] = relVal & 0x7ff
+	operands['relative_register_type'][relative] = ((relVal >> 28) & 0x7) | (((relVal >> 11) & 0x3) << 3)
+	operands['relative_swizzle'][relative] = (relVal >> 16) & 0xff
+	return instructions, operands
 
-class MadInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
+class Program(object):
+	"""Decoded shader program: the version from get_version and the instruction list
 
-class MaxInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	Each instruction's offset is its byte offset in the bytecode. Formatting is done by to_text"""
+	def __init__(self, version, instructions):
+		self.version = version
+		self.instructions = instructions
+		self.context = DisassemblyContext(*version)
+		self.flow_graph = None
+		for inst in instructions:
+			if inst.token.op == D3DSIO_COMMENT and inst.constant_table is not None:
+				self.context.constant_table = inst.constant_table
+				break
+	def shader_type(self):
+		return self.version[0]
+	def stats(self):
+		"""ShaderStats of the decoded instructions"""
+		stats = ShaderStats(self.context)
+		for inst in self.instructions:
+			stats.add(inst)
+		return stats
+	def control_flow(self):
+		"""ControlFlowGraph of the instructions, built on first use and kept for later analyses"""
+		if self.flow_graph is None:
+			self.flow_graph = ControlFlowGraph(self.instructions)
+		return self.flow_graph
+	def encode(self):
+		"""Bytecode of the program: the version token, then every instruction with its length recomputed
 
-class MinInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+		A program that was decoded and not changed encodes to the bytes it was decoded from, up to its END token"""
+		tokens = [(self.version[0] << 16) | (self.version[1] << 8) | self.version[2]]
+		for inst in self.instructions:
+			tokens += inst.encode()
+		if not self.instructions or not self.instructions[-1].token.is_exit():
+			tokens.append(D3DSIO_END)
+		return pack_tokens(tokens)
+	def size(self):
+		"""Size in bytes of the bytecode, from the version token to the end of the last instruction"""
+		if not self.instructions:
+			return 4
+		last = self.instructions[-1]
+		return last.offset + last.size()
+	def to_text(self, isDebug=False):
+		ctx = self.context
+		lines = [ctx.version_string()]
+		for inst in self.instructions:
+			if isDebug:
+				lines.append("; Offset 0x%X" % inst.offset)
+			lines.append(instruction_text(inst, ctx))
+		lines.append('')
+		return "\n".join(lines)
 
-class MovInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def decode(bytecode):
+	"""Decode shader bytecode into a Program"""
+	tokens = unpack_tokens(bytecode)
+	version = get_version(tokens)
+	instructions = []
+	index = 1
+	count = len(tokens)
+	while index < count:
+		inst = get_instruction(tokens, index)
+		inst.offset = index * 4
+		instructions.append(inst)
+		if inst.token.is_exit():
+			break
+		index += inst.token_count()
+	return Program(version, instructions)
 
-class MovaInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Control flow graphs
+# Flow instructions end a basic block, endif/endloop/endrep and label start one.
+# Everything is built in a single pass over the instructions plus one over the blocks
 
-class MulInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset) # DestinationParameterToken(data[0])
-		self.src0, offset = get_source_param(stream, offset) # = SourceParameterToken(data[1])
-		self.src1, offset = get_source_param(stream, offset) # = SourceParameterToken(data[2])
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+# Instructions that end a basic block
+FLOW_TERMINATORS = frozenset([D3DSIO_IF, D3DSIO_IFC, D3DSIO_ELSE, D3DSIO_LOOP, D3DSIO_REP, D3DSIO_ENDLOOP, D3DSIO_ENDREP,
+	D3DSIO_BREAK, D3DSIO_BREAKC, D3DSIO_BREAKP, D3DSIO_CALL, D3DSIO_CALLNZ, D3DSIO_RET, D3DSIO_END])
+# Instructions that start a basic block
+FLOW_TARGETS = frozenset([D3DSIO_ENDIF, D3DSIO_ENDLOOP, D3DSIO_ENDREP, D3DSIO_LABEL])
 
-class NrmInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+class BasicBlock(object):
+	"""Instructions [start, end) of a program, entered only at start and left only after end - 1
 
-class PowInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	function is the label number of the subroutine holding the block, None for the main program"""
+	__slots__ = ('index', 'start', 'end', 'successors', 'predecessors', 'loop', 'function')
+	def __init__(self, index, start, end, loop, function):
+		self.index = index
+		self.start = start
+		self.end = end
+		self.successors = []
+		self.predecessors = []
+		self.loop = loop
+		self.function = function
+	def last(self):
+		return self.end - 1
+	def loop_depth(self):
+		if self.loop is None:
+			return 0
+		return self.loop.depth
 
-class RcpInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+class Loop(object):
+	"""loop/endloop or rep/endrep pair, start and end are the instruction indices of the pair"""
+	__slots__ = ('start', 'end', 'parent', 'depth', 'children')
+	def __init__(self, start, parent):
+		self.start = start
+		self.end = None
+		self.parent = parent
+		self.depth = 1 if parent is None else parent.depth + 1
+		self.children = []
+	def contains(self, index):
+		return self.start < index <= self.end
 
-class RepInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(), self.src.to_string())
+class ControlFlowGraph(object):
+	"""Basic blocks, edges, loop nesting and subroutine call graph of a decoded instruction list
 
-class RsqInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	Subroutines are keyed by their label register number, None is the main program.
+	A call only has an edge to the block after it, the call itself is recorded in calls"""
+	def __init__(self, instructions):
+		self.instructions = instructions
+		self.blocks = []
+		# Block index of each instruction
+		self.block_of = []
+		# Every loop in program order, outer loops before the loops they contain
+		self.loops = []
+		# Function -> entry block index
+		self.functions = OrderedDict()
+		# Function -> [(block index ending in the call, called label)]
+		self.calls = OrderedDict()
+		# Instruction index of the matching else/endif of each if and else, endloop/endrep of each loop/rep
+		# and loop/rep of each endloop/endrep
+		self.flow_targets = {}
+		self.build()
+	def build(self):
+		instructions = self.instructions
+		count = len(instructions)
+		leaders = [False] * (count + 1)
+		leaders[0] = True
+		# if/ifc -> its else or endif, else -> its endif
+		match = {}
+		loopOf = [None] * count
+		functionOf = [None] * count
+		function = None
+		nesting = []
+		loops = []
+		for i in xrange(count):
+			op = instructions[i].token.op
+			if op in FLOW_TARGETS:
+				leaders[i] = True
+			if op in FLOW_TERMINATORS:
+				leaders[i + 1] = True
+			if op == D3DSIO_LABEL:
+				function = instructions[i].srcs[0].register
+				if nesting:
+					raise TokenStreamError("label inside a flow block at offset 0x%X" % instructions[i].offset)
+			functionOf[i] = function
+			loopOf[i] = loops[-1] if loops else None
+			if op == D3DSIO_IF or op == D3DSIO_IFC:
+				nesting.append(i)
+			elif op == D3DSIO_LOOP or op == D3DSIO_REP:
+				loop = Loop(i, loopOf[i])
+				if loop.parent is not None:
+					loop.parent.children.append(loop)
+				self.loops.append(loop)
+				loops.append(loop)
+				nesting.append(i)
+			elif op == D3DSIO_ELSE:
+				if not nesting or instructions[nesting[-1]].token.op not in (D3DSIO_IF, D3DSIO_IFC):
+					raise TokenStreamError("else without if at offset 0x%X" % instructions[i].offset)
+				match[nesting[-1]] = i
+				nesting[-1] = i
+			elif op == D3DSIO_ENDIF:
+				if not nesting or instructions[nesting[-1]].token.op not in (D3DSIO_IF, D3DSIO_IFC, D3DSIO_ELSE):
+					raise TokenStreamError("endif without if at offset 0x%X" % instructions[i].offset)
+				match[nesting.pop()] = i
+			elif op == D3DSIO_ENDLOOP or op == D3DSIO_ENDREP:
+				opener = D3DSIO_LOOP if op == D3DSIO_ENDLOOP else D3DSIO_REP
+				if not nesting or instructions[nesting[-1]].token.op != opener:
+					raise TokenStreamError("%s without %s at offset 0x%X" % (D3DSIO[op]['op'], D3DSIO[opener]['op'], instructions[i].offset))
+				nesting.pop()
+				loops.pop().end = i
+			elif op == D3DSIO_BREAK or op == D3DSIO_BREAKC or op == D3DSIO_BREAKP:
+				if not loops:
+					raise TokenStreamError("%s outside a loop at offset 0x%X" % (D3DSIO[op]['op'], instructions[i].offset))
+		if nesting:
+			raise TokenStreamError("Unterminated %s at offset 0x%X" % (D3DSIO[instructions[nesting[-1]].token.op]['op'], instructions[nesting[-1]].offset))
+		self.flow_targets.update(match)
+		for loop in self.loops:
+			self.flow_targets[loop.start] = loop.end
+			self.flow_targets[loop.end] = loop.start
 
-class SetpInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+		blocks = self.blocks
+		blockOf = self.block_of
+		for i in xrange(count):
+			if leaders[i]:
+				if blocks:
+					blocks[-1].end = i
+				blocks.append(BasicBlock(len(blocks), i, count, loopOf[i], functionOf[i]))
+				if not self.functions or instructions[i].token.op == D3DSIO_LABEL:
+					self.functions[functionOf[i]] = len(blocks) - 1
+					self.calls[functionOf[i]] = []
+			blockOf.append(len(blocks) - 1)
 
-class SgeInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
+		def block_at(index):
+			if index >= count:
+				return None
+			return blockOf[index]
+		for block in blocks:
+			i = block.last()
+			inst = instructions[i]
+			op = inst.token.op
+			targets = []
+			fallthrough = op not in (D3DSIO_ELSE, D3DSIO_BREAK, D3DSIO_RET, D3DSIO_END)
+			if op == D3DSIO_IF or op == D3DSIO_IFC:
+				other = match[i]
+				if instructions[other].token.op == D3DSIO_ELSE:
+					other += 1
+				targets.append(block_at(other))
+			elif op == D3DSIO_ELSE:
+				targets.append(block_at(match[i]))
+			elif op == D3DSIO_LOOP or op == D3DSIO_REP:
+				# The iteration count can be zero
+				targets.append(block_at(loopOf[i + 1].end + 1))
+			elif op == D3DSIO_ENDLOOP or op == D3DSIO_ENDREP:
+				targets.append(block_at(loopOf[i].start + 1))
+			elif op == D3DSIO_BREAK or op == D3DSIO_BREAKC or op == D3DSIO_BREAKP:
+				targets.append(block_at(loopOf[i].end + 1))
+			elif op == D3DSIO_CALL or op == D3DSIO_CALLNZ:
+				self.calls[block.function].append((block.index, inst.srcs[0].register))
+			if fallthrough and block.index + 1 < len(blocks) and blocks[block.index + 1].function == block.function:
+				targets.insert(0, block.index + 1)
+			for target in targets:
+				if target is not None and target not in block.successors:
+					block.successors.append(target)
+					blocks[target].predecessors.append(block.index)
+	def block_for(self, index):
+		"""Block holding the instruction at index"""
+		return self.blocks[self.block_of[index]]
+	def callees(self, function=None):
+		"""Labels called from function, in order of first call"""
+		labels = []
+		for blockIndex, label in self.calls.get(function, ()):
+			if label not in labels:
+				labels.append(label)
+		return labels
+	def call_graph(self):
+		"""Function -> list of called labels"""
+		return OrderedDict([(function, self.callees(function)) for function in self.functions])
+	def interprocedural_successors(self):
+		"""Block successor lists where calls enter the called subroutine and its rets return to every call site"""
+		successors = [list(block.successors) for block in self.blocks]
+		returnSites = {}
+		for function, calls in self.calls.items():
+			for blockIndex, label in calls:
+				if label not in self.functions:
+					continue
+				block = self.blocks[blockIndex]
+				returnSites.setdefault(label, []).extend(block.successors)
+				if self.instructions[block.last()].token.op == D3DSIO_CALL:
+					successors[blockIndex] = []
+				if self.functions[label] not in successors[blockIndex]:
+					successors[blockIndex].append(self.functions[label])
+		for block in self.blocks:
+			if block.function is not None and self.instructions[block.last()].token.op == D3DSIO_RET:
+				for site in returnSites.get(block.function, ()):
+					if site not in successors[block.index]:
+						successors[block.index].append(site)
+		return successors
 	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+		lines = []
+		for block in self.blocks:
+			first = self.instructions[block.start]
+			function = "main" if block.function is None else "l%d" % block.function
+			lines.append("block %d: 0x%X-0x%X %s depth %d -> %s" % (block.index, first.offset, self.instructions[block.last()].offset,
+				function, block.loop_depth(), ", ".join([str(target) for target in block.successors]) or "exit"))
+		for function, labels in self.call_graph().items():
+			if labels:
+				lines.append("%s calls %s" % ("main" if function is None else "l%d" % function, ", ".join(["l%d" % label for label in labels])))
+		return "\n".join(lines)
 
-class SgnInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string())
+# Dataflow analysis
+# Sets are ints used as bitsets. Temporaries are tracked per component, bit 4 * register + component
 
-class SinCosInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Opcodes whose sources are read one component per written destination component
+PER_COMPONENT_OPS = frozenset([D3DSIO_MOV, D3DSIO_ADD, D3DSIO_SUB, D3DSIO_MAD, D3DSIO_MUL, D3DSIO_MIN, D3DSIO_MAX,
+	D3DSIO_SLT, D3DSIO_SGE, D3DSIO_LRP, D3DSIO_FRC, D3DSIO_SGN, D3DSIO_ABS, D3DSIO_MOVA, D3DSIO_CND, D3DSIO_CMP,
+	D3DSIO_DSX, D3DSIO_DSY, D3DSIO_SETP])
+# Source components read by the other fixed-width opcodes before swizzling, anything not listed reads all four
+READ_COMPONENTS = {
+	D3DSIO_DP3: 0x7,
+	D3DSIO_DP4: 0xf,
+	D3DSIO_DP2ADD: 0x3,
+	D3DSIO_NRM: 0x7,
+	D3DSIO_CRS: 0x7,
+	D3DSIO_LIT: 0xb,
+	D3DSIO_M4x4: 0xf,
+	D3DSIO_M4x3: 0xf,
+	D3DSIO_M3x4: 0x7,
+	D3DSIO_M3x3: 0x7,
+	D3DSIO_M3x2: 0x7
+}
+# Matrix opcodes read this many consecutive registers starting at their second source
+MATRIX_ROWS = {
+	D3DSIO_M4x4: 4,
+	D3DSIO_M4x3: 3,
+	D3DSIO_M3x4: 4,
+	D3DSIO_M3x3: 3,
+	D3DSIO_M3x2: 2
+}
 
-class SltInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+def build_swizzle_reads():
+	"""SWIZZLE_READS[swizzle][mask]: register components a source swizzle reads for the given components"""
+	table = []
+	for swizzle in xrange(256):
+		reads = []
+		for mask in xrange(16):
+			read = 0
+			for component in xrange(4):
+				if mask & (1 << component):
+					read |= 1 << ((swizzle >> (2 * component)) & 0x3)
+			reads.append(read)
+		table.append(reads)
+	return table
 
-class SubInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+SWIZZLE_READS = build_swizzle_reads()
 
-class TexInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+def temp_accesses(inst):
+	"""(use bits, def bits, kill bits) of the temporaries an instruction reads and writes
 
-class TexBemInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	A predicated write may not happen, so it defines its components without killing them"""
+	op = inst.token.op
+	uses = 0
+	defs = 0
+	dst = inst.dst
+	if op == D3DSIO_TEXKILL:
+		# texkill tests the components of its destination operand, nothing is written
+		if dst.register_type == D3DSPR_TEMP:
+			return (dst.write_mask << (4 * dst.register), 0, 0)
+		return (0, 0, 0)
+	if dst is not None and dst.register_type == D3DSPR_TEMP:
+		defs = dst.write_mask << (4 * dst.register)
+	if op in PER_COMPONENT_OPS and dst is not None:
+		components = dst.write_mask
+	else:
+		components = READ_COMPONENTS.get(op, 0xf)
+	rows = MATRIX_ROWS.get(op, 1)
+	for i, src in enumerate(inst.srcs):
+		if src.register_type != D3DSPR_TEMP:
+			continue
+		read = SWIZZLE_READS[src.read_mask][components]
+		if i == 1 and rows > 1:
+			for row in xrange(rows):
+				uses |= read << (4 * (src.register + row))
+		else:
+			uses |= read << (4 * src.register)
+	if inst.token.predicated:
+		return (uses, defs, 0)
+	return (uses, defs, defs)
 
-class TexBemlInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def solve_dataflow(successors, summaries, forward):
+	"""Worklist solver for gen/kill bitset problems joined by union
 
-class TexCoordInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(self.dst), self.dst.to_string())
+	successors[b] lists the blocks following block b, summaries[b] is its (gen, kill) pair.
+	Returns (entry facts, exit facts) of every block"""
+	count = len(successors)
+	predecessors = [[] for b in xrange(count)]
+	for b in xrange(count):
+		for successor in successors[b]:
+			predecessors[successor].append(b)
+	if forward:
+		sources, targets = predecessors, successors
+		worklist = deque(xrange(count))
+	else:
+		sources, targets = successors, predecessors
+		worklist = deque(xrange(count - 1, -1, -1))
+	incoming = [0] * count
+	outgoing = [0] * count
+	queued = [True] * count
+	while worklist:
+		b = worklist.popleft()
+		queued[b] = False
+		fact = 0
+		for source in sources[b]:
+			fact |= outgoing[source]
+		incoming[b] = fact
+		gen, kill = summaries[b]
+		fact = gen | (fact & ~kill)
+		if fact != outgoing[b]:
+			outgoing[b] = fact
+			for target in targets[b]:
+				if not queued[target]:
+					queued[target] = True
+					worklist.append(target)
+	if forward:
+		return (incoming, outgoing)
+	return (outgoing, incoming)
 
-class TexDepthInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(self.dst), self.dst.to_string())
+# Bit 0 of every register's nibble, for all 2048 register numbers a parameter token can hold
+REGISTER_BITS = int('1' * 2048, 16)
 
-class TexDp3Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def register_bits(components):
+	"""Bitset of the registers with any component set, bit 4 * register"""
+	return (components | (components >> 1) | (components >> 2) | (components >> 3)) & REGISTER_BITS
 
-class TexDp3TexInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def count_bits(bits):
+	return bin(bits).count('1')
 
-class TexKillInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-	def to_string(self):
-		return "%s %s" % (self.mnemonic(self.dst), self.dst.to_string())
+def iter_bits(bits):
+	"""Indices of the set bits, lowest first"""
+	while bits:
+		low = bits & -bits
+		yield low.bit_length() - 1
+		bits ^= low
 
-class TexLddInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-		self.src2, offset = get_source_param(stream, offset)
-		self.src3, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string(), self.src2.to_string(), self.src3.to_string())
+class Liveness(object):
+	"""Live temporary components before and after every instruction of a program
 
-class TexLdlInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+	Calls and rets are followed into and out of subroutines"""
+	def __init__(self, program):
+		self.program = program
+		cfg = program.control_flow()
+		instructions = program.instructions
+		self.accesses = [temp_accesses(inst) for inst in instructions]
+		summaries = []
+		for block in cfg.blocks:
+			gen = 0
+			kill = 0
+			for i in xrange(block.end - 1, block.start - 1, -1):
+				uses, defs, kills = self.accesses[i]
+				gen = uses | (gen & ~kills)
+				kill |= kills
+			summaries.append((gen, kill))
+		self.block_in, self.block_out = solve_dataflow(cfg.interprocedural_successors(), summaries, False)
+		self.live_in = [0] * len(instructions)
+		self.live_out = [0] * len(instructions)
+		for block in cfg.blocks:
+			live = self.block_out[block.index]
+			for i in xrange(block.end - 1, block.start - 1, -1):
+				self.live_out[i] = live
+				uses, defs, kills = self.accesses[i]
+				live = uses | (live & ~kills)
+				self.live_in[i] = live
+	def live_registers(self, index):
+		"""Temporary register numbers live before the instruction at index"""
+		return [bit // 4 for bit in iter_bits(register_bits(self.live_in[index]))]
+	def peak_pressure(self):
+		"""(most temporaries live at once, index of the first instruction where that happens)"""
+		peak = 0
+		where = None
+		for i, live in enumerate(self.live_in):
+			count = count_bits(register_bits(live))
+			if count > peak:
+				peak = count
+				where = i
+		return (peak, where)
+	def dead_writes(self):
+		"""[(instruction index, dead component bits)] for temporary writes that are never read"""
+		dead = []
+		for i, (uses, defs, kills) in enumerate(self.accesses):
+			if defs and defs & ~self.live_out[i]:
+				dead.append((i, defs & ~self.live_out[i]))
+		return dead
 
-class TexM3x2DepthInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+class DefUseChains(object):
+	"""Reaching definitions of temporaries joined to their uses, per component
 
-class TexM3x2PadInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	uses maps a defining instruction index to the instruction indices reading its result,
+	defs maps a reading instruction index to the indices of the definitions it may read"""
+	def __init__(self, program):
+		cfg = program.control_flow()
+		instructions = program.instructions
+		accesses = [temp_accesses(inst) for inst in instructions]
+		# Definition site bits: 4 * site number + component, and the sites writing each temporary component
+		sites = []
+		siteBits = []
+		sitesOf = {}
+		for i, (uses, defs, kills) in enumerate(accesses):
+			bits = 0
+			if defs:
+				site = len(sites)
+				sites.append(i)
+				register = (defs.bit_length() - 1) // 4
+				bits = (defs >> (4 * register)) << (4 * site)
+				for component in iter_bits(defs):
+					sitesOf[component] = sitesOf.get(component, 0) | (1 << (4 * site + (component & 3)))
+			siteBits.append(bits)
+		# Instructions mostly touch the same few registers, so the component -> sites unions are shared
+		unions = {0: 0}
+		def sites_for(components):
+			bits = unions.get(components)
+			if bits is None:
+				bits = 0
+				for component in iter_bits(components):
+					bits |= sitesOf.get(component, 0)
+				unions[components] = bits
+			return bits
+		killBits = [sites_for(kills) for uses, defs, kills in accesses]
+		summaries = []
+		for block in cfg.blocks:
+			gen = 0
+			kill = 0
+			for i in xrange(block.start, block.end):
+				gen = siteBits[i] | (gen & ~killBits[i])
+				kill |= killBits[i]
+			summaries.append((gen, kill))
+		blockIn, blockOut = solve_dataflow(cfg.interprocedural_successors(), summaries, True)
+		self.uses = OrderedDict([(i, []) for i in sites])
+		self.defs = OrderedDict()
+		for block in cfg.blocks:
+			reaching = blockIn[block.index]
+			for i in xrange(block.start, block.end):
+				uses = accesses[i][0]
+				if uses:
+					# One bit per reaching site, in program order
+					defs = [sites[bit // 4] for bit in iter_bits(register_bits(reaching & sites_for(uses)))]
+					self.defs[i] = defs
+					for d in defs:
+						self.uses[d].append(i)
+				reaching = siteBits[i] | (reaching & ~killBits[i])
+		for d in self.uses:
+			self.uses[d].sort()
+	def undefined_reads(self):
+		"""Instruction indices reading a temporary no definition reaches"""
+		return [i for i, defs in self.defs.items() if not defs]
 
-class TexM3x2TexInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Streaming decoding
 
-class TexM3x3Instruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def token_reader(source, start=0):
+	"""Function reading the next count tokens from a file object or a buffer (bytes, mmap, memoryview)
 
-class TexM3x3PadInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	Buffers are read in place from byte offset start. Returns fewer tokens than asked for at the end of the data"""
+	# mmap objects have a file-like read() too, but are read in place like any other buffer
+	if hasattr(source, 'read') and not isinstance(source, mmap.mmap):
+		def read(count):
+			data = source.read(count * 4)
+			return struct.unpack('<%dI' % (len(data) // 4), data[:len(data) & ~3])
+		return read
+	position = [start]
+	size = len(source)
+	def read(count):
+		offset = position[0]
+		count = min(count, (size - offset) // 4)
+		position[0] = offset + count * 4
+		return struct.unpack_from('<%dI' % count, source, offset)
+	return read
 
-class TexM3x3SpecInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src0, offset = get_source_param(stream, offset)
-		self.src1, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src0.to_string(), self.src1.to_string())
+def iter_instructions(source, ctx=None, start=0):
+	"""Yield the instructions of one shader as they are decoded from a file object or a buffer
 
-class TexM3x3TexInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	The version token is read first and stored in ctx when one is given. Reading stops right after
+	D3DSIO_END, so a file object is left positioned on whatever follows the shader.
+	For buffers the shader starts at byte offset start, instruction offsets are relative to it."""
+	read = token_reader(source, start)
+	version = get_version(read(1))
+	if ctx is not None:
+		ctx.set_version(version)
+	offset = 4
+	while True:
+		tokens = read(1)
+		if not tokens:
+			return
+		token = InstructionToken(tokens[0])
+		count = token.token_count()
+		if count > 1:
+			tokens += read(count - 1)
+			if len(tokens) < count:
+				raise TokenStreamError("Truncated instruction at offset 0x%X" % offset)
+		inst = token.create_instruction(tokens, 0)
+		inst.offset = offset
+		if ctx is not None and token.op == D3DSIO_COMMENT and inst.constant_table is not None:
+			ctx.constant_table = inst.constant_table
+		yield inst
+		if token.is_exit():
+			return
+		offset += count * 4
 
-class TexM3x3VSpecInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+def decode_stream(source, start=0):
+	"""Decode one shader from a file object or from a buffer at byte offset start into a Program"""
+	ctx = DisassemblyContext()
+	instructions = list(iter_instructions(source, ctx, start))
+	return Program(ctx.version(), instructions)
 
-class TexReg2ARInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+# Characters of listing text collected before they are written out
+OUTPUT_CHUNK = 64 * 1024
 
-class TexReg2GBInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		#data = struct.unpack('<II', stream[offset+4:offset+12])
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+class ListingWriter(object):
+	"""Collects listing lines and writes them to out in chunks of about chunkSize characters
 
-class TexReg2RGBInstruction(Instruction):
-	def __init__(self, token):
-		Instruction.__init__(self, token)
-	def load(self, stream, offset):
-		data = struct.unpack('<II', stream[offset+4:offset+12])
-		offset += 4
-		self.dst, offset = get_destination_param(stream, offset)
-		self.src, offset = get_source_param(stream, offset)
-	def to_string(self):
-		return "%s %s, %s" % (self.mnemonic(self.dst), self.dst.to_string(), self.src.to_string())
+	out is anything with a write method, or a socket. With chunkSize None nothing is written before flush(),
+	so the whole listing goes out in a single call"""
+	def __init__(self, out=None, chunkSize=OUTPUT_CHUNK):
+		if out is None:
+			out = sys.stdout
+		self.write = getattr(out, 'write', None) or out.sendall
+		self.chunk_size = chunkSize
+		self.lines = []
+		self.pending = 0
+	def add(self, line):
+		self.lines.append(line)
+		self.pending += len(line) + 1
+		if self.chunk_size is not None and self.pending >= self.chunk_size:
+			self.flush()
+	def add_text(self, text):
+		"""Add text made of whole lines, each ending in a newline"""
+		self.add(text[:-1] if text.endswith("\n") else text)
+	def flush(self):
+		if self.lines:
+			self.lines.append('')
+			self.write("\n".join(self.lines))
+			self.lines = []
+			self.pending = 0
 
-# Get the next instruction from the bytecode stream
-def get_instruction(stream, offset):
-	instTokenValue = struct.unpack('<I', stream[offset:offset+4])[0]
-	instToken = InstructionToken(instTokenValue)
-	inst = instToken.create_instruction(stream, offset)
-	return inst
+def disassemble_stream(source, isDebug, out=None, chunkSize=OUTPUT_CHUNK):
+	"""Write the disassembly of the shader read from source to out as it is decoded
 
-def get_source_param(stream, offset):
-	tokenValue = struct.unpack('<I', stream[offset:offset+4])[0]
-	param = SourceParameterToken(tokenValue)
-	offset += 4
-	if param.is_relative:
-		param.relative_param, offset = get_source_param(stream, offset)
-	return param, offset
+	The text goes out in chunks of about chunkSize characters, or in one write with chunkSize None.
+	Returns the number of instructions decoded"""
+	writer = ListingWriter(out, chunkSize)
+	ctx = DisassemblyContext(isDebug=isDebug)
+	count = 0
+	for inst in iter_instructions(source, ctx):
+		if count == 0:
+			writer.add(ctx.version_string())
+		if isDebug:
+			writer.add("; Offset 0x%X" % inst.offset)
+		writer.add(instruction_text(inst, ctx))
+		count += 1
+	if count == 0:
+		writer.add(ctx.version_string())
+	writer.flush()
+	return count
 
-def get_destination_param(stream, offset):
-	tokenValue = struct.unpack('<I', stream[offset:offset+4])[0]
-	param = DestinationParameterToken(tokenValue)
-	offset += 4
-	if param.is_relative:
-		param.relative_param, offset = get_destination_param(stream, offset)
-	return param, offset
+# Structured output
+# Every shader is a header record {'shader': byte offset, 'version': 'vs_3_0'} followed by one record per instruction,
+# built from the decoded objects as JSON Lines or MessagePack. The listing text is never made
 
-def get_version(stream):
-	val = struct.unpack('<I', stream[:4])[0]
-	if ((val >> 16) & 0xfffe) != 0xfffe:
-		raise TokenStreamError("Version error, unknown shader type")
-	minorVersion = val & 0xff
-	majorVersion = (val >> 8) & 0xff
-	shaderType = (val >> 16) & 0xffff
-	return (shaderType, majorVersion, minorVersion)
+OUTPUT_FORMATS = ('text', 'jsonl', 'msgpack')
+
+class RecordWriter(object):
+	"""Serializes records to out in chunks of about chunkSize bytes, as JSON Lines or MessagePack"""
+	def __init__(self, out=None, outputFormat='jsonl', chunkSize=OUTPUT_CHUNK):
+		if out is None:
+			out = sys.stdout
+		if outputFormat == 'msgpack':
+			if msgpack is None:
+				raise ImportError("MessagePack output requires the msgpack module")
+			self.encode = msgpack.Packer(use_bin_type=True).pack
+			self.empty = b''
+		elif outputFormat == 'jsonl':
+			encoder = json.JSONEncoder(separators=(',', ':'))
+			self.encode = lambda record: encoder.encode(record) + "\n"
+			self.empty = ''
+		else:
+			raise ValueError("Unknown record format %s" % outputFormat)
+		self.write = getattr(out, 'write', None) or out.sendall
+		self.chunk_size = chunkSize
+		self.chunks = []
+		self.pending = 0
+	def add(self, record):
+		data = self.encode(record)
+		self.chunks.append(data)
+		self.pending += len(data)
+		if self.chunk_size is not None and self.pending >= self.chunk_size:
+			self.flush()
+	def add_program(self, program, offset=0):
+		self.add({'shader': offset, 'version': program.context.version_string()})
+		for inst in program.instructions:
+			self.add(inst.to_record(program.context))
+	def flush(self):
+		if self.chunks:
+			self.write(self.empty.join(self.chunks))
+			self.chunks = []
+			self.pending = 0
+
+def write_records(source, out=None, outputFormat='jsonl', start=0):
+	"""Write the records of the shader read from a file object, or from a buffer at byte offset start, as it is decoded
+
+	Returns the number of instructions decoded"""
+	writer = RecordWriter(out, outputFormat)
+	ctx = DisassemblyContext()
+	count = 0
+	for inst in iter_instructions(source, ctx, start):
+		if count == 0:
+			writer.add({'shader': start, 'version': ctx.version_string()})
+		writer.add(inst.to_record(ctx))
+		count += 1
+	writer.flush()
+	return count
+
+def disassemble(bytecode, isDebug, out=None):
+	"""Write the disassembly of bytecode to out (stdout by default), returns the number of instructions decoded"""
+	program = decode(bytecode)
+	writer = ListingWriter(out, None)
+	writer.add_text(program.to_text(isDebug))
+	writer.flush()
+	return len(program.instructions)
+
+def disassemble_text(bytecode, isDebug=False):
+	"""Disassembly of bytecode as a string"""
+	return decode(bytecode).to_text(isDebug)
+
+def disassemble_many(bytecodes, jobs=4, isDebug=False):
+	"""Disassemble a list of shaders on a pool of threads, returns the listings in the same order
+
+	For callers that embed the disassembler in a long-running threaded process, use --batch for large jobs"""
+	pool = ThreadPool(jobs)
+	try:
+		return pool.map(lambda bytecode: disassemble_text(bytecode, isDebug), bytecodes)
+	finally:
+		pool.close()
+		pool.join()
+
+# Shader statistics
+# Gathered one instruction at a time while decoding, the listing text is never built
+
+TEXTURE_OPS = frozenset([D3DSIO_TEX, D3DSIO_TEXLDL, D3DSIO_TEXLDD, D3DSIO_TEXKILL, D3DSIO_TEXCOORD, D3DSIO_TEXBEM,
+	D3DSIO_TEXBEML, D3DSIO_TEXREG2AR, D3DSIO_TEXREG2GB, D3DSIO_TEXM3x2PAD, D3DSIO_TEXM3x2TEX, D3DSIO_TEXM3x3PAD,
+	D3DSIO_TEXM3x3TEX, D3DSIO_TEXM3x3DIFF, D3DSIO_TEXM3x3SPEC, D3DSIO_TEXM3x3VSPEC, D3DSIO_TEXREG2RGB, D3DSIO_TEXDP3TEX,
+	D3DSIO_TEXM3x2DEPTH, D3DSIO_TEXDP3, D3DSIO_TEXM3x3, D3DSIO_TEXDEPTH])
+FLOW_OPS = frozenset([D3DSIO_CALL, D3DSIO_CALLNZ, D3DSIO_LOOP, D3DSIO_RET, D3DSIO_ENDLOOP, D3DSIO_LABEL, D3DSIO_REP,
+	D3DSIO_ENDREP, D3DSIO_IF, D3DSIO_IFC, D3DSIO_ELSE, D3DSIO_ENDIF, D3DSIO_BREAK, D3DSIO_BREAKC, D3DSIO_BREAKP])
+DECLARATION_OPS = frozenset([D3DSIO_DCL, D3DSIO_DEF, D3DSIO_DEFB, D3DSIO_DEFI])
+OTHER_OPS = frozenset([D3DSIO_NOP, D3DSIO_PHASE, D3DSIO_END])
+
+# Approximate instruction slots taken by the opcodes that do not take exactly one, after the D3D9 slot tables
+# Macros expand to several instructions, flow control counts against the arithmetic slots
+SLOT_COSTS = {
+	D3DSIO_M4x4: 4,
+	D3DSIO_M4x3: 3,
+	D3DSIO_M3x4: 4,
+	D3DSIO_M3x3: 3,
+	D3DSIO_M3x2: 2,
+	D3DSIO_SINCOS: 8,
+	D3DSIO_LIT: 3,
+	D3DSIO_NRM: 3,
+	D3DSIO_POW: 3,
+	D3DSIO_SGN: 3,
+	D3DSIO_CRS: 2,
+	D3DSIO_LRP: 2,
+	D3DSIO_DP2ADD: 2,
+	D3DSIO_TEXLDL: 2,
+	D3DSIO_TEXLDD: 3,
+	D3DSIO_IF: 3,
+	D3DSIO_IFC: 3,
+	D3DSIO_LOOP: 3,
+	D3DSIO_ENDLOOP: 2,
+	D3DSIO_REP: 3,
+	D3DSIO_ENDREP: 2,
+	D3DSIO_BREAKC: 3,
+	D3DSIO_BREAKP: 3,
+	D3DSIO_CALL: 2,
+	D3DSIO_CALLNZ: 3,
+	D3DSIO_LABEL: 0,
+	D3DSIO_NOP: 0,
+	D3DSIO_PHASE: 0,
+	D3DSIO_END: 0
+}
+
+# First register number of the upper constant register banks
+CONST_BANK_BASE = {
+	D3DSPR_CONST2: 2048,
+	D3DSPR_CONST3: 4096,
+	D3DSPR_CONST4: 6144
+}
+
+def opcode_class(op):
+	if op in TEXTURE_OPS:
+		return 'texture'
+	if op in FLOW_OPS:
+		return 'flow'
+	if op in DECLARATION_OPS:
+		return 'declaration'
+	if op == D3DSIO_COMMENT:
+		return 'comment'
+	if op in OTHER_OPS:
+		return 'other'
+	return 'arithmetic'
+
+class ShaderStats(object):
+	"""Instruction, slot, register and flow control counts of one shader, fed one instruction at a time by add()"""
+	def __init__(self, ctx):
+		self.context = ctx
+		self.size = 4
+		self.classes = dict([(name, 0) for name in ('arithmetic', 'texture', 'flow', 'declaration', 'comment', 'other')])
+		self.opcodes = {}
+		self.alu_slots = 0
+		self.texture_slots = 0
+		self.registers = {}
+		self.samplers = {}
+		self.depth = 0
+		self.flow_depth = 0
+		self.loops = 0
+		self.loop_depth = 0
+	def add(self, inst):
+		op = inst.token.op
+		opClass = opcode_class(op)
+		self.classes[opClass] += 1
+		self.size = inst.offset + inst.size()
+		if opClass == 'declaration':
+			self.add_declaration(inst)
+			return
+		if opClass == 'comment':
+			return
+		name = inst.token.mnemonic()
+		self.opcodes[name] = self.opcodes.get(name, 0) + 1
+		if opClass == 'texture':
+			self.texture_slots += SLOT_COSTS.get(op, 1)
+		else:
+			self.alu_slots += SLOT_COSTS.get(op, 1)
+		for param in inst.operands():
+			self.add_register(param)
+			if param.register_type == D3DSPR_SAMPLER:
+				self.sampler(param.register)['samples'] += 1
+		if inst.predicate is not None:
+			self.add_register(inst.predicate)
+		if op == D3DSIO_IF or op == D3DSIO_IFC or op == D3DSIO_LOOP or op == D3DSIO_REP:
+			self.depth += 1
+			self.flow_depth = max(self.flow_depth, self.depth)
+			if op == D3DSIO_LOOP or op == D3DSIO_REP:
+				self.loops += 1
+				self.loop_depth = max(self.loop_depth, self.loops)
+		elif op == D3DSIO_ENDIF or op == D3DSIO_ENDLOOP or op == D3DSIO_ENDREP:
+			self.depth = max(0, self.depth - 1)
+			if op != D3DSIO_ENDIF:
+				self.loops = max(0, self.loops - 1)
+	def add_declaration(self, inst):
+		self.add_register(inst.dst)
+		if inst.token.op == D3DSIO_DCL and inst.dst.register_type == D3DSPR_SAMPLER:
+			self.sampler(inst.dst.register)['type'] = D3DSTT.get(inst.texture_type, D3DSTT[D3DSTT_UNKNOWN])['text']
+	def add_register(self, param):
+		name = self.context.register_mnemonics.get(param.register_type, 'type%d' % param.register_type)
+		register = param.register + CONST_BANK_BASE.get(param.register_type, 0)
+		self.registers[name] = max(self.registers.get(name, -1), register)
+		if param.is_relative and param.relative_param is not None:
+			self.add_register(param.relative_param)
+	def sampler(self, register):
+		key = "s%d" % register
+		if key not in self.samplers:
+			self.samplers[key] = {'type': None, 'samples': 0}
+		return self.samplers[key]
+	def to_dict(self):
+		return {
+			'version': self.context.version_string(),
+			'bytes': self.size,
+			'instructions': sum(self.classes.values()) - self.classes['comment'],
+			'classes': self.classes,
+			'opcodes': self.opcodes,
+			'slots': {'alu': self.alu_slots, 'texture': self.texture_slots, 'total': self.alu_slots + self.texture_slots},
+			'registers': self.registers,
+			'samplers': self.samplers,
+			'flow_depth': self.flow_depth,
+			'loop_depth': self.loop_depth
+		}
+	def to_json(self):
+		return json.dumps(self.to_dict(), sort_keys=True)
+
+def shader_stats(source, start=0):
+	"""ShaderStats of one shader from a file object or a buffer at byte offset start, gathered as it is decoded"""
+	ctx = DisassemblyContext()
+	stats = ShaderStats(ctx)
+	for inst in iter_instructions(source, ctx, start):
+		stats.add(inst)
+	return stats
+
+# Peephole optimization
+# Passes over the decoded instruction objects. Changed instructions are copies, the input program is left as it is.
+# Pixel shaders before ps_2_0 are not touched: r0 is their output and their instructions pair up
+
+# Source modifiers applied to each component on its own, the ones a mov can pass on to the instructions reading it
+PER_COMPONENT_MODIFIERS = frozenset([0, 1, 2, 3, 4, 5, 6, 7, 8, 11, 12])
+# (modifier of the value, modifier applied on top of it) -> single modifier doing both, for neg, abs and -abs
+COMBINED_MODIFIERS = {
+	(1, 1): 0,
+	(1, 11): 11,
+	(1, 12): 12,
+	(11, 1): 12,
+	(11, 11): 11,
+	(11, 12): 12,
+	(12, 1): 11,
+	(12, 11): 11,
+	(12, 12): 12
+}
+# Arithmetic opcodes whose sources can read any register, with any swizzle
+FOLDABLE_OPS = PER_COMPONENT_OPS | frozenset(READ_COMPONENTS) | frozenset([D3DSIO_RCP, D3DSIO_RSQ, D3DSIO_EXP,
+	D3DSIO_EXPP, D3DSIO_LOG, D3DSIO_LOGP, D3DSIO_DST, D3DSIO_POW])
+# Register types a folded mov source may have
+FOLDABLE_REGISTER_TYPES = frozenset([D3DSPR_TEMP, D3DSPR_INPUT, D3DSPR_CONST, D3DSPR_CONST2, D3DSPR_CONST3, D3DSPR_CONST4])
+
+def compose_swizzle(inner, outer):
+	"""Swizzle reading through outer what inner picked"""
+	swizzle = 0
+	for component in xrange(4):
+		picked = (outer >> (2 * component)) & 0x3
+		swizzle |= ((inner >> (2 * picked)) & 0x3) << (2 * component)
+	return swizzle
+
+def identity_swizzle(swizzle, components):
+	"""True when swizzle leaves every component in components where it is"""
+	for component in xrange(4):
+		if components & (1 << component) and (swizzle >> (2 * component)) & 0x3 != component:
+			return False
+	return True
+
+def combine_modifiers(inner, outer):
+	"""Modifier doing inner then outer, or None when there is none"""
+	if outer == 0:
+		return inner if inner in PER_COMPONENT_MODIFIERS else None
+	if inner == 0:
+		return outer
+	return COMBINED_MODIFIERS.get((inner, outer))
+
+def source_components(inst):
+	"""Components of each source an instruction reads before swizzling"""
+	if inst.token.op in PER_COMPONENT_OPS and inst.dst is not None:
+		return inst.dst.write_mask
+	return READ_COMPONENTS.get(inst.token.op, 0xf)
+
+def operand_registers(srcs, registerTypes):
+	return set([(src.register_type, src.register) for src in srcs if src.register_type in registerTypes])
+
+def exceeds_read_limits(before, after):
+	"""True when after reads more distinct constant or input registers than allowed and than before did"""
+	for registerTypes in (CONST_REGISTER_TYPES, (D3DSPR_INPUT,)):
+		count = len(operand_registers(after, registerTypes))
+		if count > 1 and count > len(operand_registers(before, registerTypes)):
+			return True
+	return False
+
+def with_sources(inst, srcs):
+	result = copy.copy(inst)
+	result.srcs = tuple(srcs)
+	return result
+
+def has_relative_temps(program):
+	"""True when a temporary is addressed relatively, the dataflow analyses only see direct accesses"""
+	for inst in program.instructions:
+		for param in inst.operands():
+			if param.is_relative and param.register_type == D3DSPR_TEMP:
+				return True
+	return False
+
+def optimize_swizzles(program):
+	"""Drop source swizzles that pick every component they are read for from its own place, and movs of a temporary to itself"""
+	instructions = []
+	changes = 0
+	for inst in program.instructions:
+		op = inst.token.op
+		if op in FOLDABLE_OPS:
+			components = source_components(inst)
+			srcs = list(inst.srcs)
+			for i, src in enumerate(srcs):
+				if src.read_mask != 0xE4 and identity_swizzle(src.read_mask, components) and not (i == 1 and op in MATRIX_ROWS):
+					srcs[i] = copy.copy(src)
+					srcs[i].read_mask = 0xE4
+					changes += 1
+			if srcs != list(inst.srcs):
+				inst = with_sources(inst, srcs)
+			if op == D3DSIO_MOV and inst.predicate is None:
+				src = inst.srcs[0]
+				dst = inst.dst
+				if (src.register_type == dst.register_type and src.register == dst.register and src.read_mask == 0xE4 and
+					not src.source_modifier and not src.is_relative and not dst.is_relative and not dst.result_modifier & 0x1 and not dst.shift_scale):
+					changes += 1
+					continue
+		instructions.append(inst)
+	return instructions, changes
 
-def disassemble(bytecode, isDebug):
-	global gCurrentShaderType
-	shaderType, majorVersion, minorVersion = get_version(bytecode)
-	gCurrentShaderType = shaderType
-	print "%s_%d_%d" % (('vs' if (shaderType == SHADERTYPE_VERTEX) else 'ps'), majorVersion, minorVersion)
+def foldable_move(inst):
+	"""True for a plain mov of a register into a temporary, which its readers can read the source of instead"""
+	if inst.token.op != D3DSIO_MOV or inst.predicate is not None:
+		return False
+	dst = inst.dst
+	src = inst.srcs[0]
+	if dst.register_type != D3DSPR_TEMP or dst.is_relative or dst.result_modifier & 0x1 or dst.shift_scale:
+		return False
+	if src.is_relative or src.register_type not in FOLDABLE_REGISTER_TYPES or src.source_modifier not in PER_COMPONENT_MODIFIERS:
+		return False
+	return not (src.register_type == D3DSPR_TEMP and src.register == dst.register)
+
+def fold_moves(program):
+	"""Read the source of a mov in place of its result, in the instructions of the same basic block"""
+	instructions = list(program.instructions)
+	changes = 0
+	for block in program.control_flow().blocks:
+		for i in xrange(block.start, block.end):
+			move = instructions[i]
+			if not foldable_move(move):
+				continue
+			target = move.dst
+			source = move.srcs[0]
+			for j in xrange(i + 1, block.end):
+				inst = instructions[j]
+				if inst.token.op in FOLDABLE_OPS:
+					components = source_components(inst)
+					srcs = list(inst.srcs)
+					for k, src in enumerate(srcs):
+						if src.register_type != D3DSPR_TEMP or src.register != target.register or src.is_relative:
+							continue
+						if (k == 1 and inst.token.op in MATRIX_ROWS) or SWIZZLE_READS[src.read_mask][components] & ~target.write_mask:
+							continue
+						modifier = combine_modifiers(source.source_modifier, src.source_modifier)
+						if modifier is None:
+							continue
+						folded = copy.copy(source)
+						folded.read_mask = compose_swizzle(source.read_mask, src.read_mask)
+						folded.source_modifier = modifier
+						srcs[k] = folded
+					if srcs != list(inst.srcs) and not exceeds_read_limits(inst.srcs, srcs):
+						changes += 1
+						inst = instructions[j] = with_sources(inst, srcs)
+				dst = inst.dst
+				if dst is not None and dst.register_type == D3DSPR_TEMP and inst.token.op not in DECLARATION_OPS:
+					if dst.register == target.register or (source.register_type == D3DSPR_TEMP and dst.register == source.register):
+						break
+	return instructions, changes
+
+def fuse_mads(program):
+	"""Turn mul followed by an add that is the only reader of its result into a mad, the mul is then a dead write"""
+	if has_relative_temps(program):
+		return program.instructions, 0
+	instructions = list(program.instructions)
+	chains = DefUseChains(program)
+	changes = 0
+	for block in program.control_flow().blocks:
+		for i in xrange(block.start, block.end):
+			mul = instructions[i]
+			dst = mul.dst
+			if mul.token.op != D3DSIO_MUL or mul.predicate is not None or dst.register_type != D3DSPR_TEMP:
+				continue
+			if dst.is_relative or dst.result_modifier & 0x1 or dst.shift_scale:
+				continue
+			if [src for src in mul.srcs if src.is_relative or (src.register_type == D3DSPR_TEMP and src.register == dst.register)]:
+				continue
+			users = chains.uses.get(i, [])
+			if len(users) != 1 or not i < users[0] < block.end or instructions[users[0]].token.op != D3DSIO_ADD:
+				continue
+			j = users[0]
+			add = instructions[j]
+			product = [k for k, src in enumerate(add.srcs) if src.register_type == D3DSPR_TEMP and src.register == dst.register]
+			if len(product) != 1 or add.srcs[product[0]].is_relative:
+				continue
+			src = add.srcs[product[0]]
+			if SWIZZLE_READS[src.read_mask][add.dst.write_mask] & ~dst.write_mask or src.source_modifier not in (0, 1):
+				continue
+			# The factors must still hold their values at the add, and every component the add reads must come from
+			# the mul: a write to the product register in between means the add reads that write for some components
+			overwritten = False
+			for inst in instructions[i + 1:j]:
+				if inst.dst is not None and inst.dst.register_type == D3DSPR_TEMP:
+					if inst.dst.register == dst.register:
+						overwritten = True
+					for factor in mul.srcs:
+						if factor.register_type == D3DSPR_TEMP and factor.register == inst.dst.register:
+							overwritten = True
+			if overwritten:
+				continue
+			factors = [copy.copy(factor) for factor in mul.srcs]
+			for factor in factors:
+				factor.read_mask = compose_swizzle(factor.read_mask, src.read_mask)
+			if src.source_modifier:
+				factors[0].source_modifier = combine_modifiers(factors[0].source_modifier, 1)
+				if factors[0].source_modifier is None:
+					continue
+			srcs = factors + [add.srcs[1 - product[0]]]
+			if exceeds_read_limits(mul.srcs + add.srcs, srcs):
+				continue
+			mad = with_sources(add, srcs)
+			mad.token = InstructionToken(D3DSIO_MAD | (instruction_length(mad) << 24) | (add.token.predicated << 28))
+			instructions[j] = mad
+			changes += 1
+	return instructions, changes
+
+def remove_dead_writes(program):
+	"""Remove instructions whose temporary writes are never read, and narrow the write masks of partly dead ones"""
+	if has_relative_temps(program):
+		return program.instructions, 0
+	instructions = list(program.instructions)
+	removed = set()
+	changes = 0
+	for i, dead in Liveness(program).dead_writes():
+		inst = instructions[i]
+		op = inst.token.op
+		dst = inst.dst
+		if op in FLOW_OPS or op in DECLARATION_OPS or op == D3DSIO_TEXKILL or dst.is_relative:
+			continue
+		deadMask = (dead >> (4 * dst.register)) & 0xf
+		if deadMask == dst.write_mask:
+			removed.add(i)
+			changes += 1
+		elif op in PER_COMPONENT_OPS:
+			inst = instructions[i] = copy.copy(inst)
+			inst.dst = copy.copy(dst)
+			inst.dst.write_mask &= ~deadMask
+			changes += 1
+	return [inst for i, inst in enumerate(instructions) if i not in removed], changes
+
+def instruction_length(inst):
+	"""Operand DWORD count of an instruction, for the length field of its token"""
+	length = 0
+	params = list(inst.operands())
+	if inst.predicate is not None:
+		params.append(inst.predicate)
+	for param in params:
+		length += 1
+		if param.is_relative:
+			length += 1
+	return length
+
+# Pass names in the order they run, with what they count
+OPTIMIZATION_PASSES = OrderedDict([
+	('swizzles', optimize_swizzles),
+	('moves', fold_moves),
+	('mads', fuse_mads),
+	('dead_writes', remove_dead_writes)
+])
+
+def relink_program(program, instructions):
+	"""Program of the same version over instructions, with byte offsets following the new order"""
 	offset = 4
-	while offset < len(bytecode):
-		inst = get_instruction(bytecode, offset)
-		if isDebug:
-			print "; Offset 0x%X" % offset
-		print inst.to_string()
+	for inst in instructions:
+		inst.offset = offset
 		offset += inst.size()
+	return Program(program.version, instructions)
+
+def optimize(program, passes=None, rounds=16):
+	"""Run the peephole passes until they stop finding anything, returns (optimized Program, report)
+
+	The report has the instruction and slot counts before and after and how often each pass fired"""
+	if passes is None:
+		passes = list(OPTIMIZATION_PASSES)
+	before = program.stats().to_dict()
+	counts = OrderedDict([(name, 0) for name in passes])
+	result = program
+	if program.shader_type() == SHADERTYPE_VERTEX or program.version[1] >= 2:
+		# Work on copies so the offsets of the original program's instructions stay as they are
+		result = relink_program(program, [copy.copy(inst) for inst in program.instructions])
+		for i in xrange(rounds):
+			changed = False
+			for name in passes:
+				instructions, changes = OPTIMIZATION_PASSES[name](result)
+				if changes:
+					counts[name] += changes
+					result = relink_program(result, instructions)
+					changed = True
+			if not changed:
+				break
+	after = result.stats().to_dict()
+	report = OrderedDict([
+		('version', before['version']),
+		('instructions', [before['instructions'], after['instructions']]),
+		('slots', [before['slots']['total'], after['slots']['total']]),
+		('saved_slots', before['slots']['total'] - after['slots']['total']),
+		('passes', counts)
+	])
+	return result, report
+
+# SIMD interpreter
+# Runs a decoded program over a batch of N vertices or pixels at once, every register is an (N, 4) float32 array.
+# Divergent flow control runs every path with a per-lane execution mask
+
+# Component indices picked by each source swizzle, and the components kept by each write mask
+SWIZZLE_COMPONENTS = [[(swizzle >> (2 * i)) & 0x3 for i in xrange(4)] for swizzle in xrange(256)]
+WRITE_MASK_COMPONENTS = [[bool(mask & (1 << i)) for i in xrange(4)] for mask in xrange(16)]
+WRITE_COMPONENT_LISTS = [[i for i in xrange(4) if mask & (1 << i)] for mask in xrange(16)]
+REPLICATE_SWIZZLES = frozenset([0x00, 0x55, 0xAA, 0xFF])
+
+# Destination shift scale: 1-7 multiply by 2^n, 13-15 divide by 8, 4 and 2
+SHIFT_SCALES = dict([(shift, float(2 ** shift)) for shift in xrange(1, 8)] + [(shift, 2.0 ** (shift - 16)) for shift in xrange(13, 16)])
+
+OUTPUT_REGISTER_TYPES = frozenset([D3DSPR_RASTOUT, D3DSPR_ATTROUT, D3DSPR_OUTPUT, D3DSPR_COLOROUT, D3DSPR_DEPTHOUT])
+CONST_REGISTER_TYPES = frozenset([D3DSPR_CONST, D3DSPR_CONST2, D3DSPR_CONST3, D3DSPR_CONST4])
+
+def simd_scalar(value):
+	"""Component read by scalar opcodes, their sources are expected to use a replicate swizzle"""
+	return value[..., 3:4]
+
+def simd_dot(a, b, width):
+	# Summing columns beats a reduction over the short last axis
+	result = a[..., 0:1] * b[..., 0:1]
+	for i in xrange(1, width):
+		result = result + a[..., i:i + 1] * b[..., i:i + 1]
+	return result
+
+def simd_vector(x, y, z, w):
+	"""4-component values from per-component arrays or numbers"""
+	return numpy.stack(numpy.broadcast_arrays(x, y, z, w), axis=-1).astype(numpy.float32)
+
+def simd_divide(value, component):
+	result = numpy.array(value, numpy.float32)
+	result[..., :2] /= value[..., component:component + 1]
+	return result
+
+def simd_lit(a):
+	x = a[..., 0]
+	y = numpy.maximum(a[..., 1], 0.0)
+	power = numpy.clip(a[..., 3], -128.0, 128.0)
+	return simd_vector(1.0, numpy.maximum(x, 0.0), numpy.where(x > 0.0, numpy.power(y, power), 0.0), 1.0)
+
+def simd_cross(a, b):
+	c = numpy.cross(a[..., :3], b[..., :3])
+	return simd_vector(c[..., 0], c[..., 1], c[..., 2], 0.0)
+
+def simd_replicate(value, component):
+	"""Replicate swizzle as a broadcast view, cheaper than picking the same column four times"""
+	return numpy.broadcast_to(value[..., component:component + 1], value.shape)
+
+def simd_swizzle(value, swizzle):
+	if swizzle == 0xE4:
+		return value
+	components = SWIZZLE_COMPONENTS[swizzle]
+	if swizzle in REPLICATE_SWIZZLES:
+		return simd_replicate(value, components[0])
+	return value[..., components]
+
+def simd_gather(constants, index, offset):
+	"""Constant rows index + offset for a per-lane or shared offset, out of range rows read as 0"""
+	rows = index + offset
+	if numpy.ndim(rows) == 0:
+		if 0 <= rows < len(constants):
+			return constants[rows]
+		return numpy.zeros(4, numpy.float32)
+	value = constants.take(numpy.clip(rows, 0, len(constants) - 1), axis=0)
+	value[(rows < 0) | (rows >= len(constants))] = 0.0
+	return value
+
+def simd_store(target, value, mask, writeMask, predicate=None):
+	"""Write value into the (N, 4) target for the lanes in mask, the components in writeMask and those passing predicate"""
+	count = len(target)
+	value = numpy.broadcast_to(value, (count, 4))
+	if predicate is None and mask.all():
+		if writeMask == 0xf:
+			target[...] = value
+		else:
+			for component in WRITE_COMPONENT_LISTS[writeMask]:
+				target[:, component] = value[:, component]
+		return
+	where = numpy.broadcast_to(mask[:, None], (count, 4))
+	if predicate is not None:
+		where = where & numpy.broadcast_to(predicate, (count, 4))
+	for component in WRITE_COMPONENT_LISTS[writeMask]:
+		numpy.copyto(target[:, component], value[:, component], casting='unsafe', where=where[:, component])
+
+def simd_derivative(value, vertical):
+	"""dsx/dsy with the lanes grouped in 2x2 quads: top left, top right, bottom left, bottom right"""
+	if value.ndim < 2 or value.shape[0] % 4:
+		return numpy.zeros(value.shape, numpy.float32)
+	quads = value.reshape(-1, 4, value.shape[-1])
+	if vertical:
+		delta = quads[:, 2] - quads[:, 0]
+	else:
+		delta = quads[:, 1] - quads[:, 0]
+	return numpy.repeat(delta, 4, axis=0)
+
+# Source modifiers, in SOURCE_MOD_FORMAT order
+SIMD_SOURCE_MODIFIERS = {
+	1: lambda v: -v,
+	2: lambda v: v - 0.5,
+	3: lambda v: 0.5 - v,
+	4: lambda v: 2.0 * v - 1.0,
+	5: lambda v: 1.0 - 2.0 * v,
+	6: lambda v: 1.0 - v,
+	7: lambda v: 2.0 * v,
+	8: lambda v: -2.0 * v,
+	9: lambda v: simd_divide(v, 2),
+	10: lambda v: simd_divide(v, 3),
+	11: lambda v: numpy.abs(v),
+	12: lambda v: -numpy.abs(v),
+	13: lambda v: ~v
+}
+
+# setp, ifc and breakc comparisons by instruction flags
+SIMD_COMPARISONS = {
+	1: lambda a, b: a > b,
+	2: lambda a, b: a == b,
+	3: lambda a, b: a >= b,
+	4: lambda a, b: a < b,
+	5: lambda a, b: a != b,
+	6: lambda a, b: a <= b
+}
+
+# Opcodes computed from their swizzled and modified sources alone
+SIMD_OPS = {
+	D3DSIO_MOV: lambda a: a,
+	D3DSIO_ADD: lambda a, b: a + b,
+	D3DSIO_SUB: lambda a, b: a - b,
+	D3DSIO_MAD: lambda a, b, c: a * b + c,
+	D3DSIO_MUL: lambda a, b: a * b,
+	D3DSIO_RCP: lambda a: 1.0 / simd_scalar(a),
+	D3DSIO_RSQ: lambda a: 1.0 / numpy.sqrt(numpy.abs(simd_scalar(a))),
+	D3DSIO_DP3: lambda a, b: simd_dot(a, b, 3),
+	D3DSIO_DP4: lambda a, b: simd_dot(a, b, 4),
+	D3DSIO_MIN: lambda a, b: numpy.minimum(a, b),
+	D3DSIO_MAX: lambda a, b: numpy.maximum(a, b),
+	D3DSIO_SLT: lambda a, b: (a < b).astype(numpy.float32),
+	D3DSIO_SGE: lambda a, b: (a >= b).astype(numpy.float32),
+	D3DSIO_EXP: lambda a: numpy.exp2(simd_scalar(a)),
+	D3DSIO_EXPP: lambda a: numpy.exp2(simd_scalar(a)),
+	D3DSIO_LOG: lambda a: numpy.log2(numpy.abs(simd_scalar(a))),
+	D3DSIO_LOGP: lambda a: numpy.log2(numpy.abs(simd_scalar(a))),
+	D3DSIO_LIT: simd_lit,
+	D3DSIO_DST: lambda a, b: simd_vector(1.0, a[..., 1] * b[..., 1], a[..., 2], b[..., 3]),
+	D3DSIO_LRP: lambda a, b, c: a * (b - c) + c,
+	D3DSIO_FRC: lambda a: a - numpy.floor(a),
+	D3DSIO_POW: lambda a, b: numpy.power(numpy.abs(simd_scalar(a)), simd_scalar(b)),
+	D3DSIO_CRS: simd_cross,
+	D3DSIO_SGN: lambda a, b, c: numpy.sign(a),
+	D3DSIO_ABS: lambda a: numpy.abs(a),
+	D3DSIO_NRM: lambda a: a / numpy.sqrt(simd_dot(a, a, 3)),
+	D3DSIO_SINCOS: lambda a, *scratch: simd_vector(numpy.cos(simd_scalar(a)[..., 0]), numpy.sin(simd_scalar(a)[..., 0]), 0.0, 0.0),
+	D3DSIO_MOVA: lambda a: numpy.floor(a + 0.5),
+	D3DSIO_CND: lambda a, b, c: numpy.where(a > 0.5, b, c),
+	D3DSIO_CMP: lambda a, b, c: numpy.where(a >= 0.0, b, c),
+	D3DSIO_DP2ADD: lambda a, b, c: simd_dot(a, b, 2) + simd_scalar(c),
+	D3DSIO_DSX: lambda a: simd_derivative(numpy.broadcast_to(a, a.shape), False),
+	D3DSIO_DSY: lambda a: simd_derivative(numpy.broadcast_to(a, a.shape), True)
+}
+
+class Interpreter(object):
+	"""Runs a decoded Program over a batch of vertices or pixels with NumPy
+
+	Per-lane registers are (N, 4) float32 arrays, constants are shared by the whole batch.
+	if/else, loops, breaks, calls and texkill narrow a per-lane execution mask, masked lanes keep their registers.
+	dsx/dsy read the lanes as 2x2 quads in the order top left, top right, bottom left, bottom right.
+	bem, the ps_1_x texture addressing ops (texcoord, texbem, texm3x3pad and the like) and a0 relative addressing
+	of anything but constant registers raise UnsupportedInstructionError"""
+	def __init__(self, program):
+		if numpy is None:
+			raise ImportError("Interpreter requires numpy")
+		self.program = program
+		self.instructions = program.instructions
+		self.context = program.context
+		cfg = program.control_flow()
+		self.flow_targets = cfg.flow_targets
+		self.labels = dict([(label, cfg.blocks[block].start) for label, block in cfg.functions.items() if label is not None])
+		self.constant_rows = max(256, program.stats().registers.get('c', -1) + 1)
+		mnemonics = {}
+		for registerType, mnemonic in sorted(self.context.register_mnemonics.items()):
+			mnemonics.setdefault(mnemonic, registerType)
+		self.register_types = mnemonics
+		self.sampler_types = dict([(inst.dst.register, inst.texture_type) for inst in self.instructions
+			if inst.token.op == D3DSIO_DCL and inst.dst.register_type == D3DSPR_SAMPLER])
+		self.textures = {}
+		self.count = 0
+		self.registers = {}
+		self.constants = None
+		self.int_constants = {}
+		self.bool_constants = {}
+		self.killed = None
+		self.mask = None
+		self.stack = []
+		self.instruction = None
+		self.frames = []
+		self.loop_counter = 0
+	def register_key(self, name):
+		"""(register type, register) of a register name like 'v0', 'c12' or 'oDepth'"""
+		if isinstance(name, tuple):
+			return name
+		if name == 'oDepth':
+			return (D3DSPR_DEPTHOUT, 0)
+		if name == 'aL':
+			return (D3DSPR_LOOP, 0)
+		match = re.match(r'([a-zA-Z]+)(\d+)$', name)
+		if match is None or match.group(1) not in self.register_types:
+			raise ValueError("Unknown register %s" % name)
+		return (self.register_types[match.group(1)], int(match.group(2)))
+	def register_name(self, registerType, register):
+		if registerType == D3DSPR_DEPTHOUT:
+			return 'oDepth'
+		if registerType == D3DSPR_LOOP:
+			return 'aL'
+		return "%s%d" % (self.context.register_mnemonics.get(registerType, 'type%d' % registerType), register)
+	def run(self, inputs, count=None):
+		"""Execute the program, returns {register name: (N, 4) array} for the output registers written
+
+		inputs maps register names or (register type, register) pairs to values. Per-lane registers take
+		(N, 4) arrays or 4-vectors shared by every lane, i# takes 4 ints and b# a bool. s# takes a Texture,
+		or texels for a Texture of the sampler's declared type with default sampler state"""
+		if count is None:
+			count = 1
+			for value in inputs.values():
+				if numpy.ndim(value) == 2:
+					count = len(value)
+					break
+		self.count = count
+		self.registers = {}
+		self.int_constants = {}
+		self.bool_constants = {}
+		self.textures = {}
+		self.constants = numpy.zeros((self.constant_rows, 4), numpy.float32)
+		for name, value in inputs.items():
+			registerType, register = self.register_key(name)
+			if registerType in CONST_REGISTER_TYPES:
+				index = register + CONST_BANK_BASE.get(registerType, 0)
+				if index >= len(self.constants):
+					self.constants = numpy.concatenate([self.constants, numpy.zeros((index + 1 - len(self.constants), 4), numpy.float32)])
+				self.constants[index] = value
+			elif registerType == D3DSPR_CONSTINT:
+				self.int_constants[register] = [int(v) for v in value]
+			elif registerType == D3DSPR_CONSTBOOL:
+				self.bool_constants[register] = bool(value)
+			elif registerType == D3DSPR_SAMPLER:
+				if not isinstance(value, Texture):
+					value = Texture(value, self.sampler_types.get(register) or D3DSTT_2D)
+				self.textures[register] = value
+			else:
+				self.registers[(registerType, register)] = numpy.array(numpy.broadcast_to(numpy.asarray(value, numpy.float32), (count, 4)))
+		self.killed = numpy.zeros(count, bool)
+		self.mask = numpy.ones(count, bool)
+		self.stack = []
+		# Call frames: [return index, caller mask, returned lanes, flow stack depth at the call]
+		self.frames = [[None, self.mask, numpy.zeros(count, bool), 0]]
+		self.loop_counter = 0
+		errors = numpy.seterr(all='ignore')
+		try:
+			self.execute()
+		finally:
+			numpy.seterr(**errors)
+		outputs = {}
+		for (registerType, register), value in self.registers.items():
+			if registerType in OUTPUT_REGISTER_TYPES:
+				outputs[self.register_name(registerType, register)] = value
+		return outputs
+	def execute(self):
+		instructions = self.instructions
+		targets = self.flow_targets
+		index = 0
+		while index < len(instructions):
+			inst = instructions[index]
+			op = inst.token.op
+			self.instruction = inst
+			if op == D3DSIO_IF or op == D3DSIO_IFC:
+				condition = self.condition(inst)
+				self.stack.append(['if', self.mask, condition])
+				self.mask = self.mask & condition
+				if not self.mask.any():
+					index = targets[index]
+					continue
+			elif op == D3DSIO_ELSE:
+				entry = self.stack[-1]
+				self.mask = self.restore(entry[1] & ~entry[2])
+				if not self.mask.any():
+					index = targets[index]
+					continue
+			elif op == D3DSIO_ENDIF:
+				self.mask = self.restore(self.stack.pop()[1])
+			elif op == D3DSIO_LOOP or op == D3DSIO_REP:
+				counter = self.int_constants.get(inst.srcs[-1].register, (0, 0, 0, 0))
+				if counter[0] <= 0 or not self.mask.any():
+					index = targets[index] + 1
+					continue
+				# ['loop', mask before the loop, lanes that did not break, iterations left, outer aL, aL step]
+				self.stack.append(['loop', self.mask, self.mask, counter[0], self.loop_counter, counter[2]])
+				if op == D3DSIO_LOOP:
+					self.loop_counter = counter[1]
+			elif op == D3DSIO_ENDLOOP or op == D3DSIO_ENDREP:
+				entry = self.stack[-1]
+				entry[3] -= 1
+				self.mask = entry[2] & ~self.killed & ~self.frames[-1][2]
+				if entry[3] > 0 and self.mask.any():
+					if op == D3DSIO_ENDLOOP:
+						self.loop_counter += entry[5]
+					index = targets[index] + 1
+					continue
+				self.stack.pop()
+				self.loop_counter = entry[4]
+				self.mask = self.restore(entry[1])
+			elif op == D3DSIO_BREAK:
+				entry = self.innermost_loop()
+				entry[2] = entry[2] & ~self.mask
+				self.mask = numpy.zeros(self.count, bool)
+			elif op == D3DSIO_BREAKC or op == D3DSIO_BREAKP:
+				leaving = self.mask & self.condition(inst)
+				entry = self.innermost_loop()
+				entry[2] = entry[2] & ~leaving
+				self.mask = self.mask & ~leaving
+			elif op == D3DSIO_CALL or op == D3DSIO_CALLNZ:
+				mask = self.mask
+				if op == D3DSIO_CALLNZ:
+					mask = mask & self.condition(inst)
+				if mask.any():
+					self.frames.append([index + 1, self.mask, numpy.zeros(self.count, bool), len(self.stack)])
+					self.mask = mask
+					index = self.labels[inst.srcs[0].register] + 1
+					continue
+			elif op == D3DSIO_RET or op == D3DSIO_LABEL:
+				# Running into a label ends the subroutine before it like a ret
+				frame = self.frames[-1]
+				if len(self.frames) == 1:
+					return
+				if len(self.stack) > frame[3]:
+					frame[2] |= self.mask
+					self.mask = numpy.zeros(self.count, bool)
+				else:
+					self.frames.pop()
+					self.mask = self.restore(frame[1])
+					index = frame[0]
+					continue
+			elif op == D3DSIO_END:
+				return
+			elif op == D3DSIO_DEF:
+				self.constants[inst.dst.register + CONST_BANK_BASE.get(inst.dst.register_type, 0)] = inst.values
+			elif op == D3DSIO_DEFI:
+				self.int_constants[inst.dst.register] = list(inst.values)
+			elif op == D3DSIO_DEFB:
+				self.bool_constants[inst.dst.register] = inst.value != 0
+			elif op == D3DSIO_TEXKILL:
+				value = self.read_register(inst.dst)
+				below = (numpy.broadcast_to(value, (self.count, 4))[:, WRITE_MASK_COMPONENTS[inst.dst.write_mask]] < 0.0).any(axis=1)
+				self.killed |= self.mask & below
+				self.mask = self.mask & ~below
+			elif op in TEXTURE_OPS:
+				if self.mask.any():
+					self.write(inst, self.sample(inst))
+			elif op in SIMD_OPS or op in MATRIX_ROWS or op == D3DSIO_SETP:
+				if self.mask.any():
+					self.write(inst, self.compute(inst))
+			elif op not in (D3DSIO_DCL, D3DSIO_COMMENT, D3DSIO_NOP, D3DSIO_PHASE):
+				raise UnsupportedInstructionError(inst, "not supported by the interpreter")
+			index += 1
+	def restore(self, mask):
+		"""mask without the lanes that were killed, returned from the current subroutine or broke out of the current loop"""
+		frame = self.frames[-1]
+		mask = mask & ~self.killed & ~frame[2]
+		for entry in reversed(self.stack[frame[3]:]):
+			if entry[0] == 'loop':
+				return mask & entry[2]
+		return mask
+	def innermost_loop(self):
+		for entry in reversed(self.stack):
+			if entry[0] == 'loop':
+				return entry
+	def condition(self, inst):
+		"""Per-lane bool array, or a single bool for uniform conditions, of an if, ifc, break, breakc, breakp or callnz"""
+		if inst.token.op == D3DSIO_IFC or inst.token.op == D3DSIO_BREAKC:
+			a = numpy.broadcast_to(self.read(inst.srcs[0]), (self.count, 4))
+			b = numpy.broadcast_to(self.read(inst.srcs[1]), (self.count, 4))
+			return SIMD_COMPARISONS[inst.token.flags](a[:, 0], b[:, 0])
+		value = self.read(inst.srcs[-1])
+		if numpy.ndim(value) == 0:
+			return numpy.bool_(value)
+		return numpy.broadcast_to(value, (self.count, 4))[:, 0]
+	def relative_offset(self, param):
+		"""Register offset of a relatively addressed operand, an int for aL or an (N,) array for a0"""
+		relative = param.relative_param
+		if relative.register_type == D3DSPR_LOOP:
+			return self.loop_counter
+		component = getattr(relative, 'read_mask', None)
+		if component is None:
+			component = relative.write_mask
+		value = self.registers.get((D3DSPR_ADDR, relative.register))
+		if value is None:
+			return 0
+		return value[:, component & 0x3].astype(numpy.int32)
+	def read_register(self, param, row=0):
+		"""Value of the register behind an operand before swizzle and modifier"""
+		registerType = param.register_type
+		register = param.register + row
+		if registerType in CONST_REGISTER_TYPES:
+			index = register + CONST_BANK_BASE.get(registerType, 0)
+			if not param.is_relative:
+				return self.constants[index]
+			return simd_gather(self.constants, index, self.relative_offset(param))
+		if registerType == D3DSPR_CONSTINT:
+			return numpy.array(self.int_constants.get(register, (0, 0, 0, 0)), numpy.float32)
+		if registerType == D3DSPR_CONSTBOOL:
+			return numpy.bool_(self.bool_constants.get(register, False))
+		if registerType == D3DSPR_LOOP:
+			return numpy.full(4, self.loop_counter, numpy.float32)
+		if param.is_relative:
+			offset = self.relative_offset(param)
+			if numpy.ndim(offset) != 0:
+				raise UnsupportedInstructionError(self.instruction, "per-lane relative addressing of %s registers" % self.register_name(registerType, param.register))
+			register += offset
+		value = self.registers.get((registerType, register))
+		if value is None:
+			return numpy.zeros(4, bool if registerType == D3DSPR_PREDICATE else numpy.float32)
+		return value
+	def read(self, src, row=0):
+		"""Value of a source operand with its swizzle and modifier applied"""
+		value = self.read_register(src, row)
+		if numpy.ndim(value) == 0:
+			if src.source_modifier == 13:
+				return ~value
+			return value
+		value = simd_swizzle(value, src.read_mask)
+		if src.source_modifier:
+			value = SIMD_SOURCE_MODIFIERS[src.source_modifier](value)
+		return value
+	def compute(self, inst):
+		op = inst.token.op
+		if op in MATRIX_ROWS:
+			a = self.read(inst.srcs[0])
+			width = 4 if READ_COMPONENTS[op] == 0xf else 3
+			columns = [simd_dot(a, self.read(inst.srcs[1], row), width)[..., 0] for row in xrange(MATRIX_ROWS[op])]
+			return simd_vector(*(columns + [0.0] * (4 - len(columns))))
+		if op == D3DSIO_SETP:
+			return SIMD_COMPARISONS[inst.token.flags](self.read(inst.srcs[0]), self.read(inst.srcs[1]))
+		return SIMD_OPS[op](*[self.read(src) for src in inst.srcs])
+	def sample(self, inst):
+		return self.texture_lookup(inst, [self.read(src) for src in inst.srcs])
+	def texture_lookup(self, inst, sources):
+		"""Result of tex, texldp, texldb, texldl or texldd from the values of its sources
+
+		The mip level comes from texldl's w, texldd's gradients, or the 2x2 quad derivatives of the coordinates
+		in pixel shaders. ps_1_x tex and ps_1_4 texld read the sampler numbered like their destination.
+		Texture ops outside SAMPLED_OPS raise UnsupportedInstructionError"""
+		op = inst.token.op
+		self.instruction = inst
+		if op not in SAMPLED_OPS:
+			raise UnsupportedInstructionError(inst, "not supported by the texture sampler")
+		if len(inst.srcs) > 1:
+			stage = inst.srcs[1].register
+		else:
+			stage = inst.dst.register
+		texture = self.textures.get(stage)
+		if texture is None:
+			raise ValueError("No texture bound to s%d" % stage)
+		if sources:
+			texcoord = sources[0]
+		else:
+			texcoord = self.read_register(inst.dst)
+		texcoord = numpy.array(numpy.broadcast_to(texcoord, (self.count, 4)), numpy.float32)
+		if op == D3DSIO_TEXLDL:
+			return texture.sample(texcoord, texcoord[:, 3])
+		if op == D3DSIO_TEX and inst.token.flags == 1:
+			texcoord = texcoord / texcoord[:, 3:4]
+		lod = None
+		if op == D3DSIO_TEXLDD:
+			ddx = numpy.broadcast_to(sources[2], (self.count, 4))
+			ddy = numpy.broadcast_to(sources[3], (self.count, 4))
+			lod = texture.level_of_detail(texcoord, ddx, ddy)
+		elif self.context.shader_type == SHADERTYPE_PIXEL and self.count % 4 == 0:
+			lod = texture.level_of_detail(texcoord, simd_derivative(texcoord, False), simd_derivative(texcoord, True))
+		if op == D3DSIO_TEX and inst.token.flags == 2:
+			lod = texcoord[:, 3] if lod is None else lod + texcoord[:, 3]
+		return texture.sample(texcoord, lod)
+	def write(self, inst, value):
+		"""Store value into the destination of inst for the active lanes, components in the write mask and passing predicate"""
+		dst = inst.dst
+		if dst.shift_scale:
+			value = value * SHIFT_SCALES[dst.shift_scale]
+		if dst.result_modifier & 0x1:
+			value = numpy.clip(value, 0.0, 1.0)
+		register = dst.register
+		if dst.is_relative:
+			offset = self.relative_offset(dst)
+			if numpy.ndim(offset) != 0:
+				raise UnsupportedInstructionError(inst, "per-lane relative addressing of %s registers" % self.register_name(dst.register_type, dst.register))
+			register += offset
+		key = (dst.register_type, register)
+		target = self.registers.get(key)
+		if target is None:
+			target = numpy.zeros((self.count, 4), bool if dst.register_type == D3DSPR_PREDICATE else numpy.float32)
+			self.registers[key] = target
+		predicate = None
+		if inst.predicate is not None:
+			predicate = self.read(inst.predicate)
+		simd_store(target, value, self.mask, dst.write_mask, predicate)
+
+# Texture sampling
+# Software sampler behind the Interpreter's tex, texldl and texldd, textures are bound to s# registers.
+# Every lookup is vectorized over the batch, lanes are only split up by the mip level they read
+
+# Texture ops the sampler runs. The rest of TEXTURE_OPS besides texkill are the ps_1_x texture addressing ops
+# texcoord, texbem, texbeml, texreg2ar, texreg2gb, texreg2rgb, texm3x2pad, texm3x2tex, texm3x2depth, texm3x3pad,
+# texm3x3tex, texm3x3diff, texm3x3spec, texm3x3vspec, texm3x3, texdp3, texdp3tex and texdepth, which it does not
+SAMPLED_OPS = frozenset([D3DSIO_TEX, D3DSIO_TEXLDL, D3DSIO_TEXLDD])
+
+# D3DTEXTUREFILTERTYPE
+D3DTEXF_NONE = 0
+D3DTEXF_POINT = 1
+D3DTEXF_LINEAR = 2
+
+# D3DTEXTUREADDRESS
+D3DTADDRESS_WRAP = 1
+D3DTADDRESS_MIRROR = 2
+D3DTADDRESS_CLAMP = 3
+
+# Texel array dimensions of each texture type, not counting the components
+TEXTURE_DIMENSIONS = {
+	D3DSTT_1D: 1,
+	D3DSTT_2D: 2,
+	D3DSTT_CUBE: 3,
+	D3DSTT_VOLUME: 3
+}
+
+# Cube faces in +x, -x, +y, -y, +z, -z order: major axis, s axis, s sign, t axis, t sign
+CUBE_FACES = (
+	(0, 2, -1.0, 1, -1.0),
+	(0, 2, 1.0, 1, -1.0),
+	(1, 0, 1.0, 2, 1.0),
+	(1, 0, 1.0, 2, -1.0),
+	(2, 0, 1.0, 1, -1.0),
+	(2, 0, -1.0, 1, -1.0)
+)
+
+def texture_downsample(texels):
+	"""Next mip level of (layers, depth, height, width, 4) texels, box filtered"""
+	for axis in (1, 2, 3):
+		size = texels.shape[axis]
+		if size > 1:
+			half = size // 2
+			texels = (texels.take(numpy.arange(0, 2 * half, 2), axis=axis) + texels.take(numpy.arange(1, 2 * half, 2), axis=axis)) * 0.5
+	return texels
+
+class Texture(object):
+	"""Mip chain of a texture plus the sampler state used to read it
+
+	levels is an array, or a list of arrays from the largest level down: (width, components) for 1d textures,
+	(height, width, components) for 2d, (6, height, width, components) for cube faces in +x, -x, +y, -y, +z, -z order
+	and (depth, height, width, components) for volumes. A single array gets its mip chain built by box filtering.
+	The components axis can be left out for one component textures, missing components read 0 and a missing alpha 1"""
+	def __init__(self, levels, textureType=D3DSTT_2D, textureFilter=D3DTEXF_LINEAR, mipFilter=D3DTEXF_POINT, addressMode=D3DTADDRESS_WRAP):
+		if numpy is None:
+			raise ImportError("Texture requires numpy")
+		if textureType not in TEXTURE_DIMENSIONS:
+			raise ValueError("Unsupported texture type %d" % textureType)
+		self.texture_type = textureType
+		self.filter = textureFilter
+		self.mip_filter = mipFilter
+		self.address_mode = addressMode
+		if isinstance(levels, (list, tuple)):
+			self.levels = [self.expand(level) for level in levels]
+		else:
+			self.levels = [self.expand(levels)]
+			while max(self.levels[-1].shape[1:4]) > 1:
+				self.levels.append(texture_downsample(self.levels[-1]))
+		# depth, height and width of the top level, the sizes texture coordinates are scaled by
+		self.size = numpy.array(self.levels[0].shape[1:4], numpy.float32)
+	def expand(self, level):
+		"""(layers, depth, height, width, 4) float32 texels of one level"""
+		level = numpy.asarray(level, numpy.float32)
+		dimensions = TEXTURE_DIMENSIONS[self.texture_type]
+		if level.ndim == dimensions:
+			level = level[..., None]
+		if level.ndim != dimensions + 1 or level.shape[-1] > 4:
+			raise ValueError("Texture level of shape %r does not fit a %s texture" % (level.shape, D3DSTT[self.texture_type]['text']))
+		if self.texture_type == D3DSTT_1D:
+			level = level[None, None, None]
+		elif self.texture_type == D3DSTT_2D:
+			level = level[None, None]
+		elif self.texture_type == D3DSTT_CUBE:
+			if level.shape[0] != 6:
+				raise ValueError("Cube textures need 6 faces, got %d" % level.shape[0])
+			level = level[:, None]
+		else:
+			level = level[None]
+		texels = numpy.zeros(level.shape[:-1] + (4,), numpy.float32)
+		texels[..., 3] = 1.0
+		texels[..., :level.shape[-1]] = level
+		return texels
+	def address(self, index, size):
+		"""Texel indices moved into [0, size) by the address mode"""
+		if self.address_mode == D3DTADDRESS_CLAMP:
+			return numpy.clip(index, 0, size - 1)
+		if self.address_mode == D3DTADDRESS_MIRROR:
+			index = index % (2 * size)
+			return numpy.where(index >= size, 2 * size - 1 - index, index)
+		return index % size
+	def coordinates(self, texcoord):
+		"""Normalized (depth, height, width) coordinates, None for the axes a texture type lacks, and the layer of (N, 4) texcoord"""
+		if self.texture_type == D3DSTT_1D:
+			return [None, None, texcoord[:, 0]], 0
+		if self.texture_type == D3DSTT_2D:
+			return [None, texcoord[:, 1], texcoord[:, 0]], 0
+		if self.texture_type == D3DSTT_VOLUME:
+			return [texcoord[:, 2], texcoord[:, 1], texcoord[:, 0]], 0
+		face, major, s, t = self.cube_face(texcoord, texcoord)
+		return [None, 0.5 * (t / major + 1.0), 0.5 * (s / major + 1.0)], face
+	def cube_face(self, direction, vector):
+		"""Face picked by each (N, 4) direction, its major axis length and vector projected on the face's s and t axes"""
+		faces = numpy.array(CUBE_FACES)
+		lanes = numpy.arange(len(direction))
+		axis = numpy.argmax(numpy.abs(direction[:, :3]), axis=1)
+		major = direction[lanes, axis]
+		face = 2 * axis + (major < 0.0)
+		rows = faces[face]
+		s = vector[lanes, rows[:, 1].astype(numpy.intp)] * rows[:, 2]
+		t = vector[lanes, rows[:, 3].astype(numpy.intp)] * rows[:, 4]
+		major = numpy.abs(major)
+		major[major == 0.0] = 1.0
+		return face, major, s, t
+	def gradient(self, texcoord, derivative):
+		"""Texel space length of the (N, 4) derivative of texcoord, measured on the top level"""
+		if self.texture_type == D3DSTT_CUBE:
+			face, major, s, t = self.cube_face(texcoord, derivative)
+			return numpy.sqrt((0.5 * s / major * self.size[2]) ** 2 + (0.5 * t / major * self.size[1]) ** 2)
+		axes = {D3DSTT_1D: 1, D3DSTT_2D: 2, D3DSTT_VOLUME: 3}[self.texture_type]
+		scaled = derivative[:, :axes] * self.size[::-1][:axes]
+		return numpy.sqrt((scaled * scaled).sum(axis=1))
+	def level_of_detail(self, texcoord, ddx, ddy):
+		"""Per-lane mip level from the screen space derivatives of texcoord"""
+		rho = numpy.maximum(self.gradient(texcoord, ddx), self.gradient(texcoord, ddy))
+		return numpy.log2(numpy.maximum(rho, 1e-30))
+	def filtered(self, level, layer, coords):
+		"""Point or linear filtered (N, 4) texels of one mip level"""
+		texels = self.levels[level]
+		taps = []
+		for axis, coord in zip((1, 2, 3), coords):
+			size = texels.shape[axis]
+			if coord is None or size == 1:
+				taps.append([(0, None)])
+			elif self.filter == D3DTEXF_LINEAR:
+				x = coord * size - 0.5
+				base = numpy.floor(x)
+				fraction = (x - base).astype(numpy.float32)
+				base = base.astype(numpy.intp)
+				taps.append([(self.address(base, size), 1.0 - fraction), (self.address(base + 1, size), fraction)])
+			else:
+				taps.append([(self.address(numpy.floor(coord * size).astype(numpy.intp), size), None)])
+		result = None
+		for depth, depthWeight in taps[0]:
+			for row, rowWeight in taps[1]:
+				for column, columnWeight in taps[2]:
+					value = texels[layer, depth, row, column]
+					weight = None
+					for factor in (depthWeight, rowWeight, columnWeight):
+						if factor is not None:
+							weight = factor if weight is None else weight * factor
+					if weight is not None:
+						value = value * weight[:, None]
+					result = value if result is None else result + value
+		return result
+	def sample(self, texcoord, lod=None):
+		"""Filtered texels at the (N, 4) texture coordinates, lod is a per-lane mip level or None for the top level"""
+		coords, layer = self.coordinates(texcoord)
+		if lod is None or self.mip_filter == D3DTEXF_NONE or len(self.levels) == 1:
+			return self.filtered(0, layer, coords)
+		lod = numpy.clip(lod, 0.0, len(self.levels) - 1)
+		if self.mip_filter == D3DTEXF_LINEAR:
+			levels = numpy.floor(lod).astype(numpy.intp)
+			blend = (lod - levels).astype(numpy.float32)
+		else:
+			levels = numpy.floor(lod + 0.5).astype(numpy.intp)
+			blend = None
+		picked = numpy.unique(levels)
+		result = None if len(picked) == 1 else numpy.zeros((len(texcoord), 4), numpy.float32)
+		for level in picked:
+			if result is None:
+				lanes = slice(None)
+				levelCoords, levelLayer = coords, layer
+			else:
+				lanes = numpy.nonzero(levels == level)[0]
+				levelCoords = [coord if coord is None else coord[lanes] for coord in coords]
+				levelLayer = layer if numpy.ndim(layer) == 0 else layer[lanes]
+			value = self.filtered(level, levelLayer, levelCoords)
+			if blend is not None and level + 1 < len(self.levels):
+				weight = blend[lanes, None]
+				value = value * (1.0 - weight) + self.filtered(level + 1, levelLayer, levelCoords) * weight
+			if result is None:
+				return value
+			result[lanes] = value
+		return result
+
+# Shader compilation
+# Translates a decoded program into the source of one Python function doing what the Interpreter does,
+# without dispatching every instruction at run time. Subroutines are inlined at their calls
+
+COMPILED_SHADER_CACHE_SIZE = 256
+
+# Python templates of the most common opcodes, the others call into SIMD_OPS
+PYTHON_OPS = {
+	D3DSIO_MOV: '{0}',
+	D3DSIO_ADD: '{0} + {1}',
+	D3DSIO_SUB: '{0} - {1}',
+	D3DSIO_MUL: '{0} * {1}',
+	D3DSIO_MAD: '{0} * {1} + {2}',
+	D3DSIO_MIN: 'numpy.minimum({0}, {1})',
+	D3DSIO_MAX: 'numpy.maximum({0}, {1})',
+	D3DSIO_DP3: 'simd_dot({0}, {1}, 3)',
+	D3DSIO_DP4: 'simd_dot({0}, {1}, 4)',
+	D3DSIO_CMP: 'numpy.where({0} >= 0.0, {1}, {2})'
+}
+
+# Python templates of the source modifiers, in SOURCE_MOD_FORMAT order
+SOURCE_MOD_PYTHON = {
+	1: '-%s',
+	2: '(%s - 0.5)',
+	3: '(0.5 - %s)',
+	4: '(2.0 * %s - 1.0)',
+	5: '(1.0 - 2.0 * %s)',
+	6: '(1.0 - %s)',
+	7: '(2.0 * %s)',
+	8: '(-2.0 * %s)',
+	9: 'simd_divide(%s, 2)',
+	10: 'simd_divide(%s, 3)',
+	11: 'numpy.abs(%s)',
+	12: '-numpy.abs(%s)',
+	13: '~%s'
+}
+
+class ShaderCompiler(object):
+	"""Generates the Python source of a program, every instruction emits its own statements through to_python
+
+	Registers live in local variables, flow control keeps the Interpreter's execution masks in locals too.
+	Relative addressing of anything but constant registers, and opcodes without a SIMD_OPS entry, raise
+	UnsupportedInstructionError like the Interpreter does, so callers can catch that one exception and
+	fall back to an Interpreter, which also runs aL relative temps and outputs"""
+	def __init__(self, program):
+		self.program = program
+		self.instructions = program.instructions
+		self.context = program.context
+		cfg = program.control_flow()
+		self.labels = dict([(label, cfg.blocks[block].start) for label, block in cfg.functions.items() if label is not None])
+		self.lines = []
+		self.indent = 1
+		self.names = 0
+		# Open if and loop blocks, and the inlined functions with the flow depth they started at
+		self.blocks = []
+		self.functions = []
+		# (register type, register) -> [local name, written]
+		self.variables = OrderedDict()
+		self.index = 0
+		self.finished = False
+	def emit(self, line):
+		self.lines.append('\t' * self.indent + line)
+	def name(self, prefix):
+		self.names += 1
+		return "%s%d" % (prefix, self.names)
+	def variable(self, registerType, register, written=False):
+		key = (registerType, register)
+		if key not in self.variables:
+			name = "%s%d" % (self.context.register_mnemonics.get(registerType, 'type'), register)
+			if registerType == D3DSPR_DEPTHOUT:
+				name = 'oDepth'
+			if name in [variable[0] for variable in self.variables.values()]:
+				name += "_%d" % registerType
+			self.variables[key] = [name, False]
+		if written:
+			self.variables[key][1] = True
+		return self.variables[key][0]
+	def source(self):
+		"""Source of a function shader(machine) running the program on an Interpreter's state"""
+		self.functions.append({'returned': 'returned', 'depth': 0})
+		self.emit_function(0)
+		body = self.lines
+		self.lines = []
+		self.emit("count = machine.count")
+		self.emit("C = machine.constants")
+		self.emit("I = machine.int_constants")
+		self.emit("B = machine.bool_constants")
+		self.emit("R = machine.registers")
+		self.emit("INST = machine.instructions")
+		self.emit("killed = machine.killed")
+		self.emit("mask = machine.mask")
+		self.emit("none = numpy.zeros(count, bool)")
+		self.emit("returned = none")
+		self.emit("aL = 0")
+		for (registerType, register), (name, written) in self.variables.items():
+			dtype = 'bool' if registerType == D3DSPR_PREDICATE else 'numpy.float32'
+			if written:
+				self.emit("%s = R.get(%r)" % (name, (registerType, register)))
+				self.emit("if %s is None:" % name)
+				self.emit("\t%s = R[%r] = numpy.zeros((count, 4), %s)" % (name, (registerType, register), dtype))
+			else:
+				self.emit("%s = R.get(%r, numpy.zeros(4, %s))" % (name, (registerType, register), dtype))
+		self.lines.extend(body)
+		self.emit("machine.killed = killed")
+		return "def shader(machine):\n" + "\n".join(self.lines) + "\n"
+	def emit_function(self, index):
+		"""Emit the instructions from index up to the ret ending the current function"""
+		self.finished = False
+		while index < len(self.instructions) and not self.finished:
+			self.index = index
+			self.instructions[index].to_python(self)
+			index += 1
+		self.finished = False
+	def relative_offset(self, param):
+		relative = param.relative_param
+		if relative.register_type == D3DSPR_LOOP:
+			return 'aL'
+		component = getattr(relative, 'read_mask', None)
+		if component is None:
+			component = relative.write_mask
+		return "%s[:, %d].astype(numpy.int32)" % (self.variable(D3DSPR_ADDR, relative.register), component & 0x3)
+	def operand(self, src, row=0):
+		"""Expression for the value of a source operand with its swizzle and modifier"""
+		registerType = src.register_type
+		register = src.register + row
+		if registerType in CONST_REGISTER_TYPES:
+			index = register + CONST_BANK_BASE.get(registerType, 0)
+			if src.is_relative:
+				value = "simd_gather(C, %d, %s)" % (index, self.relative_offset(src))
+			else:
+				value = "C[%d]" % index
+		elif registerType == D3DSPR_CONSTINT:
+			value = "numpy.array(I.get(%d, (0, 0, 0, 0)), numpy.float32)" % register
+		elif registerType == D3DSPR_CONSTBOOL:
+			value = "numpy.bool_(B.get(%d, False))" % register
+			if src.source_modifier == 13:
+				value = '~' + value
+			return value
+		elif registerType == D3DSPR_LOOP:
+			value = "numpy.full(4, aL, numpy.float32)"
+		else:
+			if src.is_relative:
+				raise UnsupportedInstructionError(self.instructions[self.index], "relative addressing of %s registers is not supported by the compiler" % self.variable(registerType, register))
+			value = self.variable(registerType, register)
+		if src.read_mask in REPLICATE_SWIZZLES:
+			value = "simd_replicate(%s, %d)" % (value, src.read_mask & 0x3)
+		elif src.read_mask != 0xE4:
+			value = "%s[..., %r]" % (value, SWIZZLE_COMPONENTS[src.read_mask])
+		if src.source_modifier:
+			value = SOURCE_MOD_PYTHON[src.source_modifier] % value
+		return value
+	def expression(self, inst):
+		op = inst.token.op
+		if op in MATRIX_ROWS:
+			a = self.operand(inst.srcs[0])
+			width = 4 if READ_COMPONENTS[op] == 0xf else 3
+			columns = ["simd_dot(%s, %s, %d)[..., 0]" % (a, self.operand(inst.srcs[1], row), width) for row in xrange(MATRIX_ROWS[op])]
+			return "simd_vector(%s)" % ", ".join(columns + ['0.0'] * (4 - len(columns)))
+		if op == D3DSIO_SETP:
+			return "SIMD_COMPARISONS[%d](%s, %s)" % (inst.token.flags, self.operand(inst.srcs[0]), self.operand(inst.srcs[1]))
+		if op not in SIMD_OPS:
+			raise UnsupportedInstructionError(inst, "not supported by the compiler")
+		sources = [self.operand(src) for src in inst.srcs]
+		if op in PYTHON_OPS:
+			return PYTHON_OPS[op].format(*sources)
+		return "SIMD_OPS[%d](%s)" % (op, ", ".join(sources))
+	def store(self, inst, expression):
+		dst = inst.dst
+		if dst.is_relative:
+			raise UnsupportedInstructionError(inst, "relative addressing of %s registers is not supported by the compiler" % self.variable(dst.register_type, dst.register))
+		if dst.shift_scale:
+			expression = "(%s) * %r" % (expression, SHIFT_SCALES[dst.shift_scale])
+		if dst.result_modifier & 0x1:
+			expression = "numpy.clip(%s, 0.0, 1.0)" % expression
+		predicate = 'None'
+		if inst.predicate is not None:
+			predicate = self.operand(inst.predicate)
+		self.emit("simd_store(%s, %s, mask, %d, %s)" % (self.variable(dst.register_type, dst.register, True), expression, dst.write_mask, predicate))
+	def restore(self, expression):
+		"""Expression for mask when a block closes, without killed lanes, returned lanes and lanes that left the current loop"""
+		function = self.functions[-1]
+		text = "%s & ~killed & ~%s" % (expression, function['returned'])
+		for block in reversed(self.blocks[function['depth']:]):
+			if block['kind'] == 'loop':
+				return "%s & %s" % (text, block['live'])
+		return text
+	def condition(self, inst):
+		if inst.token.op == D3DSIO_IFC or inst.token.op == D3DSIO_BREAKC:
+			return "SIMD_COMPARISONS[%d](numpy.broadcast_to(%s, (count, 4))[:, 0], numpy.broadcast_to(%s, (count, 4))[:, 0])" % (
+				inst.token.flags, self.operand(inst.srcs[0]), self.operand(inst.srcs[1]))
+		src = inst.srcs[-1]
+		if src.register_type == D3DSPR_CONSTBOOL:
+			return self.operand(src)
+		return "numpy.broadcast_to(%s, (count, 4))[:, 0]" % self.operand(src)
+	def innermost_loop(self):
+		for block in reversed(self.blocks):
+			if block['kind'] == 'loop':
+				return block
+	def flow(self, inst):
+		"""Emit a flow control instruction, texkill or end"""
+		op = inst.token.op
+		function = self.functions[-1]
+		if op == D3DSIO_IF or op == D3DSIO_IFC:
+			block = {'kind': 'if', 'saved': self.name('saved'), 'condition': self.name('condition')}
+			self.emit("%s = %s" % (block['condition'], self.condition(inst)))
+			self.emit("%s = mask" % block['saved'])
+			self.emit("mask = mask & %s" % block['condition'])
+			self.emit("if mask.any():")
+			self.indent += 1
+			self.emit("pass")
+			self.blocks.append(block)
+		elif op == D3DSIO_ELSE:
+			block = self.blocks[-1]
+			self.indent -= 1
+			self.emit("mask = %s" % self.restore("%s & ~%s" % (block['saved'], block['condition'])))
+			self.emit("if mask.any():")
+			self.indent += 1
+			self.emit("pass")
+		elif op == D3DSIO_ENDIF:
+			block = self.blocks.pop()
+			self.indent -= 1
+			self.emit("mask = %s" % self.restore(block['saved']))
+		elif op == D3DSIO_LOOP or op == D3DSIO_REP:
+			block = {'kind': 'loop', 'saved': self.name('saved'), 'live': self.name('live'), 'counter': self.name('counter'), 'outer': self.name('outer')}
+			self.emit("%s = mask" % block['saved'])
+			self.emit("%s = mask" % block['live'])
+			self.emit("%s = aL" % block['outer'])
+			self.emit("%s = I.get(%d, (0, 0, 0, 0))" % (block['counter'], inst.srcs[-1].register))
+			self.emit("if %s[0] > 0 and mask.any():" % block['counter'])
+			self.indent += 1
+			if op == D3DSIO_LOOP:
+				self.emit("aL = %s[1]" % block['counter'])
+			self.emit("for %s in xrange(%s[0]):" % (self.name('iteration'), block['counter']))
+			self.indent += 1
+			self.emit("mask = %s & ~killed & ~%s" % (block['live'], function['returned']))
+			self.emit("if not mask.any():")
+			self.emit("\tbreak")
+			self.blocks.append(block)
+		elif op == D3DSIO_ENDLOOP or op == D3DSIO_ENDREP:
+			block = self.blocks.pop()
+			if op == D3DSIO_ENDLOOP:
+				self.emit("aL += %s[2]" % block['counter'])
+			self.indent -= 2
+			self.emit("aL = %s" % block['outer'])
+			self.emit("mask = %s" % self.restore(block['saved']))
+		elif op == D3DSIO_BREAK:
+			live = self.innermost_loop()['live']
+			self.emit("%s = %s & ~mask" % (live, live))
+			self.emit("mask = none")
+		elif op == D3DSIO_BREAKC or op == D3DSIO_BREAKP:
+			live = self.innermost_loop()['live']
+			leaving = self.name('leaving')
+			self.emit("%s = mask & %s" % (leaving, self.condition(inst)))
+			self.emit("%s = %s & ~%s" % (live, live, leaving))
+			self.emit("mask = mask & ~%s" % leaving)
+		elif op == D3DSIO_CALL or op == D3DSIO_CALLNZ:
+			saved = self.name('saved')
+			self.emit("%s = mask" % saved)
+			if op == D3DSIO_CALLNZ:
+				self.emit("mask = mask & %s" % self.condition(inst))
+			callee = {'returned': self.name('returned'), 'depth': len(self.blocks)}
+			self.emit("%s = none" % callee['returned'])
+			self.emit("if mask.any():")
+			self.indent += 1
+			self.emit("pass")
+			self.functions.append(callee)
+			self.emit_function(self.labels[inst.srcs[0].register] + 1)
+			self.functions.pop()
+			self.indent -= 1
+			self.emit("mask = %s" % self.restore(saved))
+		elif op == D3DSIO_RET or op == D3DSIO_LABEL:
+			if op == D3DSIO_RET and len(self.blocks) > function['depth']:
+				self.emit("%s = %s | mask" % (function['returned'], function['returned']))
+				self.emit("mask = none")
+			else:
+				self.finished = True
+		elif op == D3DSIO_END:
+			self.finished = True
+		elif op == D3DSIO_TEXKILL:
+			value = self.variable(inst.dst.register_type, inst.dst.register)
+			self.emit("below = (numpy.broadcast_to(%s, (count, 4))[:, %r] < 0.0).any(axis=1)" % (value, WRITE_COMPONENT_LISTS[inst.dst.write_mask]))
+			self.emit("killed = killed | (mask & below)")
+			self.emit("mask = mask & ~below")
+
+class CompiledShader(Interpreter):
+	"""Interpreter running its program as generated Python, inputs and outputs are the same"""
+	def __init__(self, program, code=None):
+		Interpreter.__init__(self, program)
+		if code is None:
+			code = compile(ShaderCompiler(program).source(), '<shader>', 'exec')
+		namespace = dict(globals())
+		eval(code, namespace)
+		self.function = namespace['shader']
+	def execute(self):
+		self.function(self)
+
+# Compiled code of recently used shaders by bytecode hash, most recent last
+gCompiledShaders = OrderedDict()
+
+def compile_shader(bytecode):
+	"""CompiledShader for bytecode, reusing the generated code of shaders compiled before"""
+	digest = hashlib.sha1(bytecode).hexdigest()
+	entry = gCompiledShaders.pop(digest, None)
+	if entry is None:
+		program = decode(bytecode)
+		entry = (program, compile(ShaderCompiler(program).source(), '<shader %s>' % digest, 'exec'))
+		while len(gCompiledShaders) >= COMPILED_SHADER_CACHE_SIZE:
+			gCompiledShaders.popitem(last=False)
+	gCompiledShaders[digest] = entry
+	return CompiledShader(*entry)
+
+# Shader packs
+# Many shader blobs stored in one file, decoded in place from a single memory mapping
+
+# Version token bytes: minor, major (1-3), 0xFFFE or 0xFFFF
+VERSION_TOKEN_PATTERN = re.compile(b'[\x00-\x04\xff][\x01-\x03][\xfe\xff]\xff')
+
+def scan_pack(buffer):
+	"""Yield (offset, Program) for every shader found by scanning buffer for version tokens
+
+	A candidate that fails to decode is skipped, the scan resumes after the END of each shader found"""
+	position = 0
+	while True:
+		match = VERSION_TOKEN_PATTERN.search(buffer, position)
+		if match is None:
+			return
+		offset = match.start()
+		try:
+			program = decode_stream(buffer, offset)
+		except (TokenStreamError, KeyError, IndexError, struct.error):
+			position = offset + 1
+			continue
+		if not program.instructions or not program.instructions[-1].token.is_exit():
+			position = offset + 1
+			continue
+		yield (offset, program)
+		position = offset + program.size()
+
+def iter_pack(buffer, offsets=None):
+	"""Yield (offset, Program) for the shaders of a pack buffer, usually an mmap
+
+	offsets is the list of byte offsets of the shaders, or None to scan for them"""
+	if offsets is None:
+		for item in scan_pack(buffer):
+			yield item
+		return
+	for offset in offsets:
+		yield (offset, decode_stream(buffer, offset))
+
+def read_offset_table(path):
+	"""Shader offsets from a text file, one decimal or 0x-prefixed offset per line"""
+	offsetFile = open(path, 'r')
+	try:
+		return [int(line.split()[0], 0) for line in offsetFile if line.strip() and not line.startswith('#')]
+	finally:
+		offsetFile.close()
+
+def disassemble_pack(path, offsets=None, isDebug=False, out=None, stats=False, optimized=False, chunkSize=OUTPUT_CHUNK, outputFormat='text'):
+	"""Disassemble every shader of a pack file, returns the number of shaders
+
+	With stats, writes one line of ShaderStats JSON per shader instead, with its offset in the pack.
+	With optimized, writes one line of the optimize() report per shader the same way.
+	With an outputFormat other than text, writes the records of every shader through a RecordWriter.
+	Output is written in chunks of chunkSize"""
+	if outputFormat != 'text' and not (stats or optimized):
+		writer = RecordWriter(out, outputFormat, chunkSize)
+	else:
+		writer = ListingWriter(out, chunkSize)
+	packFile = open(path, 'rb')
+	try:
+		if os.fstat(packFile.fileno()).st_size == 0:
+			return 0
+		mapping = mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			count = 0
+			for offset, program in iter_pack(mapping, offsets):
+				if isinstance(writer, RecordWriter):
+					writer.add_program(program, offset)
+				elif stats or optimized:
+					if optimized:
+						report = optimize(program)[1]
+					else:
+						report = program.stats().to_dict()
+					report['offset'] = offset
+					writer.add(json.dumps(report, sort_keys=True))
+				else:
+					writer.add("; Shader at 0x%X" % offset)
+					writer.add_text(program.to_text(isDebug))
+				count += 1
+			writer.flush()
+			return count
+		finally:
+			mapping.close()
+	finally:
+		packFile.close()
+
+# Disassembly cache
+
+# Bump when the decoded objects or the listing format change, so stale cache entries stop matching
+CACHE_FORMAT = 2
+
+def make_dirs(path):
+	"""os.makedirs that tolerates another process creating the directory at the same time"""
+	if not os.path.isdir(path):
+		try:
+			os.makedirs(path)
+		except OSError:
+			if not os.path.isdir(path):
+				raise
+
+class DisassemblyCache(object):
+	"""Content-addressed cache of decoded programs and their listings
+
+	Entries are keyed by a hash of the bytecode and the formatter options. The memory tier keeps the
+	capacity most recently used entries. With a directory, entries are also pickled to disk and the
+	least recently used files are evicted once the store grows past maxDiskBytes.
+	Not thread-safe, use one cache per thread or process."""
+	def __init__(self, capacity=1024, directory=None, maxDiskBytes=256 * 1024 * 1024):
+		self.capacity = capacity
+		self.directory = directory
+		self.max_disk_bytes = maxDiskBytes
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.disk_bytes = 0
+		if directory is not None:
+			make_dirs(directory)
+			self.disk_bytes = sum([size for path, size, mtime in self.disk_entries()])
+	def key(self, bytecode, isDebug):
+		digest = hashlib.sha1(bytecode)
+		digest.update(("|format=%d|debug=%d" % (CACHE_FORMAT, isDebug)).encode('ascii'))
+		return digest.hexdigest()
+	def lookup(self, bytecode, isDebug=False):
+		"""(program, listing) for bytecode, decoding it only on a miss"""
+		key = self.key(bytecode, isDebug)
+		entry = self.entries.pop(key, None)
+		if entry is not None:
+			self.hits += 1
+		else:
+			entry = self.load(key)
+			if entry is not None:
+				self.disk_hits += 1
+			else:
+				self.misses += 1
+				program = decode(bytecode)
+				entry = (program, program.to_text(isDebug))
+				self.store(key, entry)
+		self.entries[key] = entry
+		if len(self.entries) > self.capacity:
+			self.entries.popitem(last=False)
+		return entry
+	def stats(self):
+		return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+	def entry_path(self, key):
+		return os.path.join(self.directory, key[:2], key + '.pickle')
+	def load(self, key):
+		if self.directory is None:
+			return None
+		path = self.entry_path(key)
+		try:
+			entryFile = open(path, 'rb')
+			try:
+				entry = pickle.load(entryFile)
+			finally:
+				entryFile.close()
+			# Touch the file so eviction sees it as recently used
+			os.utime(path, None)
+		except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+			return None
+		return entry
+	def store(self, key, entry):
+		if self.directory is None:
+			return
+		path = self.entry_path(key)
+		make_dirs(os.path.dirname(path))
+		tempPath = "%s.%d.tmp" % (path, os.getpid())
+		entryFile = open(tempPath, 'wb')
+		try:
+			pickle.dump(entry, entryFile, pickle.HIGHEST_PROTOCOL)
+		finally:
+			entryFile.close()
+		# On POSIX the rename replaces an entry stored before, whose size is already counted
+		try:
+			replaced = os.path.getsize(path)
+		except OSError:
+			replaced = 0
+		try:
+			os.rename(tempPath, path)
+		except OSError:
+			# Windows will not rename over an existing file, another process stored the same entry
+			os.remove(tempPath)
+			return
+		self.disk_bytes += os.path.getsize(path) - replaced
+		if self.disk_bytes > self.max_disk_bytes:
+			self.evict()
+	def disk_entries(self):
+		"""[(path, size, mtime)] of the entries stored on disk"""
+		entries = []
+		for root, dirs, files in os.walk(self.directory):
+			for name in files:
+				if name.endswith('.pickle'):
+					path = os.path.join(root, name)
+					try:
+						st = os.stat(path)
+					except OSError:
+						continue
+					entries.append((path, st.st_size, st.st_mtime))
+		return entries
+	def evict(self):
+		"""Remove the least recently used disk entries until the store is back under 90% of its limit"""
+		entries = self.disk_entries()
+		entries.sort(key=lambda entry: entry[2])
+		total = sum([size for path, size, mtime in entries])
+		target = self.max_disk_bytes * 9 // 10
+		for path, size, mtime in entries:
+			if total <= target:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+		self.disk_bytes = total
+
+# Batch disassembly
+
+SHADER_EXTENSIONS = ('.cso', '.vso', '.pso')
+
+def find_shaders(directory):
+	"""Sorted list of the shader files under directory"""
+	paths = []
+	for root, dirs, files in os.walk(directory):
+		for name in files:
+			if os.path.splitext(name)[1].lower() in SHADER_EXTENSIONS:
+				paths.append(os.path.join(root, name))
+	paths.sort()
+	return paths
+
+# Cache of the current batch worker process, set up by init_batch_worker
+gBatchCache = None
+
+def init_batch_worker(cacheDir):
+	global gBatchCache
+	gBatchCache = None
+	if cacheDir is not None:
+		gBatchCache = DisassemblyCache(directory=cacheDir)
+
+def disassemble_file(job):
+	"""Disassemble one (inputPath, outputPath, isDebug) job
+
+	Returns (inputPath, instruction count, error message or None, cache counters or None)
+	Runs in the batch worker processes, so it must stay a module-level function"""
+	inputPath, outputPath, isDebug = job
+	cacheStats = None
+	try:
+		shaderFile = open(inputPath, 'rb')
+		try:
+			bytecode = shaderFile.read()
+		finally:
+			shaderFile.close()
+		outputDir = os.path.dirname(outputPath)
+		if outputDir:
+			make_dirs(outputDir)
+		outFile = open(outputPath, 'w')
+		try:
+			if gBatchCache is None:
+				count = disassemble(bytecode, isDebug, outFile)
+			else:
+				before = gBatchCache.stats()
+				program, text = gBatchCache.lookup(bytecode, isDebug)
+				after = gBatchCache.stats()
+				cacheStats = dict([(name, after[name] - before[name]) for name in after])
+				outFile.write(text)
+				count = len(program.instructions)
+		finally:
+			outFile.close()
+	except Exception as e:
+		# TokenStreamError, unknown opcodes, truncated files... report it and keep the batch going
+		if os.path.isfile(outputPath):
+			os.remove(outputPath)
+		return (inputPath, 0, "%s: %s" % (e.__class__.__name__, e), cacheStats)
+	return (inputPath, count, None, cacheStats)
+
+def disassemble_batch(inputDir, outputDir, jobs, isDebug=False, cacheDir=None):
+	"""Disassemble every shader under inputDir into a mirrored tree of .asm files under outputDir
+
+	With cacheDir, listings of unchanged shaders come from a DisassemblyCache stored there.
+	Returns (file count, instruction count, [(path, error message)], elapsed seconds, cache counters or None)"""
+	work = []
+	for path in find_shaders(inputDir):
+		rel = os.path.relpath(path, inputDir)
+		work.append((path, os.path.join(outputDir, os.path.splitext(rel)[0] + '.asm'), isDebug))
+	if jobs <= 0:
+		jobs = multiprocessing.cpu_count()
+	start = time.time()
+	instructions = 0
+	failures = []
+	if jobs == 1 or len(work) < 2:
+		init_batch_worker(cacheDir)
+		results = [disassemble_file(job) for job in work]
+	else:
+		pool = multiprocessing.Pool(jobs, init_batch_worker, (cacheDir,))
+		try:
+			chunk = max(1, len(work) // (jobs * 16))
+			results = list(pool.imap_unordered(disassemble_file, work, chunk))
+		finally:
+			pool.close()
+			pool.join()
+	cacheStats = None
+	if cacheDir is not None:
+		cacheStats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+	for path, count, error, fileCacheStats in results:
+		instructions += count
+		if error is not None:
+			failures.append((path, error))
+		if fileCacheStats is not None:
+			for name, value in fileCacheStats.items():
+				cacheStats[name] += value
+	return (len(work), instructions, failures, time.time() - start, cacheStats)
+
+def print_batch_summary(files, instructions, failures, elapsed, cacheStats=None):
+	for path, error in failures:
+		print >>sys.stderr, "%s: %s" % (path, error)
+	elapsed = max(elapsed, 1e-6)
+	print "%d files, %d instructions, %d failed in %.2fs" % (files, instructions, len(failures), elapsed)
+	print "%.1f files/s, %.1f instructions/s" % (files / elapsed, instructions / elapsed)
+	if cacheStats is not None:
+		print "cache: %d memory hits, %d disk hits, %d misses" % (cacheStats['hits'], cacheStats['disk_hits'], cacheStats['misses'])
+
+# Round-trip verification
+
+def verify_shader_file(path):
+	"""Check that the bytecode of path encodes back to the same bytes, and that its optimized program
+	decodes back from its encoding. Returns (path, error message or None), runs in worker processes"""
+	try:
+		shaderFile = open(path, 'rb')
+		try:
+			bytecode = shaderFile.read()
+		finally:
+			shaderFile.close()
+		program = decode(bytecode)
+		encoded = program.encode()
+		original = bytecode[:program.size()]
+		if encoded != original:
+			tokens = unpack_tokens(encoded)
+			for i, token in enumerate(unpack_tokens(original)):
+				if i >= len(tokens) or tokens[i] != token:
+					return (path, "round trip differs at offset 0x%X" % (i * 4))
+			return (path, "round trip is %d bytes, expected %d" % (len(encoded), len(original)))
+		optimized = optimize(program)[0]
+		if decode(optimized.encode()).to_text() != optimized.to_text():
+			return (path, "optimized program does not decode back from its bytecode")
+		return (path, None)
+	except (TokenStreamError, struct.error, KeyError, IndexError) as e:
+		return (path, "%s: %s" % (type(e).__name__, e))
+
+def verify_round_trip(directory, jobs=0):
+	"""Round-trip every shader under directory, returns (file count, [(path, error message)], elapsed seconds)"""
+	paths = find_shaders(directory)
+	if jobs <= 0:
+		jobs = multiprocessing.cpu_count()
+	start = time.time()
+	if jobs == 1 or len(paths) < 2:
+		results = [verify_shader_file(path) for path in paths]
+	else:
+		pool = multiprocessing.Pool(jobs)
+		try:
+			results = list(pool.imap_unordered(verify_shader_file, paths, max(1, len(paths) // (jobs * 16))))
+		finally:
+			pool.close()
+			pool.join()
+	failures = sorted([(path, error) for path, error in results if error is not None])
+	return (len(paths), failures, time.time() - start)
+
+# Corpus deduplication and inverted index
+
+INDEX_BATCH = 1000
+# Bumped when the index schema or the terms change, older index files are rebuilt from scratch
+INDEX_FORMAT = 1
+# tex with these flags is listed as tex but behaves as texldp / texldb
+TEX_FLAG_MNEMONICS = {1: 'texldp', 2: 'texldb'}
+
+def exact_hash(bytecode):
+	"""Hash of the raw bytecode"""
+	return hashlib.sha1(bytecode).hexdigest()
+
+def structural_hash(program):
+	"""Hash of the opcodes and operand shapes, ignoring comments, register indices and literal constants
+
+	Shaders that differ only in def values or register allocation share a structural hash"""
+	h = hashlib.sha1(repr(program.version))
+	for inst in program.instructions:
+		if inst.token.op == D3DSIO_COMMENT:
+			continue
+		h.update(repr(inst.signature(True, True)))
+	return h.hexdigest()
+
+def operand_terms(ctx, param, terms):
+	"""Add the reg: and rel: terms of one operand to terms"""
+	mnemonic = ctx.register_mnemonics.get(param.register_type)
+	if mnemonic is None:
+		return
+	terms.add('reg:' + mnemonic)
+	if not param.is_relative:
+		terms.add('reg:' + ctx.register_text(param.register_type, param.register))
+		return
+	terms.add('rel:' + mnemonic)
+	address = param.relative_param
+	if address is not None and address.register_type in ctx.register_mnemonics:
+		terms.add('rel:%s[%s]' % (mnemonic, ctx.register_text(address.register_type, address.register)))
+
+def shader_terms(program):
+	"""Sorted inverted index terms of a decoded program
+
+	version:vs_3_0, op:texldl, reg:c, reg:c12, rel:c, rel:c[a0], dcl:position0, sampler:cube and
+	sample:texldl:cube for which sampling instructions read which sampler types"""
+	ctx = program.context
+	terms = set(['version:' + ctx.version_string()])
+	samplers = {}
+	for inst in program.instructions:
+		op = inst.token.op
+		if op == D3DSIO_COMMENT:
+			continue
+		mnemonic = inst.token.mnemonic()
+		if op == D3DSIO_TEX:
+			mnemonic = TEX_FLAG_MNEMONICS.get(inst.token.flags, mnemonic)
+		terms.add('op:' + mnemonic)
+		if op == D3DSIO_DCL:
+			if inst.dst.register_type == D3DSPR_SAMPLER:
+				textureType = D3DSTT.get(inst.texture_type, D3DSTT[D3DSTT_UNKNOWN])['text']
+				samplers[inst.dst.register] = textureType
+				terms.add('sampler:' + textureType)
+			elif getattr(inst, 'usage', None) in D3DDECLUSAGE:
+				terms.add('dcl:%s%d' % (D3DDECLUSAGE[inst.usage]['text'], inst.usage_index))
+		for param in inst.operands():
+			operand_terms(ctx, param, terms)
+		if inst.predicate is not None:
+			operand_terms(ctx, inst.predicate, terms)
+		if op in (D3DSIO_TEX, D3DSIO_TEXLDL, D3DSIO_TEXLDD) and len(inst.srcs) > 1:
+			terms.add('sample:%s:%s' % (mnemonic, samplers.get(inst.srcs[1].register, 'unknown')))
+	return sorted(terms)
+
+def hash_shader_file(job):
+	"""Hash and extract the index terms of one (path, size, mtime) job
+
+	Returns (path, size, mtime, exact hash, structural hash, version, instruction count, error message or None, [terms])
+	Runs in the indexer worker processes, so it must stay a module-level function"""
+	path, size, mtime = job
+	try:
+		shaderFile = open(path, 'rb')
+		try:
+			bytecode = shaderFile.read()
+		finally:
+			shaderFile.close()
+		program = decode(bytecode)
+		terms = shader_terms(program)
+	except Exception as e:
+		return (path, size, mtime, None, None, None, 0, "%s: %s" % (e.__class__.__name__, e), [])
+	return (path, size, mtime, exact_hash(bytecode), structural_hash(program), program.context.version_string(), len(program.instructions), None, terms)
+
+class ShaderIndex(object):
+	"""Persistent sqlite index of a shader corpus
+
+	Keeps exact and structural hashes per shader, and postings of shader_terms terms to shaders
+	so queries are answered from the index without decoding anything"""
+	def __init__(self, path):
+		import sqlite3
+		self.db = sqlite3.connect(path)
+		if self.db.execute("PRAGMA user_version").fetchone()[0] != INDEX_FORMAT:
+			self.db.execute("DROP TABLE IF EXISTS shaders")
+			self.db.execute("DROP TABLE IF EXISTS terms")
+			self.db.execute("PRAGMA user_version = %d" % INDEX_FORMAT)
+		self.db.execute("CREATE TABLE IF NOT EXISTS shaders (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+			"exact TEXT, structural TEXT, version TEXT, instructions INTEGER, error TEXT)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS shaders_exact ON shaders (exact)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS shaders_structural ON shaders (structural)")
+		# One row per (term, shader rowid), the (term, shader) index answers queries without touching the table
+		self.db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT, shader INTEGER)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS terms_term ON terms (term, shader)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS terms_shader ON terms (shader)")
+		self.db.commit()
+	def close(self):
+		self.db.close()
+	def update(self, directory, jobs=0):
+		"""Bring the index up to date with the shaders under directory
+
+		Only new or modified files (by size and mtime) are decoded, rows for deleted files are dropped.
+		Returns (indexed count, unchanged count, removed count, [(path, error message)])"""
+		known = {}
+		prefix = os.path.join(os.path.abspath(directory), '')
+		for path, size, mtime in self.db.execute("SELECT path, size, mtime FROM shaders"):
+			if path.startswith(prefix):
+				known[path] = (size, mtime)
+		work = []
+		unchanged = 0
+		for path in find_shaders(directory):
+			path = os.path.abspath(path)
+			st = os.stat(path)
+			if known.pop(path, None) == (st.st_size, st.st_mtime):
+				unchanged += 1
+				continue
+			work.append((path, st.st_size, st.st_mtime))
+		removed = list(known)
+		for i in xrange(0, len(removed), INDEX_BATCH):
+			self.remove(removed[i:i + INDEX_BATCH])
+		if jobs <= 0:
+			jobs = multiprocessing.cpu_count()
+		pool = None
+		if jobs == 1 or len(work) < 2:
+			results = (hash_shader_file(job) for job in work)
+		else:
+			pool = multiprocessing.Pool(jobs)
+			results = pool.imap_unordered(hash_shader_file, work, max(1, min(256, len(work) // (jobs * 16))))
+		failures = []
+		rows = []
+		try:
+			for row in results:
+				if row[7] is not None:
+					failures.append((row[0], row[7]))
+				rows.append(row)
+				if len(rows) >= INDEX_BATCH:
+					self.insert(rows)
+					rows = []
+			self.insert(rows)
+		finally:
+			if pool is not None:
+				pool.close()
+				pool.join()
+		self.db.commit()
+		return (len(work), unchanged, len(removed), failures)
+	def remove(self, paths):
+		self.db.executemany("DELETE FROM terms WHERE shader IN (SELECT rowid FROM shaders WHERE path = ?)", [(path,) for path in paths])
+		self.db.executemany("DELETE FROM shaders WHERE path = ?", [(path,) for path in paths])
+	def insert(self, rows):
+		"""Add or replace hash_shader_file rows along with their postings"""
+		self.remove([row[0] for row in rows])
+		postings = []
+		for row in rows:
+			shader = self.db.execute("INSERT INTO shaders VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row[:8]).lastrowid
+			postings.extend([(term, shader) for term in row[8]])
+		self.db.executemany("INSERT INTO terms VALUES (?, ?)", postings)
+	def counts(self):
+		"""(shader count, unique exact hashes, unique structural hashes)"""
+		return self.db.execute("SELECT COUNT(*), COUNT(DISTINCT exact), COUNT(DISTINCT structural) FROM shaders").fetchone()
+	def posting_counts(self):
+		"""(distinct terms, postings)"""
+		return self.db.execute("SELECT COUNT(DISTINCT term), COUNT(*) FROM terms").fetchone()
+	def query(self, terms):
+		"""Sorted paths of the shaders with all of terms
+
+		A term starting with '-' excludes the shaders that have it, a '*' in a term matches any run of characters"""
+		includes = []
+		excludes = []
+		for term in terms:
+			matches = includes
+			if term.startswith('-'):
+				matches = excludes
+				term = term[1:]
+			if '*' in term:
+				matches.append(("term GLOB ?", term.replace('[', '[[]').replace('?', '[?]')))
+			else:
+				matches.append(("term = ?", term))
+		selects = ["SELECT shader FROM terms WHERE " + condition for condition, value in includes] or ["SELECT rowid FROM shaders WHERE error IS NULL"]
+		sql = " INTERSECT ".join(selects) + "".join([" EXCEPT SELECT shader FROM terms WHERE " + condition for condition, value in excludes])
+		params = [value for condition, value in includes + excludes]
+		return [row[0] for row in self.db.execute("SELECT path FROM shaders WHERE rowid IN (%s) ORDER BY path" % sql, params)]
+	def groups(self, column='structural'):
+		"""Yield (hash, [paths]) for every hash in column shared by more than one shader"""
+		if column not in ('exact', 'structural'):
+			raise ValueError("unknown hash column %s" % column)
+		cursor = self.db.execute("SELECT %s, path FROM shaders WHERE %s IN "
+			"(SELECT %s FROM shaders WHERE %s IS NOT NULL GROUP BY %s HAVING COUNT(*) > 1) ORDER BY %s, path" % ((column,) * 6))
+		current = None
+		paths = []
+		for value, path in cursor:
+			if value != current:
+				if paths:
+					yield (current, paths)
+				current = value
+				paths = []
+			paths.append(path)
+		if paths:
+			yield (current, paths)
+	def unique(self, column='structural'):
+		"""Yield one representative path per distinct hash in column"""
+		if column not in ('exact', 'structural'):
+			raise ValueError("unknown hash column %s" % column)
+		for row in self.db.execute("SELECT MIN(path) FROM shaders WHERE %s IS NOT NULL GROUP BY %s ORDER BY 1" % (column, column)):
+			yield row[0]
+
+def update_index(index, directory, jobs):
+	"""Update index from directory, printing failures and the update counts"""
+	start = time.time()
+	indexed, unchanged, removed, failures = index.update(directory, jobs)
+	elapsed = time.time() - start
+	for path, error in failures:
+		print >>sys.stderr, "%s: %s" % (path, error)
+	print "%d indexed, %d unchanged, %d removed, %d failed in %.2fs" % (indexed, unchanged, removed, len(failures), elapsed)
+
+def dedup_corpus(directory, indexPath, jobs=0):
+	"""Update the index at indexPath from directory and print a summary"""
+	index = ShaderIndex(indexPath)
+	try:
+		update_index(index, directory, jobs)
+		total, exact, structural = index.counts()
+		print "%d shaders, %d unique by bytes, %d unique by structure" % (total, exact, structural)
+	finally:
+		index.close()
+
+def index_corpus(directory, indexPath, jobs=0):
+	"""Update the index at indexPath from directory and print the size of the inverted index"""
+	index = ShaderIndex(indexPath)
+	try:
+		update_index(index, directory, jobs)
+		terms, postings = index.posting_counts()
+		print "%d shaders, %d terms, %d postings" % (index.counts()[0], terms, postings)
+	finally:
+		index.close()
+
+def query_corpus(indexPath, terms, out=sys.stdout):
+	"""Print the paths of the indexed shaders matching all of terms"""
+	if not os.path.exists(indexPath):
+		print >>sys.stderr, "%s: no such index" % indexPath
+		return
+	index = ShaderIndex(indexPath)
+	try:
+		start = time.time()
+		paths = index.query(terms)
+		elapsed = time.time() - start
+	finally:
+		index.close()
+	writer = ListingWriter(out, None)
+	for path in paths:
+		writer.add(path)
+	writer.flush()
+	print >>sys.stderr, "%d shaders in %.1fms" % (len(paths), 1000.0 * elapsed)
+
+# Structural diff
+# Instructions are aligned on their signatures with Myers' shortest edit script, so a diff shows the
+# instructions that were really added or removed rather than every line whose text moved
+
+# Past this many edits the rest of a pair of programs is reported as replaced instead of aligned
+DIFF_MAX_EDITS = 2000
+DIFF_CONTEXT = 3
+
+def myers_edits(a, b, maxEdits=DIFF_MAX_EDITS):
+	"""Shortest edit script turning sequence a into sequence b
+
+	Returns a list of (tag, i, j) in order: ('=', i, j) keeps a[i] == b[j], ('-', i, None) deletes a[i]
+	and ('+', None, j) inserts b[j]. Elements only need to support ==, the caller hashes them down first"""
+	n = len(a)
+	m = len(b)
+	start = 0
+	while start < n and start < m and a[start] == b[start]:
+		start += 1
+	end = 0
+	while end < n - start and end < m - start and a[n - 1 - end] == b[m - 1 - end]:
+		end += 1
+	head = [('=', i, i) for i in xrange(start)]
+	tail = [('=', n - end + i, m - end + i) for i in xrange(end)]
+	a = a[start:n - end]
+	b = b[start:m - end]
+	n = len(a)
+	m = len(b)
+	# v[k] is the furthest x reached on diagonal k = x - y, trace keeps v as it was before each edit count d
+	v = {1: 0}
+	trace = []
+	found = False
+	for d in xrange(min(n + m, maxEdits) + 1):
+		trace.append(v.copy())
+		for k in xrange(-d, d + 1, 2):
+			if k == -d or (k != d and v[k - 1] < v[k + 1]):
+				x = v[k + 1]
+			else:
+				x = v[k - 1] + 1
+			y = x - k
+			while x < n and y < m and a[x] == b[y]:
+				x += 1
+				y += 1
+			v[k] = x
+			if x >= n and y >= m:
+				found = True
+				break
+		if found:
+			break
+	if not found:
+		middle = [('-', start + i, None) for i in xrange(n)] + [('+', None, start + j) for j in xrange(m)]
+		return head + middle + tail
+	middle = []
+	x = n
+	y = m
+	for d in xrange(len(trace) - 1, -1, -1):
+		v = trace[d]
+		k = x - y
+		if k == -d or (k != d and v[k - 1] < v[k + 1]):
+			previousK = k + 1
+		else:
+			previousK = k - 1
+		previousX = v[previousK]
+		previousY = previousX - previousK
+		while x > previousX and y > previousY:
+			x -= 1
+			y -= 1
+			middle.append(('=', start + x, start + y))
+		if d > 0:
+			if x == previousX:
+				middle.append(('+', None, start + previousY))
+			else:
+				middle.append(('-', start + previousX, None))
+		x = previousX
+		y = previousY
+	middle.reverse()
+	return head + middle + tail
+
+class ShaderDiff(object):
+	"""Alignment of the instructions of two programs on their opcode and operand signatures
+
+	Comments are left out. ignoreRegisters masks out register numbers so renumbered registers compare equal,
+	ignoreConstants masks out def values"""
+	def __init__(self, old, new, ignoreRegisters=False, ignoreConstants=False):
+		self.old = old
+		self.new = new
+		self.old_instructions = [inst for inst in old.instructions if inst.token.op != D3DSIO_COMMENT]
+		self.new_instructions = [inst for inst in new.instructions if inst.token.op != D3DSIO_COMMENT]
+		# Signatures are interned to small integers so the alignment compares ints instead of nested tuples
+		ids = {}
+		oldIds = [ids.setdefault(inst.signature(ignoreRegisters, ignoreConstants), len(ids)) for inst in self.old_instructions]
+		newIds = [ids.setdefault(inst.signature(ignoreRegisters, ignoreConstants), len(ids)) for inst in self.new_instructions]
+		self.edits = myers_edits(oldIds, newIds)
+	def counts(self):
+		"""(deleted instructions, inserted instructions)"""
+		deleted = 0
+		inserted = 0
+		for tag, i, j in self.edits:
+			if tag == '-':
+				deleted += 1
+			elif tag == '+':
+				inserted += 1
+		return (deleted, inserted)
+	def changed(self):
+		return self.old.version != self.new.version or self.counts() != (0, 0)
+	def hunks(self, context=DIFF_CONTEXT):
+		"""Runs of edits with up to context unchanged instructions around each change"""
+		changes = [index for index, edit in enumerate(self.edits) if edit[0] != '=']
+		hunks = []
+		for index in changes:
+			if hunks and index - hunks[-1][1] <= 2 * context:
+				hunks[-1][1] = index
+			else:
+				hunks.append([index, index])
+		return [self.edits[max(0, first - context):last + context + 1] for first, last in hunks]
+	def to_string(self, context=DIFF_CONTEXT):
+		"""Unified diff style listing, with instruction numbers in the hunk headers"""
+		lines = []
+		oldText = self.old.context.version_string()
+		newText = self.new.context.version_string()
+		if oldText != newText:
+			lines.extend(["-" + oldText, "+" + newText])
+		for hunk in self.hunks(context):
+			oldLines = [i for tag, i, j in hunk if i is not None]
+			newLines = [j for tag, i, j in hunk if j is not None]
+			oldStart = oldLines[0] + 1 if oldLines else self.next_index(hunk, 1)
+			newStart = newLines[0] + 1 if newLines else self.next_index(hunk, 2)
+			lines.append("@@ -%d,%d +%d,%d @@" % (oldStart, len(oldLines), newStart, len(newLines)))
+			for tag, i, j in hunk:
+				if tag == '+':
+					lines.append("+" + instruction_text(self.new_instructions[j], self.new.context))
+				else:
+					lines.append(("-" if tag == '-' else " ") + instruction_text(self.old_instructions[i], self.old.context))
+		return "\n".join(lines)
+	def next_index(self, hunk, field):
+		"""Instruction number a hunk with no lines on one side starts after"""
+		position = self.edits.index(hunk[0])
+		for edit in reversed(self.edits[:position]):
+			if edit[field] is not None:
+				return edit[field] + 1
+		return 0
+
+def diff_shader_files(job):
+	"""Compare one (name, old path, new path, ignoreRegisters, ignoreConstants) job
+
+	Returns (name, status, deleted count, inserted count, error message or None) with status one of
+	'same', 'changed', 'added', 'removed' or 'failed'. Runs in the diff worker processes"""
+	name, oldPath, newPath, ignoreRegisters, ignoreConstants = job
+	if oldPath is None:
+		return (name, 'added', 0, 0, None)
+	if newPath is None:
+		return (name, 'removed', 0, 0, None)
+	try:
+		bytecodes = []
+		for path in (oldPath, newPath):
+			shaderFile = open(path, 'rb')
+			try:
+				bytecodes.append(shaderFile.read())
+			finally:
+				shaderFile.close()
+		if bytecodes[0] == bytecodes[1]:
+			return (name, 'same', 0, 0, None)
+		diff = ShaderDiff(decode(bytecodes[0]), decode(bytecodes[1]), ignoreRegisters, ignoreConstants)
+	except Exception as e:
+		return (name, 'failed', 0, 0, "%s: %s" % (e.__class__.__name__, e))
+	deleted, inserted = diff.counts()
+	return (name, 'changed' if diff.changed() else 'same', deleted, inserted, None)
+
+def diff_corpus(oldDirectory, newDirectory, jobs=0, ignoreRegisters=False, ignoreConstants=False):
+	"""Diff the shaders of two directories, pairing files by their relative path
+
+	Identical files are not decoded. Returns ([diff_shader_files results sorted by name], elapsed seconds)"""
+	start = time.time()
+	pairs = {}
+	for side, directory in enumerate((oldDirectory, newDirectory)):
+		for path in find_shaders(directory):
+			pairs.setdefault(os.path.relpath(path, directory), [None, None])[side] = path
+	work = [(name, oldPath, newPath, ignoreRegisters, ignoreConstants) for name, (oldPath, newPath) in sorted(pairs.items())]
+	if jobs <= 0:
+		jobs = multiprocessing.cpu_count()
+	if jobs == 1 or len(work) < 2:
+		results = [diff_shader_files(job) for job in work]
+	else:
+		pool = multiprocessing.Pool(jobs)
+		try:
+			results = list(pool.imap_unordered(diff_shader_files, work, max(1, min(256, len(work) // (jobs * 16)))))
+		finally:
+			pool.close()
+			pool.join()
+	results.sort()
+	return (results, time.time() - start)
+
+def print_corpus_diff(results, elapsed, out=sys.stdout):
+	"""Print the shaders that changed, were added, removed or failed to decode, then the totals"""
+	writer = ListingWriter(out, None)
+	totals = dict([(status, 0) for status in ('same', 'changed', 'added', 'removed', 'failed')])
+	for name, status, deleted, inserted, error in results:
+		totals[status] += 1
+		if status == 'changed':
+			writer.add("changed %s: -%d +%d" % (name, deleted, inserted))
+		elif status == 'failed':
+			print >>sys.stderr, "%s: %s" % (name, error)
+		elif status != 'same':
+			writer.add("%s %s" % (status, name))
+	writer.add("%d shaders, %d changed, %d added, %d removed, %d failed, %d unchanged in %.2fs" % (len(results),
+		totals['changed'], totals['added'], totals['removed'], totals['failed'], totals['same'], elapsed))
+	writer.flush()
+
+def diff_files(oldPath, newPath, out=sys.stdout, ignoreRegisters=False, ignoreConstants=False, context=DIFF_CONTEXT):
+	"""Print the structural diff of two shader files"""
+	programs = []
+	for path in (oldPath, newPath):
+		shaderFile = open(path, 'rb')
+		try:
+			programs.append(decode_stream(shaderFile))
+		finally:
+			shaderFile.close()
+	diff = ShaderDiff(programs[0], programs[1], ignoreRegisters, ignoreConstants)
+	writer = ListingWriter(out, None)
+	if diff.changed():
+		writer.add("--- %s" % oldPath)
+		writer.add("+++ %s" % newPath)
+		writer.add_text(diff.to_string(context))
+	writer.flush()
 
 def print_usage():
-	print "Usage: dxshd.py [-d] <file>"
+	print "Usage: dxshd.py [-d] <file> [-o OUTFILE]"
+	print "       dxshd.py --cfg <file> [-o OUTFILE]"
+	print "       dxshd.py --stats <file> [-o OUTFILE]"
+	print "       dxshd.py --optimize <file> [-o OUTFILE]"
+	print "       dxshd.py [-d] --batch DIR -o OUTDIR [-j N] [--cache CACHEDIR]"
+	print "       dxshd.py --format jsonl|msgpack <file> [-o OUTFILE]"
+	print "       dxshd.py [-d] --pack FILE [--offsets OFFSETFILE] [--stats | --optimize | --format jsonl|msgpack] [-o OUTFILE]"
+	print "       dxshd.py --dedup DIR --index-db FILE [-j N]"
+	print "       dxshd.py --index DIR --index-db FILE [-j N]"
+	print "       dxshd.py --query \"TERM [-TERM] ...\" --index-db FILE [-o OUTFILE]"
+	print "       dxshd.py --verify DIR [-j N]"
+	print "       dxshd.py --diff OLD NEW [--ignore-registers] [--ignore-constants] [-j N] [-o OUTFILE]"
 	print "File should contain only DirectX shader bytecode"
 
 def main(argc, argv):
-	if (argc < 2):
+	parser = argparse.ArgumentParser(prog='dxshd.py', add_help=False)
+	parser.add_argument('-d', dest='debug', action='store_true')
+	parser.add_argument('--cfg', action='store_true')
+	parser.add_argument('--stats', action='store_true')
+	parser.add_argument('--optimize', action='store_true')
+	parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default='text')
+	parser.add_argument('--batch', metavar='DIR')
+	parser.add_argument('-o', dest='output', metavar='OUTPUT')
+	parser.add_argument('-j', dest='jobs', type=int, default=0)
+	parser.add_argument('--cache', metavar='CACHEDIR')
+	parser.add_argument('--pack', metavar='FILE')
+	parser.add_argument('--offsets', metavar='OFFSETFILE')
+	parser.add_argument('--dedup', metavar='DIR')
+	parser.add_argument('--index', metavar='DIR')
+	parser.add_argument('--query', metavar='TERMS')
+	parser.add_argument('--index-db', dest='index_db', metavar='FILE')
+	parser.add_argument('--verify', metavar='DIR')
+	parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'))
+	parser.add_argument('--ignore-registers', dest='ignore_registers', action='store_true')
+	parser.add_argument('--ignore-constants', dest='ignore_constants', action='store_true')
+	parser.add_argument('file', nargs='?')
+	args, unknown = parser.parse_known_args(argv[1:argc])
+	if unknown:
 		print_usage()
 		return
-	isDebug = False
-	fileName = ''
-	if (argv[1] == '-d'):
-		isDebug = True
-		if (argc < 3):
+	if args.batch is not None:
+		if args.output is None:
 			print_usage()
 			return
-		fileName = argv[2]
-	else:
-		fileName = argv[1]
-	shaderFile = open(fileName, 'rb')
-	shaderBytecode = shaderFile.read()
-	disassemble(shaderBytecode, isDebug)
+		print_batch_summary(*disassemble_batch(args.batch, args.output, args.jobs, args.debug, args.cache))
+		return
+	if args.dedup is not None:
+		if args.index_db is None:
+			print_usage()
+			return
+		dedup_corpus(args.dedup, args.index_db, args.jobs)
+		return
+	if args.index is not None or args.query is not None:
+		if args.index_db is None:
+			print_usage()
+			return
+		if args.index is not None:
+			index_corpus(args.index, args.index_db, args.jobs)
+		if args.query is not None:
+			out = sys.stdout if args.output is None else open(args.output, 'w')
+			try:
+				query_corpus(args.index_db, args.query.split(), out)
+			finally:
+				if args.output is not None:
+					out.close()
+		return
+	if args.verify is not None:
+		files, failures, elapsed = verify_round_trip(args.verify, args.jobs)
+		for path, error in failures:
+			print >>sys.stderr, "%s: %s" % (path, error)
+		print "%d files, %d round-tripped, %d failed in %.2fs" % (files, files - len(failures), len(failures), elapsed)
+		return
+	if args.diff is not None:
+		oldPath, newPath = args.diff
+		out = sys.stdout if args.output is None else open(args.output, 'w')
+		try:
+			if os.path.isdir(oldPath) and os.path.isdir(newPath):
+				results, elapsed = diff_corpus(oldPath, newPath, args.jobs, args.ignore_registers, args.ignore_constants)
+				print_corpus_diff(results, elapsed, out)
+			else:
+				diff_files(oldPath, newPath, out, args.ignore_registers, args.ignore_constants)
+		finally:
+			if args.output is not None:
+				out.close()
+		return
+	if args.pack is None and args.file is None:
+		print_usage()
+		return
+	# Outside of --batch, -o names the file the output goes to
+	if args.output_format == 'msgpack' and msgpack is None:
+		print >>sys.stderr, "--format msgpack needs the msgpack module"
+		return
+	out = sys.stdout
+	if args.output is not None:
+		out = open(args.output, 'wb' if args.output_format == 'msgpack' else 'w')
+	elif args.output_format == 'msgpack':
+		out = getattr(sys.stdout, 'buffer', sys.stdout)
+	try:
+		if args.pack is not None:
+			offsets = None
+			if args.offsets is not None:
+				offsets = read_offset_table(args.offsets)
+			disassemble_pack(args.pack, offsets, args.debug, out, stats=args.stats, optimized=args.optimize, outputFormat=args.output_format)
+			return
+		shaderFile = open(args.file, 'rb')
+		try:
+			writer = ListingWriter(out, None)
+			if args.cfg:
+				writer.add(decode_stream(shaderFile).control_flow().to_string())
+			elif args.stats:
+				writer.add(shader_stats(shaderFile).to_json())
+			elif args.optimize:
+				program, report = optimize(decode_stream(shaderFile))
+				writer.add_text(program.to_text(args.debug))
+				writer.add("// %d -> %d instructions, %d -> %d slots" % (tuple(report['instructions']) + tuple(report['slots'])))
+				writer.add("// %s" % ", ".join(["%s %d" % item for item in report['passes'].items()]))
+			elif args.output_format != 'text':
+				write_records(shaderFile, out, args.output_format)
+			else:
+				disassemble_stream(shaderFile, args.debug, out)
+			writer.flush()
+		finally:
+			shaderFile.close()
+	finally:
+		if args.output is not None:
+			out.close()
 
 if __name__=="__main__":
 	main(len(sys.argv), sys.argv)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# DisassemblyCache memory LRU order, hit and miss counters and the disk size bound
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import shadergen
+import dxshd
+
+def shaders(count):
+	"""Distinct vertex and pixel shaders"""
+	return shadergen.corpus(count, 1)
+
+class MemoryCacheTest(unittest.TestCase):
+	def test_least_recently_used_entry_is_dropped(self):
+		a, b, c = shaders(3)
+		cache = dxshd.DisassemblyCache(capacity=2)
+		cache.lookup(a)
+		cache.lookup(b)
+		cache.lookup(a)
+		cache.lookup(c)
+		self.assertEqual(list(cache.entries), [cache.key(a, False), cache.key(c, False)])
+		cache.lookup(b)
+		self.assertEqual(list(cache.entries), [cache.key(c, False), cache.key(b, False)])
+		self.assertEqual(cache.stats(), {'hits': 1, 'disk_hits': 0, 'misses': 4})
+	def test_hits_return_the_decoded_entry(self):
+		a = shaders(1)[0]
+		cache = dxshd.DisassemblyCache()
+		program, listing = cache.lookup(a)
+		self.assertEqual(listing, dxshd.disassemble_text(a))
+		self.assertTrue(cache.lookup(a)[0] is program)
+		self.assertEqual(cache.stats(), {'hits': 1, 'disk_hits': 0, 'misses': 1})
+	def test_debug_listings_are_separate_entries(self):
+		a = shaders(1)[0]
+		cache = dxshd.DisassemblyCache()
+		self.assertNotEqual(cache.lookup(a, False)[1], cache.lookup(a, True)[1])
+		self.assertEqual(cache.stats()['misses'], 2)
+
+class DiskCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.directory, True)
+	def stored_bytes(self, cache):
+		return sum([size for path, size, mtime in cache.disk_entries()])
+	def test_disk_hits_across_caches(self):
+		blobs = shaders(4)
+		first = dxshd.DisassemblyCache(directory=self.directory)
+		for bytecode in blobs:
+			first.lookup(bytecode)
+		second = dxshd.DisassemblyCache(capacity=2, directory=self.directory)
+		self.assertEqual(second.disk_bytes, first.disk_bytes)
+		for bytecode in blobs + blobs[-2:]:
+			self.assertEqual(second.lookup(bytecode)[1], dxshd.disassemble_text(bytecode))
+		self.assertEqual(second.stats(), {'hits': 2, 'disk_hits': 4, 'misses': 0})
+	def test_storing_a_key_again_counts_it_once(self):
+		cache = dxshd.DisassemblyCache(directory=self.directory)
+		bytecode = shaders(1)[0]
+		entry = cache.lookup(bytecode)
+		key = cache.key(bytecode, False)
+		for i in range(5):
+			cache.store(key, entry)
+		self.assertEqual(cache.disk_bytes, self.stored_bytes(cache))
+		self.assertEqual(len(cache.disk_entries()), 1)
+	def test_disk_size_bound(self):
+		blobs = shaders(12)
+		probe = dxshd.DisassemblyCache(directory=tempfile.mkdtemp())
+		try:
+			for bytecode in blobs:
+				probe.lookup(bytecode)
+			entrySize = max([size for path, size, mtime in probe.disk_entries()])
+		finally:
+			shutil.rmtree(probe.directory, True)
+		limit = entrySize * 5
+		cache = dxshd.DisassemblyCache(capacity=1, directory=self.directory, maxDiskBytes=limit)
+		for i, bytecode in enumerate(blobs):
+			cache.lookup(bytecode)
+			# Entries get distinct, increasing mtimes so eviction order does not depend on timer resolution
+			os.utime(cache.entry_path(cache.key(bytecode, False)), (1000000 + i, 1000000 + i))
+			self.assertTrue(cache.disk_bytes <= limit)
+			self.assertEqual(cache.disk_bytes, self.stored_bytes(cache))
+		kept = set([path for path, size, mtime in cache.disk_entries()])
+		self.assertTrue(cache.entry_path(cache.key(blobs[-1], False)) in kept)
+		self.assertFalse(cache.entry_path(cache.key(blobs[0], False)) in kept)
+		self.assertTrue(len(kept) < len(blobs))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+# Vertex and pixel shaders disassembled side by side on threads must not share shader state
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+from multiprocessing.pool import ThreadPool
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import dst, src, inst, pack
+import shadergen
+import dxshd
+
+def vertex_shader(blocks):
+	"""vs_2_0 writing o0 through a0 relative constants, register type 3 is a# here"""
+	t = [0xFFFE0200]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	for i in range(blocks):
+		t += inst(dxshd.D3DSIO_MOVA, dst(0, dxshd.D3DSPR_ADDR, 0x1), src(0, dxshd.D3DSPR_INPUT, 0x00))
+		t += inst(dxshd.D3DSIO_ADD, dst(i % 8, dxshd.D3DSPR_OUTPUT), src(i, dxshd.D3DSPR_CONST, 0xE4, 0, 1), src(0, dxshd.D3DSPR_ADDR, 0x00), src(0, dxshd.D3DSPR_INPUT))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def pixel_shader(blocks):
+	"""ps_2_0 reading t# texture coordinates and writing oC0, register type 3 is t# here"""
+	t = [0xFFFF0200]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000, dst(0, dxshd.D3DSPR_TEXTURE))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DSTT_2D << 27), dst(0, dxshd.D3DSPR_SAMPLER))
+	for i in range(blocks):
+		t += inst(dxshd.D3DSIO_TEX, dst(i % 4, dxshd.D3DSPR_TEMP), src(i % 8, dxshd.D3DSPR_TEXTURE), src(0, dxshd.D3DSPR_SAMPLER))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_COLOROUT), src(0, dxshd.D3DSPR_TEMP))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def mixed_blobs(count):
+	"""Vertex and pixel shaders in alternation, from this file and from shadergen"""
+	blobs = []
+	for i in range(count):
+		if i % 4 == 0:
+			blobs.append(vertex_shader(1 + i % 9))
+		elif i % 4 == 1:
+			blobs.append(pixel_shader(1 + i % 7))
+		elif i % 4 == 2:
+			blobs.append(shadergen.vertex_shader(1 + i % 3))
+		else:
+			blobs.append(shadergen.pixel_shader(1 + i % 3))
+	return blobs
+
+def single_threaded(bytecode):
+	out = StringIO()
+	dxshd.disassemble(bytecode, False, out)
+	return out.getvalue()
+
+class ConcurrentDisassemblyTest(unittest.TestCase):
+	def setUp(self):
+		self.blobs = mixed_blobs(200)
+		self.expected = [single_threaded(bytecode) for bytecode in self.blobs]
+	def test_listings_use_the_shader_type_mnemonics(self):
+		vs, ps = self.expected[0], self.expected[1]
+		self.assertTrue(vs.startswith('vs_2_0'))
+		self.assertTrue('add o0, c[a0.x], v0' in vs)
+		self.assertFalse('oC0' in vs)
+		self.assertTrue(ps.startswith('ps_2_0'))
+		self.assertTrue('tex r0, t0, s0' in ps)
+		self.assertTrue('mov oC0, r0' in ps)
+		self.assertFalse('a0' in ps)
+	def test_disassemble_many_matches_single_threaded(self):
+		for i in range(3):
+			self.assertEqual(dxshd.disassemble_many(self.blobs, jobs=8), self.expected)
+	def test_interleaved_threads_match_single_threaded(self):
+		order = [i for i in range(len(self.blobs)) for repeat in range(4)]
+		pool = ThreadPool(8)
+		try:
+			results = pool.map(lambda i: (i, single_threaded(self.blobs[i])), order, 1)
+		finally:
+			pool.close()
+			pool.join()
+		for i, text in results:
+			self.assertEqual(text, self.expected[i])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,187 @@
+# Byte-exact decode/encode round trips over a synthetic corpus and hand-made edge cases,
+# and operands decoded up to the length field where the count depends on the shader version
+# Usage: python -m unittest discover tests
+
+import io
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import dst, src, inst, pack, float_token, constant_table
+import shadergen
+import dxshd
+
+def relative_addressing():
+	"""vs_3_0 with a0 and aL relative sources and an aL relative output"""
+	t = [0xFFFE0300]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DDECLUSAGE_TEXCOORD | (3 << 16)), dst(1, dxshd.D3DSPR_OUTPUT))
+	t += inst(dxshd.D3DSIO_DEFI, dst(0, dxshd.D3DSPR_CONSTINT), 3, 0, 1, 0)
+	t += inst(dxshd.D3DSIO_MOVA, dst(0, dxshd.D3DSPR_ADDR, 0x3), src(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(7, dxshd.D3DSPR_CONST, 0xE4, 1, 1), src(0, dxshd.D3DSPR_ADDR, 0x55),
+		src(2, dxshd.D3DSPR_CONST, 0x1B, 0, 1), src(0, dxshd.D3DSPR_ADDR, 0x00))
+	t += inst(dxshd.D3DSIO_LOOP, src(0, dxshd.D3DSPR_LOOP), src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_MOV, dst(1, dxshd.D3DSPR_OUTPUT, 0xf, 0, 1), src(0, dxshd.D3DSPR_LOOP, 0x00),
+		src(20, dxshd.D3DSPR_CONST, 0xE4, 0, 1), src(0, dxshd.D3DSPR_LOOP, 0x00))
+	t += inst(dxshd.D3DSIO_ENDLOOP)
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def comments():
+	"""Plain comment, CTAB comment and an empty comment between instructions"""
+	t = [0xFFFF0200]
+	t += [dxshd.D3DSIO_COMMENT | (3 << 16), 0x12345678, 0, 0xFFFFFFFF]
+	t += constant_table([('Tint', dxshd.D3DXRS_FLOAT4, 0, 1, (1, 3, 1, 4, 1))], 'ps_2_0')
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_COLOROUT), src(0, dxshd.D3DSPR_CONST))
+	t += [dxshd.D3DSIO_COMMENT]
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def predication():
+	"""ps_3_0 setp with predicated writes, including a negated predicate and a predicated breakp"""
+	t = [0xFFFF0300]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_COLOR, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_SETP, dst(0, dxshd.D3DSPR_PREDICATE, 0x3), src(0, dxshd.D3DSPR_INPUT), src(0, dxshd.D3DSPR_CONST), flags=4)
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_TEMP, 0x3, 2), src(0, dxshd.D3DSPR_PREDICATE, 0x55, 13), src(0, dxshd.D3DSPR_INPUT), predicated=1)
+	t += inst(dxshd.D3DSIO_REP, src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_BREAKP, src(0, dxshd.D3DSPR_PREDICATE, 0x00))
+	t += inst(dxshd.D3DSIO_ENDREP)
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_COLOROUT, 0xf, 1), src(0, dxshd.D3DSPR_TEMP, 0xE4, 11))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def constants():
+	"""def with negative zero, NaN and infinity bit patterns, defi with negative ints and both defb values"""
+	t = [0xFFFE0300]
+	t += inst(dxshd.D3DSIO_DEF, dst(0, dxshd.D3DSPR_CONST), float_token(-0.0), 0x7FC00001, 0x7F800000, float_token(1e-30))
+	t += inst(dxshd.D3DSIO_DEF, dst(255, dxshd.D3DSPR_CONST), float_token(1.5), float_token(-2.25), 0, float_token(3.0e38))
+	t += inst(dxshd.D3DSIO_DEFI, dst(15, dxshd.D3DSPR_CONSTINT), 255, struct.unpack('<I', struct.pack('<i', -128))[0], 127, 0)
+	t += inst(dxshd.D3DSIO_DEFB, dst(0, dxshd.D3DSPR_CONSTBOOL), 1)
+	t += inst(dxshd.D3DSIO_DEFB, dst(15, dxshd.D3DSPR_CONSTBOOL), 0)
+	t += inst(dxshd.D3DSIO_IF, src(15, dxshd.D3DSPR_CONSTBOOL))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(255, dxshd.D3DSPR_CONST, 0x1B, 3))
+	t += inst(dxshd.D3DSIO_ENDIF)
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def texture_flags():
+	"""ps_2_0 texldp and texldb, dcl of volume and cube samplers, sincos with its scratch registers in vs_2_0 form"""
+	t = [0xFFFF0200]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000, dst(0, dxshd.D3DSPR_TEXTURE, 0x7))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DSTT_VOLUME << 27), dst(0, dxshd.D3DSPR_SAMPLER))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | (dxshd.D3DSTT_CUBE << 27), dst(1, dxshd.D3DSPR_SAMPLER))
+	t += inst(dxshd.D3DSIO_TEX, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEXTURE), src(0, dxshd.D3DSPR_SAMPLER), flags=1)
+	t += inst(dxshd.D3DSIO_TEX, dst(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEXTURE), src(1, dxshd.D3DSPR_SAMPLER), flags=2)
+	t += inst(dxshd.D3DSIO_SINCOS, dst(2, dxshd.D3DSPR_TEMP, 0x3), src(0, dxshd.D3DSPR_TEMP, 0xFF), src(0, dxshd.D3DSPR_CONST), src(1, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_MAD, dst(0, dxshd.D3DSPR_COLOROUT, 0xf, 3), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP, 0xE4, 6), src(2, dxshd.D3DSPR_TEMP, 0x44))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def ps_1_1_textures():
+	"""ps_1_1 tex t0 and tex t1, which have a destination and no sources"""
+	t = [0xFFFF0101]
+	t += inst(dxshd.D3DSIO_TEX, dst(0, dxshd.D3DSPR_TEXTURE))
+	t += inst(dxshd.D3DSIO_TEX, dst(1, dxshd.D3DSPR_TEXTURE))
+	t += inst(dxshd.D3DSIO_MUL, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEXTURE), src(1, dxshd.D3DSPR_TEXTURE))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def ps_1_4_textures():
+	"""ps_1_4 texcrd and texld with one source each, and a dependent texld in the second phase"""
+	t = [0xFFFF0104]
+	t += inst(dxshd.D3DSIO_TEXCOORD, dst(1, dxshd.D3DSPR_TEMP, 0x7), src(1, dxshd.D3DSPR_TEXTURE))
+	t += inst(dxshd.D3DSIO_TEX, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEXTURE))
+	t += inst(dxshd.D3DSIO_PHASE)
+	t += inst(dxshd.D3DSIO_TEX, dst(2, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_TEMP))
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def corpus():
+	"""(name, bytecode) of every shader the round trip is checked on"""
+	cases = [('synthetic %d' % i, bytecode) for i, bytecode in enumerate(shadergen.corpus(24, 2))]
+	cases += [
+		('vertex_shader', shadergen.vertex_shader(3)),
+		('pixel_shader', shadergen.pixel_shader(3)),
+		('relative_addressing', relative_addressing()),
+		('comments', comments()),
+		('predication', predication()),
+		('constants', constants()),
+		('texture_flags', texture_flags()),
+		('ps_1_1_textures', ps_1_1_textures()),
+		('ps_1_4_textures', ps_1_4_textures())
+	]
+	return cases
+
+class RoundTripTest(unittest.TestCase):
+	def test_decode_encode_is_byte_exact(self):
+		for name, bytecode in corpus():
+			self.assertEqual(dxshd.decode(bytecode).encode(), bytecode, name)
+	def test_stream_decode_encodes_the_same(self):
+		for name, bytecode in corpus():
+			self.assertEqual(dxshd.decode_stream(bytecode).encode(), bytecode, name)
+	def test_listing_survives_round_trip(self):
+		for name, bytecode in corpus():
+			program = dxshd.decode(bytecode)
+			self.assertEqual(dxshd.decode(program.encode()).to_text(), program.to_text(), name)
+	def test_cases_cover_the_edge_tokens(self):
+		ops = set()
+		relative = False
+		for name, bytecode in corpus():
+			for instruction in dxshd.decode(bytecode).instructions:
+				ops.add(instruction.token.op)
+				relative = relative or any([param.is_relative for param in instruction.operands()])
+		for op in (dxshd.D3DSIO_COMMENT, dxshd.D3DSIO_DEF, dxshd.D3DSIO_DEFI, dxshd.D3DSIO_DEFB, dxshd.D3DSIO_SETP, dxshd.D3DSIO_BREAKP):
+			self.assertTrue(op in ops, dxshd.D3DSIO[op]['op'])
+		self.assertTrue(relative)
+	def test_verify_accepts_ps_1_x(self):
+		directory = tempfile.mkdtemp()
+		try:
+			for name, bytecode in (('tex.pso', ps_1_1_textures()), ('texld.pso', ps_1_4_textures())):
+				shaderFile = open(os.path.join(directory, name), 'wb')
+				shaderFile.write(bytecode)
+				shaderFile.close()
+			files, failures, elapsed = dxshd.verify_round_trip(directory, 1)
+		finally:
+			shutil.rmtree(directory, True)
+		self.assertEqual((files, failures), (2, []))
+
+class OperandCountTest(unittest.TestCase):
+	def operand_names(self, program):
+		ctx = program.context
+		return [[param.to_string(ctx) for param in instruction.operands()] for instruction in program.instructions]
+	def test_ps_1_1_tex_has_no_sources(self):
+		program = dxshd.decode_stream(io.BytesIO(ps_1_1_textures()))
+		self.assertEqual(self.operand_names(program), [['t0'], ['t1'], ['r0', 't0', 't1'], []])
+	def test_ps_1_4_texld_and_texcrd_have_one_source(self):
+		program = dxshd.decode_stream(ps_1_4_textures())
+		self.assertEqual(self.operand_names(program), [['r1.xyz', 't1'], ['r0', 't0'], [], ['r2', 'r1'], ['r0', 'r0', 'r2'], []])
+	def test_streamed_listing_matches_decode(self):
+		for bytecode in (ps_1_1_textures(), ps_1_4_textures()):
+			out = StringIO()
+			dxshd.disassemble_stream(io.BytesIO(bytecode), False, out)
+			self.assertEqual(out.getvalue(), dxshd.decode(bytecode).to_text())
+	def test_operands_past_the_length_are_rejected(self):
+		# add whose length covers its destination and one source, the second source is relative and needs one more token
+		t = [0xFFFE0200]
+		t += [dxshd.D3DSIO_ADD | (3 << 24), dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(0, dxshd.D3DSPR_CONST, 0xE4, 0, 1)]
+		t += [src(0, dxshd.D3DSPR_ADDR, 0x00), dxshd.D3DSIO_END]
+		for decoder in (dxshd.decode, dxshd.decode_stream):
+			self.assertRaises(dxshd.TokenStreamError, decoder, pack(t))
+	def test_truncated_instruction(self):
+		bytecode = pack([0xFFFE0200] + inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(1, dxshd.D3DSPR_INPUT))[:-1])
+		for decoder in (dxshd.decode, dxshd.decode_stream):
+			self.assertRaises(dxshd.TokenStreamError, decoder, bytecode)
+
+if __name__ == "__main__":
+	unittest.main()
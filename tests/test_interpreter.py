@@ -0,0 +1,153 @@
+# Interpreter and compiled shader agreement on flow control
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import dst, src, inst, pack
+import shadergen
+import dxshd
+
+VS_3_0 = 0xFFFE0300
+
+def vertex_program(body):
+	"""vs_3_0 with v0 and o0 declared, body tokens, then end"""
+	t = [VS_3_0]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_OUTPUT))
+	t += inst(dxshd.D3DSIO_DEFI, dst(0, dxshd.D3DSPR_CONSTINT), 4, 0, 1, 0)
+	t += body
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def breakc_loop():
+	"""loop with breakc v0.x > c0.x, the lanes that broke out must run the add after endloop"""
+	t = inst(dxshd.D3DSIO_LOOP, src(0, dxshd.D3DSPR_LOOP), src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_BREAKC, src(0, dxshd.D3DSPR_INPUT, 0x00), src(0, dxshd.D3DSPR_CONST, 0x00), flags=1)
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0x55))
+	t += inst(dxshd.D3DSIO_ENDLOOP)
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_OUTPUT), src(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0x55))
+	return vertex_program(t)
+
+def break_in_if():
+	"""rep with a break inside an if/else, then a second loop over the same lanes"""
+	t = inst(dxshd.D3DSIO_REP, src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0x55))
+	t += inst(dxshd.D3DSIO_IFC, src(0, dxshd.D3DSPR_TEMP, 0x00), src(0, dxshd.D3DSPR_INPUT, 0x55), flags=3)
+	t += inst(dxshd.D3DSIO_BREAK)
+	t += inst(dxshd.D3DSIO_ELSE)
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0xAA))
+	t += inst(dxshd.D3DSIO_ENDIF)
+	t += inst(dxshd.D3DSIO_ENDREP)
+	t += inst(dxshd.D3DSIO_REP, src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0x55))
+	t += inst(dxshd.D3DSIO_ENDREP)
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_OUTPUT), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP))
+	return vertex_program(t)
+
+def nested_breakp():
+	"""Nested loops, breakp leaves the inner loop only, a call inside the outer loop returns early for some lanes"""
+	t = inst(dxshd.D3DSIO_LOOP, src(0, dxshd.D3DSPR_LOOP), src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_REP, src(0, dxshd.D3DSPR_CONSTINT))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0x55))
+	t += inst(dxshd.D3DSIO_SETP, dst(0, dxshd.D3DSPR_PREDICATE, 0x1), src(0, dxshd.D3DSPR_TEMP, 0x00), src(0, dxshd.D3DSPR_INPUT, 0x00), flags=3)
+	t += inst(dxshd.D3DSIO_BREAKP, src(0, dxshd.D3DSPR_PREDICATE, 0x00))
+	t += inst(dxshd.D3DSIO_ENDREP)
+	t += inst(dxshd.D3DSIO_CALL, src(0, dxshd.D3DSPR_LABEL))
+	t += inst(dxshd.D3DSIO_ENDLOOP)
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_OUTPUT), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP))
+	t += inst(dxshd.D3DSIO_RET)
+	t += inst(dxshd.D3DSIO_LABEL, src(0, dxshd.D3DSPR_LABEL))
+	t += inst(dxshd.D3DSIO_IFC, src(0, dxshd.D3DSPR_INPUT, 0x55), src(0, dxshd.D3DSPR_CONST, 0x00), flags=1)
+	t += inst(dxshd.D3DSIO_RET)
+	t += inst(dxshd.D3DSIO_ENDIF)
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_CONST, 0xAA))
+	t += inst(dxshd.D3DSIO_RET)
+	return vertex_program(t)
+
+def flow_inputs(count=8):
+	lanes = numpy.arange(count, dtype=numpy.float32)
+	return {
+		'v0': numpy.stack([lanes % 2, lanes % 5, lanes, lanes], axis=1),
+		'c0': (0.5, 1.0, 2.0, 0.0)
+	}
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class FlowControlTest(unittest.TestCase):
+	def run_both(self, bytecode, inputs):
+		program = dxshd.decode(bytecode)
+		interpreted = dxshd.Interpreter(program).run(inputs)
+		compiled = dxshd.compile_shader(bytecode).run(inputs)
+		self.assertEqual(sorted(interpreted), sorted(compiled))
+		for name in interpreted:
+			numpy.testing.assert_array_equal(interpreted[name], compiled[name], name)
+		return interpreted
+	def test_breakc_lanes_resume_after_loop(self):
+		outputs = self.run_both(breakc_loop(), {'v0': [[0, 0, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0], [1, 0, 0, 0]], 'c0': (0.5, 1.0, 0.0, 0.0)})
+		self.assertEqual(list(outputs['o0'][:, 0]), [5.0, 1.0, 5.0, 1.0])
+	def test_break_in_if(self):
+		self.run_both(break_in_if(), flow_inputs())
+	def test_nested_breakp_and_call(self):
+		self.run_both(nested_breakp(), flow_inputs())
+	def test_synthetic_vertex_shader(self):
+		inputs = flow_inputs()
+		inputs['v1'] = numpy.ones((8, 4), numpy.float32)
+		inputs['i0'] = (3, 0, 1, 0)
+		inputs['b0'] = True
+		for register in range(64):
+			inputs['c%d' % register] = (0.25 * register, 1.0, -0.5, 2.0)
+		self.run_both(shadergen.vertex_shader(4), inputs)
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class UnsupportedInstructionTest(unittest.TestCase):
+	def test_unsupported_opcode(self):
+		t = [0xFFFF0104]
+		t += inst(dxshd.D3DSIO_BEM, dst(0, dxshd.D3DSPR_TEMP, 0x3), src(0, dxshd.D3DSPR_TEMP), src(1, dxshd.D3DSPR_TEMP))
+		t += [dxshd.D3DSIO_END]
+		program = dxshd.decode(pack(t))
+		with self.assertRaises(dxshd.UnsupportedInstructionError) as raised:
+			dxshd.Interpreter(program).run({'r0': (0.0, 0.0, 0.0, 0.0)}, 4)
+		self.assertTrue(isinstance(raised.exception, ValueError))
+		self.assertTrue(raised.exception.instruction is program.instructions[0])
+		self.assertEqual(str(raised.exception), "bem at offset 0x4: not supported by the interpreter")
+	def test_unsampled_texture_op(self):
+		t = [0xFFFF0101]
+		t += inst(dxshd.D3DSIO_TEXCOORD, dst(0, dxshd.D3DSPR_TEXTURE))
+		t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEXTURE))
+		t += [dxshd.D3DSIO_END]
+		bytecode = pack(t)
+		for machine in (dxshd.Interpreter(dxshd.decode(bytecode)), dxshd.compile_shader(bytecode)):
+			with self.assertRaises(dxshd.UnsupportedInstructionError) as raised:
+				machine.run({}, 4)
+			self.assertEqual(str(raised.exception), "texcoord at offset 0x4: not supported by the texture sampler")
+	def test_compiler_falls_back_to_interpreter(self):
+		t = inst(dxshd.D3DSIO_LOOP, src(0, dxshd.D3DSPR_LOOP), src(0, dxshd.D3DSPR_CONSTINT))
+		t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT, 0xE4, 0, 1), src(0, dxshd.D3DSPR_LOOP, 0x00))
+		t += inst(dxshd.D3DSIO_ENDLOOP)
+		t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(0, dxshd.D3DSPR_TEMP))
+		bytecode = vertex_program(t)
+		with self.assertRaises(dxshd.UnsupportedInstructionError) as raised:
+			dxshd.compile_shader(bytecode)
+		self.assertEqual(str(raised.exception), "add at offset 0x40: relative addressing of v0 registers is not supported by the compiler")
+		inputs = dict([('v%d' % register, (register, 0.0, 0.0, 1.0)) for register in range(4)])
+		outputs = dxshd.Interpreter(dxshd.decode(bytecode)).run(inputs, 2)
+		self.assertEqual(list(outputs['o0'][0]), [6.0, 0.0, 0.0, 4.0])
+	def test_per_lane_relative_input(self):
+		t = inst(dxshd.D3DSIO_MOVA, dst(0, dxshd.D3DSPR_ADDR, 0x1), src(0, dxshd.D3DSPR_INPUT, 0x00))
+		t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(1, dxshd.D3DSPR_INPUT, 0xE4, 0, 1), src(0, dxshd.D3DSPR_ADDR, 0x00))
+		program = dxshd.decode(vertex_program(t))
+		with self.assertRaises(dxshd.UnsupportedInstructionError) as raised:
+			dxshd.Interpreter(program).run(flow_inputs())
+		self.assertTrue(raised.exception.instruction is program.instructions[4])
+		self.assertTrue('per-lane relative addressing of v1 registers' in str(raised.exception))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,92 @@
+# Peephole optimizer passes must leave the interpreted outputs as they were
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import dst, src, inst, pack
+import shadergen
+import dxshd
+
+def vertex_program(body):
+	"""vs_3_0 with v0 and o0 declared, body tokens, then end"""
+	t = [0xFFFE0300]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_OUTPUT))
+	t += body
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def partly_overwritten_product():
+	"""mul r0.xy, c0, c1 / mov r0.x, c3 / add r1.xy, r0, c2 / mov o0, r1, the add reads x from the mov"""
+	t = inst(dxshd.D3DSIO_MUL, dst(0, dxshd.D3DSPR_TEMP, 0x3), src(0, dxshd.D3DSPR_CONST), src(1, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_TEMP, 0x1), src(3, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP, 0x3), src(0, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(1, dxshd.D3DSPR_TEMP))
+	return vertex_program(t)
+
+def overwritten_factor():
+	"""mul r0, v0, r2 / add r2, r2, c3 / add r1, r0, r2, the factor r2 changes before the add"""
+	t = inst(dxshd.D3DSIO_ADD, dst(2, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(4, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_MUL, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(2, dxshd.D3DSPR_TEMP))
+	t += inst(dxshd.D3DSIO_ADD, dst(2, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_TEMP), src(3, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP), src(2, dxshd.D3DSPR_TEMP))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(1, dxshd.D3DSPR_TEMP))
+	return vertex_program(t)
+
+def fusable_product():
+	"""mul r0, v0, c1 / add r1, -r0.yxzw, c2 / mov o0, r1, which becomes a single mad"""
+	t = inst(dxshd.D3DSIO_MUL, dst(0, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_INPUT), src(1, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP), src(0, dxshd.D3DSPR_TEMP, 0xE1, 1), src(2, dxshd.D3DSPR_CONST))
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_OUTPUT), src(1, dxshd.D3DSPR_TEMP))
+	return vertex_program(t)
+
+def constant_inputs(count=4):
+	inputs = {'v0': numpy.arange(count * 4, dtype=numpy.float32).reshape(count, 4)}
+	for register in range(256):
+		inputs['c%d' % register] = (register + 1.0, register * 0.5, -2.0, register % 7)
+	for register in range(16):
+		inputs['i%d' % register] = (3, 0, 1, 0)
+		inputs['b%d' % register] = register % 2 == 1
+	inputs['v1'] = numpy.ones((count, 4), numpy.float32)
+	return inputs
+
+@unittest.skipIf(numpy is None, "needs numpy")
+class OptimizerEquivalenceTest(unittest.TestCase):
+	def run_both(self, bytecode, inputs=None):
+		"""Outputs of the program and of its optimized form, which must match, and the optimize() report"""
+		if inputs is None:
+			inputs = constant_inputs()
+		program = dxshd.decode(bytecode)
+		optimized, report = dxshd.optimize(program)
+		before = dxshd.Interpreter(program).run(inputs)
+		after = dxshd.Interpreter(optimized).run(inputs)
+		self.assertEqual(sorted(before), sorted(after))
+		for name in before:
+			numpy.testing.assert_allclose(before[name], after[name], 1e-6, 0, True, name)
+		return before, optimized, report
+	def test_product_partly_overwritten_before_the_add(self):
+		before, optimized, report = self.run_both(partly_overwritten_product())
+		self.assertEqual(report['passes']['mads'], 0)
+		self.assertEqual(list(before['o0'][0, :2]), [7.0, 1.0])
+	def test_factor_overwritten_before_the_add(self):
+		before, optimized, report = self.run_both(overwritten_factor())
+		self.assertEqual(report['passes']['mads'], 0)
+	def test_fused_mad(self):
+		before, optimized, report = self.run_both(fusable_product())
+		self.assertEqual(report['passes']['mads'], 1)
+		self.assertTrue(dxshd.D3DSIO_MAD in [instruction.token.op for instruction in optimized.instructions])
+	def test_synthetic_shaders(self):
+		for blocks in range(1, 5):
+			self.run_both(shadergen.vertex_shader(blocks))
+
+if __name__ == "__main__":
+	unittest.main()
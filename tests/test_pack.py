@@ -0,0 +1,62 @@
+# Shader pack scanning: version tokens that start junk rather than a shader are skipped
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import pack
+import shadergen
+import dxshd
+
+def scanned(buffer):
+	return [(offset, program.to_text()) for offset, program in dxshd.scan_pack(buffer)]
+
+class ScanPackTest(unittest.TestCase):
+	def setUp(self):
+		self.shaders = [shadergen.vertex_shader(2), shadergen.pixel_shader(2)]
+	def expected(self, prefix):
+		offsets = [len(prefix), len(prefix) + len(self.shaders[0])]
+		return [(offset, dxshd.decode(bytecode).to_text()) for offset, bytecode in zip(offsets, self.shaders)]
+	def test_version_token_ahead_of_a_shader(self):
+		prefix = pack([0xFFFE0200, 0x00000001])
+		self.assertEqual(scanned(prefix + b''.join(self.shaders)), self.expected(prefix))
+	def test_junk_candidates(self):
+		# A dcl running off the end of its length, an instruction with an unknown opcode,
+		# a relative source whose address token is the real shader's version token, and a def cut short
+		junk = [
+			[0xFFFF0200, dxshd.D3DSIO_DCL | (1 << 24)],
+			[0xFFFE0300, 0x1234 | (1 << 24)],
+			[0xFFFE0200, dxshd.D3DSIO_MOV | (2 << 24), 0x80000000, 0x80002000],
+			[0xFFFE0200, dxshd.D3DSIO_DEF | (5 << 24), 0x80000000]
+		]
+		for tokens in junk:
+			prefix = pack(tokens)
+			self.assertEqual(scanned(prefix + b''.join(self.shaders)), self.expected(prefix), tokens)
+	def test_disassemble_pack(self):
+		prefix = pack([0xFFFE0200, 0x00000001])
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'shaders.pak')
+			packFile = open(path, 'wb')
+			packFile.write(prefix + b''.join(self.shaders) + pack([0xFFFE0200]))
+			packFile.close()
+			out = StringIO()
+			self.assertEqual(dxshd.disassemble_pack(path, out=out), 2)
+		finally:
+			shutil.rmtree(directory, True)
+		self.assertEqual(out.getvalue().count('; Shader at 0x'), 2)
+		self.assertTrue('; Shader at 0x8\n' in out.getvalue())
+
+if __name__ == "__main__":
+	unittest.main()
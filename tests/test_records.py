@@ -0,0 +1,94 @@
+# JSON Lines and MessagePack instruction records
+# Usage: python -m unittest discover tests
+
+import io
+import os
+import sys
+import json
+import unittest
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from shadergen import dst, src, inst, pack, float_token
+import dxshd
+
+def vertex_shader():
+	"""vs_3_0 with def/defi/defb literals, a predicated write and a0 relative source"""
+	t = [0xFFFE0300]
+	t += inst(dxshd.D3DSIO_DCL, 0x80000000 | dxshd.D3DDECLUSAGE_POSITION, dst(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_DEF, dst(3, dxshd.D3DSPR_CONST), float_token(1.5), float_token(-2.0), float_token(0.25), float_token(8.0))
+	t += inst(dxshd.D3DSIO_DEFI, dst(1, dxshd.D3DSPR_CONSTINT), 3, 0xFFFFFFFF, 2, 0)
+	t += inst(dxshd.D3DSIO_DEFB, dst(2, dxshd.D3DSPR_CONSTBOOL), 1)
+	t += inst(dxshd.D3DSIO_MOVA, dst(0, dxshd.D3DSPR_ADDR, 0x3), src(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_SETP, dst(0, dxshd.D3DSPR_PREDICATE, 0x1), src(0, dxshd.D3DSPR_INPUT), src(3, dxshd.D3DSPR_CONST), flags=1)
+	t += inst(dxshd.D3DSIO_ADD, dst(1, dxshd.D3DSPR_TEMP, 0x3, 1), src(0, dxshd.D3DSPR_PREDICATE, 0x00),
+		src(0, dxshd.D3DSPR_INPUT, 0x1B, 1), src(4, dxshd.D3DSPR_CONST, 0xE4, 0, 1), src(0, dxshd.D3DSPR_ADDR, 0x55), predicated=1)
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def coissued_pixel_shader():
+	"""ps_1_1 with an add co-issued with the mov before it"""
+	t = [0xFFFF0101]
+	t += inst(dxshd.D3DSIO_MOV, dst(0, dxshd.D3DSPR_TEMP, 0x7), src(0, dxshd.D3DSPR_INPUT))
+	t += inst(dxshd.D3DSIO_ADD, dst(0, dxshd.D3DSPR_TEMP, 0x8), src(0, dxshd.D3DSPR_INPUT), src(1, dxshd.D3DSPR_INPUT))
+	t[-4] |= 1 << 30
+	t += [dxshd.D3DSIO_END]
+	return pack(t)
+
+def jsonl_records(bytecode):
+	out = StringIO()
+	dxshd.write_records(bytecode, out, 'jsonl')
+	return [json.loads(line) for line in out.getvalue().splitlines()]
+
+class JsonLinesTest(unittest.TestCase):
+	def setUp(self):
+		self.records = jsonl_records(vertex_shader())
+	def test_header_and_instruction_records(self):
+		self.assertEqual(self.records[0], {'shader': 0, 'version': 'vs_3_0'})
+		self.assertEqual([record['mnemonic'] for record in self.records[1:]], ['dcl', 'def', 'defi', 'defb', 'mova', 'setp', 'add', 'end'])
+		self.assertEqual([record['offset'] for record in self.records[1:3]], [4, 16])
+		self.assertEqual(self.records[2]['op'], dxshd.D3DSIO_DEF)
+	def test_literals(self):
+		self.assertEqual(self.records[2]['values'], [1.5, -2.0, 0.25, 8.0])
+		self.assertEqual(self.records[3]['values'], [3, -1, 2, 0])
+		self.assertEqual(self.records[4]['values'], [True])
+	def test_predicated_instruction_operands(self):
+		add = self.records[7]
+		self.assertEqual(add['offset'], 0x68)
+		self.assertTrue(add['predicated'])
+		self.assertFalse(add['coissue'])
+		self.assertEqual(add['predicate']['name'], 'p0')
+		self.assertEqual(add['dst'], {'type': dxshd.D3DSPR_TEMP, 'register': 1, 'name': 'r1', 'write_mask': 0x3,
+			'modifiers': 1, 'shift': 0, 'relative': None})
+		first, second = add['srcs']
+		self.assertEqual((first['name'], first['swizzle'], first['modifier'], first['relative']), ('v0', 0x1B, 1, None))
+		self.assertEqual((second['name'], second['swizzle'], second['modifier']), ('c4', 0xE4, 0))
+		self.assertEqual((second['relative']['name'], second['relative']['swizzle']), ('a0', 0x55))
+	def test_setp_flags(self):
+		self.assertEqual(self.records[6]['flags'], 1)
+	def test_coissue(self):
+		records = jsonl_records(coissued_pixel_shader())
+		self.assertEqual([record['coissue'] for record in records[1:]], [False, True, False])
+	def test_program_records_match_streamed_records(self):
+		out = StringIO()
+		writer = dxshd.RecordWriter(out, 'jsonl', 16)
+		writer.add_program(dxshd.decode(vertex_shader()))
+		writer.flush()
+		self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], self.records)
+
+@unittest.skipIf(dxshd.msgpack is None, "needs msgpack")
+class MessagePackTest(unittest.TestCase):
+	def test_round_trip(self):
+		bytecode = vertex_shader()
+		out = io.BytesIO()
+		dxshd.write_records(bytecode, out, 'msgpack')
+		unpacker = dxshd.msgpack.Unpacker(io.BytesIO(out.getvalue()), raw=False)
+		self.assertEqual(list(unpacker), jsonl_records(bytecode))
+
+if __name__ == "__main__":
+	unittest.main()